@@ -4,15 +4,25 @@ import json
 import time
 import pandas as pd
 import glob
-import matplotlib.pyplot as plt 
-import numpy as np
-import streamlit as st
+import os
 from PIL import Image
-from utils import generate_course_outline, generate_lecture_content, recommend_resources
+from utils import generate_course_outline, recommend_resources
+from utils import get_pool_stats, get_cache_stats
+from utils import get_scheduler_stats, get_single_flight_stats
+from utils import get_circuit_breaker_stats, get_token_usage_stats
+from utils import get_llm_backend, PRIORITY_NORMAL, PRIORITY_BULK
+import metrics
+from jobs import get_job_manager, get_job_stats, JOB_QUEUED, JOB_DONE, JOB_CANCELLED, ACTIVE_STATUSES
+from storage import get_storage, get_storage_stats, LazyCourseMap, new_course_id, maybe_evict_idle_sessions
 from utils import generate_mock_course_outline, generate_mock_lecture_content, recommend_mock_resources
 from utils import update_lecture_content, save_survey_result, load_survey_results
-from utils import save_lecture_to_word, save_lecture_to_ppt  
+from utils import save_lecture_to_word, save_lecture_to_ppt, get_ppt_templates, get_ppt_template_stats
+from course_export import export_course
+from markdown_ast import get_parse_cache_stats
 import re  # 新增导入
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from config import JOB_POLL_INTERVAL, PPT_TEMPLATE_DIR
 
 # 在导入后立即定义辅助函数
 def _format_resource_item(item):
@@ -288,25 +298,97 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+# 例题的特殊样式
+st.markdown("""
+<style>
+    /* 新增：例题样式 */
+    .example-container {
+        background-color: #f8f9fa;
+        border-left: 4px solid #28a745;
+        padding: 15px;
+        margin: 10px 0;
+        border-radius: 5px;
+    }
+    
+    .example-question {
+        font-weight: bold;
+        color: #2c3e50;
+        margin-bottom: 8px;
+    }
+    
+    .example-answer {
+        color: #34495e;
+        background-color: #ecf0f1;
+        padding: 10px;
+        border-radius: 3px;
+        margin-top: 5px;
+    }
+    
+    /* 确保Markdown列表正确显示 */
+    .example-list {
+        list-style-type: decimal;
+        padding-left: 20px;
+    }
+    
+    .example-list li {
+        margin-bottom: 15px;
+        padding: 10px;
+        background-color: white;
+        border-radius: 5px;
+        border: 1px solid #e9ecef;
+    }
+</style>
+""", unsafe_allow_html=True)
+
+# 课程数据按课程ID持久化，以下会话字段随课程保存和恢复
+COURSE_STATE_KEYS = ("course_info", "course_outline", "resources", "policy_content", "policy_requirements")
+
+def bind_course(course_id, stored=None):
+    """把会话绑定到课程：讲义和修改对话按需从存储中加载、写入时保存，课程ID写入URL"""
+    storage = get_storage()
+    st.session_state.course_id = course_id
+    st.session_state.generated_lectures = LazyCourseMap(storage, course_id, "lecture")
+    st.session_state.conversation_history = LazyCourseMap(storage, course_id, "conversation")
+    st.session_state.lecture_generation_status = {key: True for key in st.session_state.generated_lectures}
+    st.query_params["course"] = course_id
+    if stored:
+        for key in COURSE_STATE_KEYS:
+            if key in stored:
+                st.session_state[key] = stored[key]
+        if stored.get("course_outline"):
+            st.session_state.current_step = "complete"
+
+def save_course_state():
+    """保存课程基本信息（大纲、资源、政策要求等），讲义和修改对话在写入时已单独保存"""
+    get_storage().save_course(
+        st.session_state.course_id,
+        {key: st.session_state.get(key) for key in COURSE_STATE_KEYS}
+    )
+
 # 初始化session状态变量 - 修复：确保讲义内容持久化
+# 按URL中的课程ID恢复课程、讲义和修改对话，没有时新建课程
+if "course_id" not in st.session_state:
+    course_id = st.query_params.get("course")
+    bind_course(course_id or new_course_id(), get_storage().load_course(course_id) if course_id else None)
+maybe_evict_idle_sessions()
+# 进程启动后在后台解析PPT模板，首次导出时不再等待解析
+get_ppt_templates().preload_in_background()
+
 if "course_outline" not in st.session_state:
     st.session_state.course_outline = None
     
 if "resources" not in st.session_state:
     st.session_state.resources = None
     
-if "generated_lectures" not in st.session_state:
-    st.session_state.generated_lectures = {}
-    
 if "api_error" not in st.session_state:
     st.session_state.api_error = None
     
 if "use_fallback" not in st.session_state:
     st.session_state.use_fallback = False
 
-# 新增：多轮对话状态
-if "conversation_history" not in st.session_state:
-    st.session_state.conversation_history = {}
+# 讲义生成/修改后触发页面重新运行的时间点，用于统计重新运行和渲染耗时
+if "pending_render" not in st.session_state:
+    st.session_state.pending_render = {}
 
 # 新增：引导流程状态
 if "current_step" not in st.session_state:
@@ -350,6 +432,24 @@ if "current_lecture_for_ppt" not in st.session_state:
 if "lecture_generation_status" not in st.session_state:
     st.session_state.lecture_generation_status = {}  # 记录每个章节的生成状态
 
+# 新增：会话标识，用于按用户区分后台任务；写入URL，刷新页面后仍是同一个标识
+if "tenant_id" not in st.session_state:
+    st.session_state.tenant_id = st.query_params.get("tenant") or uuid.uuid4().hex
+    st.query_params["tenant"] = st.session_state.tenant_id
+
+# 后台讲义生成任务：章节键 -> 任务ID；新会话（如刷新页面）按标识找回当前课程的任务
+# 已保存的讲义可能已经过修改，只找回未结束的任务和尚未保存结果的任务
+if "lecture_jobs" not in st.session_state:
+    st.session_state.lecture_jobs = {}
+    for job in get_job_manager().jobs_for_tenant(st.session_state.tenant_id):
+        if job["kind"] != "lecture" or not job["key"] or job["params"].get("course_id") != st.session_state.course_id:
+            continue
+        lecture_key = job["key"].split("/", 1)[-1]
+        if job["status"] in ACTIVE_STATUSES or lecture_key not in st.session_state.generated_lectures:
+            st.session_state.lecture_jobs[lecture_key] = job["job_id"]
+    # 当前这批任务的总章节数，用于显示批量生成进度（已结束的任务取回后会从 lecture_jobs 中移除）
+    st.session_state.lecture_batch_total = len(st.session_state.lecture_jobs)
+
 # 新增：政策文件状态
 if "policy_file" not in st.session_state:
     st.session_state.policy_file = None
@@ -660,8 +760,8 @@ def show_ppt_template_selection():
     st.markdown(f"**正在为章节生成PPT:** {st.session_state.current_chapter_for_ppt}")
     
     # 获取模板文件夹中的所有模板
-    template_files = glob.glob("templates/*.pptx")
-    template_images = glob.glob("templates/*.png") + glob.glob("templates/*.jpg")
+    template_files = get_ppt_templates().list_templates()
+    template_images = glob.glob(f"{PPT_TEMPLATE_DIR}/*.png") + glob.glob(f"{PPT_TEMPLATE_DIR}/*.jpg")
     
     if not template_files:
         st.error("未找到任何PPT模板文件！请在templates文件夹中放置.pptx模板文件")
@@ -677,7 +777,7 @@ def show_ppt_template_selection():
     cols = st.columns(3)
     for i, template_file in enumerate(template_files):
         col_idx = i % 3
-        template_name = template_file.split("/")[-1].replace(".pptx", "")
+        template_name = os.path.splitext(os.path.basename(template_file))[0]
         
         with cols[col_idx]:
             # 查找对应的预览图
@@ -1002,6 +1102,12 @@ def show_course_info_collection():
             if not course_name:
                 st.error("请输入课程名称")
             else:
+                # 换了一门课程时新建课程记录，之前课程的讲义仍可通过原链接访问
+                if st.session_state.course_outline and st.session_state.course_info.get("name") != course_name:
+                    bind_course(new_course_id())
+                    st.session_state.lecture_jobs = {}
+                    st.session_state.lecture_batch_total = 0
+                
                 # 保存课程信息（新增教育阶段和生成语言）
                 st.session_state.course_info = {
                     "name": course_name,
@@ -1012,43 +1118,48 @@ def show_course_info_collection():
                     "policy_requirements": st.session_state.policy_requirements  # 保存政策要求
                 }
                 
-                # 生成课程大纲（传入教育阶段信息和政策要求）
-                with st.spinner("正在生成课程大纲..."):
+                # 课程大纲和教学资源互不依赖，同时发起两个请求再一起等待结果
+                with st.spinner("正在生成课程大纲并推荐教学资源..."):
                     if st.session_state.use_fallback:
                         outline = generate_mock_course_outline(course_name, objectives, hours, education_stage, st.session_state.policy_requirements)
-                        st.session_state.course_outline = outline
+                        resources = recommend_mock_resources(course_name, education_stage)
                         st.session_state.api_error = None
                     else:
-                        outline = generate_course_outline(course_name, objectives, hours, education_stage, st.session_state.policy_requirements)
+                        with ThreadPoolExecutor(max_workers=2) as executor:
+                            # 生成课程大纲（传入教育阶段信息和政策要求）
+                            outline_future = executor.submit(
+                                generate_course_outline, course_name, objectives, hours, education_stage, st.session_state.policy_requirements
+                            )
+                            # 生成教学资源（传入教育阶段信息）
+                            resources_future = executor.submit(recommend_resources, course_name, education_stage)
+                            
+                            try:
+                                outline = outline_future.result()
+                            except Exception as e:
+                                outline = {"error": f"生成课程大纲时出错: {e}"}
+                            try:
+                                resources = resources_future.result()
+                            except Exception as e:
+                                st.error(f"生成教学资源时出错: {e}")
+                                resources = None
                         
+                        # 两个结果分别判断，失败的一项单独使用备用方案
                         if isinstance(outline, dict) and "error" in outline:
                             st.session_state.api_error = outline["error"]
                             st.error("生成课程大纲失败，正在使用备用方案...")
                             outline = generate_mock_course_outline(course_name, objectives, hours, education_stage, st.session_state.policy_requirements)
-                            st.session_state.course_outline = outline
                         else:
-                            st.session_state.course_outline = outline
                             st.session_state.api_error = None
-
-                # 生成教学资源（传入教育阶段信息）
-                with st.spinner("正在推荐教学资源..."):
-                    try:
-                        if st.session_state.use_fallback:
+                        
+                        if resources is None:
                             resources = recommend_mock_resources(course_name, education_stage)
-                            st.session_state.resources = resources
-                        else:
-                            resources = recommend_resources(course_name, education_stage)
-                            
-                            if isinstance(resources, dict) and "error" in resources:
-                                st.warning("推荐教学资源失败，正在使用备用方案...")
-                                resources = recommend_mock_resources(course_name, education_stage)
-                                st.session_state.resources = resources
-                            else:
-                                st.session_state.resources = resources
-                    except Exception as e:
-                        st.error(f"生成教学资源时出错: {e}")
-                        resources = recommend_mock_resources(course_name, education_stage)
-                        st.session_state.resources = resources
+                        elif isinstance(resources, dict) and "error" in resources:
+                            st.warning("推荐教学资源失败，正在使用备用方案...")
+                            resources = recommend_mock_resources(course_name, education_stage)
+                    
+                    st.session_state.course_outline = outline
+                    st.session_state.resources = resources
+                    save_course_state()
                 
                 st.session_state.current_step = "complete"
                 st.rerun()
@@ -1058,48 +1169,173 @@ def show_course_info_collection():
             st.session_state.current_step = "welcome"
             st.rerun()
 
-# 生成讲义内容，带有自动降级策略
-def generate_lecture_with_fallback(chapter_name, key_points, hours, education_stage="小学", generation_language="中文", policy_requirements=""):
-    """生成讲义内容，带有自动降级策略"""
-    # 如果API错误次数过多，自动使用备用方案
-    if st.session_state.api_status["error_count"] > 3:
-        st.warning("API错误次数过多，自动切换到备用方案")
-        return generate_mock_lecture_content(chapter_name, key_points, hours, education_stage, generation_language, policy_requirements)
+# 提交后台讲义生成任务
+def submit_lecture_job(chapter, priority=PRIORITY_NORMAL):
+    """把章节讲义的生成交给后台任务，页面重新运行或切换标签页不会中断生成
     
-    try:
-        response = generate_lecture_content(chapter_name, key_points, hours, education_stage, generation_language, policy_requirements)
+    重试、熔断和备用方案都在任务中处理，页面只负责轮询状态和取回结果。
+    """
+    course_info = st.session_state.course_info
+    lecture_key = get_chapter_key(chapter["章节名称"])
+    params = {
+        "chapter_name": chapter["章节名称"],
+        "key_points": chapter.get("重点内容", ""),
+        "hours": chapter["学时"],
+        "education_stage": course_info["education_stage"],
+        "generation_language": course_info["generation_language"],
+        "policy_requirements": course_info.get("policy_requirements", ""),  # 新增政策要求参数
+        "priority": priority,
+        "course_id": st.session_state.course_id
+    }
+    if not st.session_state.lecture_jobs:
+        # 没有未取回的任务时开始新的一批，进度从零计数
+        st.session_state.lecture_batch_total = 0
+    if lecture_key not in st.session_state.lecture_jobs:
+        st.session_state.lecture_batch_total += 1
+    # 任务key带上课程ID：同一租户的不同课程可能有同名章节，不能合并为一个任务
+    st.session_state.lecture_jobs[lecture_key] = get_job_manager().submit(
+        "lecture", params, tenant_id=st.session_state.tenant_id,
+        key=f"{st.session_state.course_id}/{lecture_key}", priority=priority
+    )
+
+# 取回已结束的后台讲义任务
+def collect_lecture_jobs():
+    """把已完成任务的讲义写入 generated_lectures，返回仍在排队或生成中的任务数"""
+    manager = get_job_manager()
+    active = 0
+    for lecture_key, job_id in list(st.session_state.lecture_jobs.items()):
+        job = manager.get(job_id)
+        if job is not None and job["status"] in ACTIVE_STATUSES:
+            active += 1
+            continue
+        del st.session_state.lecture_jobs[lecture_key]
+        if job is None or job["status"] == JOB_CANCELLED:
+            continue
         
-        if isinstance(response, dict) and "error" in response:
-            # 更新API状态
-            st.session_state.api_status["error_count"] += 1
-            st.session_state.api_status["last_error"] = response["error"]
-            
-            # 如果错误次数超过阈值，使用备用方案
-            if st.session_state.api_status["error_count"] > 2:
-                st.warning("API调用失败，使用备用方案")
-                return generate_mock_lecture_content(chapter_name, key_points, hours, education_stage, generation_language, policy_requirements)
+        if job["status"] == JOB_DONE:
+            st.session_state.generated_lectures[lecture_key] = job["result"]
+            st.session_state.lecture_generation_status[lecture_key] = True
+            if job["fallback"]:
+                # 更新API状态
+                st.session_state.api_status["error_count"] += 1
+                st.session_state.api_status["last_error"] = job["error"]
+                st.toast(f"{job['params']['chapter_name']}：API调用失败，已使用备用方案生成讲义")
             else:
-                # 重试
-                st.warning("API调用失败，正在重试...")
-                time.sleep(1)
-                return generate_lecture_with_fallback(chapter_name, key_points, hours, education_stage, generation_language, policy_requirements)
+                # 重置错误计数
+                st.session_state.api_status["error_count"] = 0
+                st.session_state.api_status["last_success"] = job["updated"]
         else:
-            # 重置错误计数
-            st.session_state.api_status["error_count"] = 0
-            st.session_state.api_status["last_success"] = time.time()
-            return response
-            
-    except Exception as e:
-        st.session_state.api_status["error_count"] += 1
-        st.session_state.api_status["last_error"] = str(e)
+            st.session_state.api_status["last_error"] = job["error"]
+            st.toast(f"{job['params']['chapter_name']} 讲义生成未完成：{job['error']}，请重新生成")
+    return active
+
+# 批量生成进度，有未取回的任务时定时刷新
+@st.fragment(run_every=JOB_POLL_INTERVAL)
+def render_lecture_progress():
+    """显示本批任务中已结束的章节数/总数；有任务结束时重新运行整个页面取回结果"""
+    manager = get_job_manager()
+    jobs = [manager.get(job_id) for job_id in st.session_state.lecture_jobs.values()]
+    active = sum(1 for job in jobs if job is not None and job["status"] in ACTIVE_STATUSES)
+    if active < len(jobs):
+        st.rerun()
+    total = max(st.session_state.lecture_batch_total, len(jobs))
+    finished = total - active
+    st.progress(finished / total if total else 1.0,
+                text=f"讲义生成进度：{finished}/{total} 章，可以继续浏览其他内容，完成后会自动显示")
+
+# 显示进行中的后台讲义任务，定时刷新流式生成的部分内容
+@st.fragment(run_every=JOB_POLL_INTERVAL)
+def render_lecture_job(lecture_key, job_id):
+    """显示任务状态，流式生成时显示已生成的部分内容；任务结束后重新运行整个页面显示结果"""
+    job = get_job_manager().get(job_id)
+    if job is None or job["status"] not in ACTIVE_STATUSES:
+        st.rerun()
+    if job["status"] == JOB_QUEUED:
+        st.info("讲义生成任务排队中，可以继续浏览其他内容，完成后会自动显示")
+    elif job["partial"]:
+        st.markdown("### 讲义内容")
+        with metrics.span("render"):
+            st.markdown(job["partial"] + "▌")
+    else:
+        st.info("正在生成讲义，完成后会自动显示...")
+    if st.button("取消生成", key=f"cancel_{lecture_key}"):
+        get_job_manager().cancel(job_id)
+        st.rerun()
+
+# 渲染讲义，并统计生成/修改讲义后页面重新运行到讲义显示出来的耗时
+def render_lecture_markdown(lecture_key, body, **markdown_kwargs):
+    rerun_started = st.session_state.pending_render.pop(lecture_key, None)
+    if rerun_started is None:
+        st.markdown(body, **markdown_kwargs)
+        return
+    trace = metrics.RequestTrace("lecture_display")
+    trace.add_span("rerun", time.perf_counter() - rerun_started)
+    with trace.span("render"):
+        st.markdown(body, **markdown_kwargs)
+    trace.finish()
+
+# 并行生成全部章节讲义
+def generate_all_lectures(chapters):
+    """为尚未生成、也没有进行中任务的章节提交后台任务，完成一章显示一章"""
+    pending = [chapter for chapter in chapters
+               if not st.session_state.generated_lectures.get(get_chapter_key(chapter["章节名称"]))
+               and get_chapter_key(chapter["章节名称"]) not in st.session_state.lecture_jobs]
+    if not pending:
+        st.info("所有章节的讲义都已生成或正在生成")
+        return
+    
+    for chapter in pending:
+        # 批量生成让位于交互式请求
+        submit_lecture_job(chapter, priority=PRIORITY_BULK)
+    st.rerun()
+
+# 整门课程导出
+COURSE_EXPORT_OPTIONS = {
+    "Word合并文档（含目录）": ("word", "merged"),
+    "Word文件打包（ZIP，每章一个文件）": ("word", "zip"),
+    "PPT文件打包（ZIP，每章一个文件）": ("ppt", "zip")
+}
+
+def render_course_export(chapters):
+    """按章节顺序导出全部已生成的讲义，各章文档在进程池中并行生成"""
+    exported = []
+    for chapter in chapters:
+        content = st.session_state.generated_lectures.get(get_chapter_key(chapter["章节名称"]))
+        if content:
+            exported.append((chapter["章节名称"], content))
+    if not exported:
+        return
+    
+    with st.expander(f"导出整门课程（已生成 {len(exported)}/{len(chapters)} 章讲义）", icon="📦"):
+        option = st.selectbox("导出方式", list(COURSE_EXPORT_OPTIONS), key="course_export_option")
+        fmt, layout = COURSE_EXPORT_OPTIONS[option]
+        template_path = None
+        if fmt == "ppt":
+            templates = get_ppt_templates().list_templates()
+            template_names = ["默认样式"] + [os.path.splitext(os.path.basename(path))[0] for path in templates]
+            choice = st.selectbox("PPT模板", template_names, key="course_export_template")
+            if choice != "默认样式":
+                template_path = templates[template_names.index(choice) - 1]
         
-        if st.session_state.api_status["error_count"] > 2:
-            st.warning("API调用异常，使用备用方案")
-            return generate_mock_lecture_content(chapter_name, key_points, hours, education_stage, generation_language, policy_requirements)
-        else:
-            st.warning("API调用异常，正在重试...")
-            time.sleep(1)
-            return generate_lecture_with_fallback(chapter_name, key_points, hours, education_stage, generation_language, policy_requirements)
+        if st.button("导出全部讲义", key="course_export", use_container_width=True):
+            course_name = st.session_state.course_outline.get("课程名称") or st.session_state.course_info.get("name") or "课程讲义"
+            with st.spinner(f"正在导出 {len(exported)} 章讲义..."):
+                file_stream, filename, failed = export_course(course_name, exported, fmt, layout, template_path)
+            if file_stream:
+                if failed:
+                    st.warning(f"以下章节导出失败：{'、'.join(failed)}")
+                else:
+                    st.success("导出完成！")
+                st.download_button(
+                    label=f"下载 {filename}",
+                    data=file_stream,
+                    file_name=filename,
+                    mime="application/zip" if filename.endswith(".zip") else "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+                    key="download_course_export",
+                    use_container_width=True
+                )
+            else:
+                st.error("导出失败")
 
 # 加粗显示修改的内容
 def highlight_modified_content(old_content, new_content):
@@ -1176,13 +1412,14 @@ def main_content():
         st.markdown(f'<div class="highlight">{st.session_state.course_info["objectives"]}</div>', unsafe_allow_html=True)
         
         # 显示API密钥状态
-        from config import DEEPSEEK_API_KEY
-        if not DEEPSEEK_API_KEY or DEEPSEEK_API_KEY == "你的API密钥":
-            st.markdown('<div class="warning-box">⚠️ 未设置DeepSeek API密钥</div>', unsafe_allow_html=True)
-            st.info("请在.env文件中设置DEEPSEEK_API_KEY")
+        backend = get_llm_backend()
+        if not backend.is_configured():
+            st.markdown(f'<div class="warning-box">⚠️ {backend.config_error()["error"]}</div>', unsafe_allow_html=True)
             st.session_state.use_fallback = True
-        else:
+        elif backend.name == "deepseek":
             st.markdown('<div class="success-box">✅ DeepSeek API密钥已设置</div>', unsafe_allow_html=True)
+        else:
+            st.markdown(f'<div class="success-box">✅ 使用{backend.description}: {backend.url}</div>', unsafe_allow_html=True)
         
         # 添加网络诊断功能
         st.markdown('<div class="sub-header">网络诊断</div>', unsafe_allow_html=True)
@@ -1198,6 +1435,38 @@ def main_content():
             except:
                 st.markdown('<div class="error-box">❌ 基本网络连接异常</div>', unsafe_allow_html=True)
         
+        if st.button("连接池状态", help="查看共享HTTP连接池的连接复用情况"):
+            st.json(get_pool_stats())
+        
+        if st.button("缓存命中情况", help="查看LLM响应缓存的命中统计"):
+            st.json({"LLM响应缓存": get_cache_stats(), "课程数据": get_storage_stats(), "PPT模板": get_ppt_template_stats(), "讲义解析": get_parse_cache_stats()})
+        
+        if st.button("Token用量", help="查看累计的提示词和生成token数"):
+            st.json(get_token_usage_stats())
+        
+        if st.button("请求队列状态", help="查看API请求调度器的排队深度和等待时间"):
+            st.json({
+                "调度器": get_scheduler_stats(),
+                "相同请求合并": get_single_flight_stats(),
+                "熔断器": get_circuit_breaker_stats(),
+                "后台任务": get_job_stats()
+            })
+        
+        if st.button("请求耗时", help="查看最近请求在提示词构建、网络、解析和渲染各阶段的耗时"):
+            recent = metrics.get_recent_requests(20)
+            if recent:
+                rows = []
+                for record in recent:
+                    row = {"时间": record["started"], "操作": record["kind"], "结果": record["status"], "总耗时(ms)": record["total_ms"]}
+                    for name in metrics.SPAN_NAMES:
+                        row[name] = record["spans_ms"].get(name)
+                    rows.append(row)
+                st.dataframe(pd.DataFrame(rows), hide_index=True, use_container_width=True)
+                with st.expander("Prometheus 指标"):
+                    st.code(metrics.render_prometheus(), language="text")
+            else:
+                st.info("暂无请求记录")
+        
         # 添加快速导航区域
         st.markdown('<div class="sub-header">快速导航</div>', unsafe_allow_html=True)
         
@@ -1266,6 +1535,13 @@ def main_content():
             if "章节列表" in st.session_state.course_outline:
                 st.markdown('<div class="sub-header">章节安排</div>', unsafe_allow_html=True)
                 
+                # 一键并行生成所有章节的讲义
+                if st.button("生成全部讲义", key="gen_all_lectures", help="并行生成所有尚未生成的章节讲义"):
+                    generate_all_lectures(st.session_state.course_outline["章节列表"])
+                if st.session_state.lecture_jobs:
+                    render_lecture_progress()
+                render_course_export(st.session_state.course_outline["章节列表"])
+                
                 for i, chapter in enumerate(st.session_state.course_outline["章节列表"]):
                     # 使用章节名称生成唯一的键，而不是索引，确保讲义内容持久化
                     lecture_key = get_chapter_key(chapter['章节名称'])
@@ -1274,29 +1550,18 @@ def main_content():
                         st.markdown(f'<div class="chapter-card">', unsafe_allow_html=True)
                         st.write("**重点内容:**", chapter.get("重点内容", "暂无"))
                         
-                        # 为每个章节添加生成讲义的按钮
-                        if st.button(f"生成{chapter['章节名称']}讲义", key=f"gen_{lecture_key}", help="生成该章节的详细讲义内容"):
-                            with st.spinner(f"正在生成{chapter['章节名称']}讲义..."):
-                                # 使用带降级策略的函数，传入教育阶段、生成语言和政策要求
-                                content = generate_lecture_with_fallback(
-                                    chapter["章节名称"],
-                                    chapter.get("重点内容", ""),
-                                    chapter["学时"],
-                                    st.session_state.course_info["education_stage"],
-                                    st.session_state.course_info["generation_language"],
-                                    st.session_state.course_info.get("policy_requirements", "")  # 新增政策要求参数
-                                )
-                                # 修复：确保讲义内容正确保存到session_state
-                                st.session_state.generated_lectures[lecture_key] = content
-                                # 同时记录生成状态
-                                st.session_state.lecture_generation_status[lecture_key] = True
-                                st.markdown('<div class="success-box">讲义生成完成！</div>', unsafe_allow_html=True)
-                                st.rerun()  # 立即刷新显示生成的讲义
+                        # 为每个章节添加生成讲义的按钮；生成在后台任务中进行，页面重新运行不会中断
+                        job_id = st.session_state.lecture_jobs.get(lecture_key)
+                        if job_id:
+                            render_lecture_job(lecture_key, job_id)
+                        elif st.button(f"生成{chapter['章节名称']}讲义", key=f"gen_{lecture_key}", help="生成该章节的详细讲义内容"):
+                            submit_lecture_job(chapter)
+                            st.rerun()  # 立即显示任务状态
                         
                         # 显示已生成的讲义 - 修复：检查讲义是否存在且不为空
-                        if lecture_key in st.session_state.generated_lectures and st.session_state.generated_lectures[lecture_key]:
+                        if not job_id and lecture_key in st.session_state.generated_lectures and st.session_state.generated_lectures[lecture_key]:
                             st.markdown("### 讲义内容")
-                            st.markdown(st.session_state.generated_lectures[lecture_key])
+                            render_lecture_markdown(lecture_key, st.session_state.generated_lectures[lecture_key])
                             
                             # 添加下载Word文档按钮
                             if st.button(f"导出Word文档", key=f"export_{lecture_key}"):
@@ -1421,6 +1686,7 @@ def main_content():
                                 resources = recommend_mock_resources(st.session_state.course_info["name"])
                         
                         st.session_state.resources = resources
+                        save_course_state()
                         st.success("教学资源已更新！")
                         st.rerun()
                     except Exception as e:
@@ -1443,7 +1709,7 @@ def main_content():
             # 显示当前讲义内容 - 修复：确保讲义内容存在
             if lecture_key in st.session_state.generated_lectures and st.session_state.generated_lectures[lecture_key]:
                 st.markdown("#### 当前讲义内容")
-                st.markdown(f'<div class="highlight">{st.session_state.generated_lectures[lecture_key]}</div>', unsafe_allow_html=True)
+                render_lecture_markdown(lecture_key, f'<div class="highlight">{st.session_state.generated_lectures[lecture_key]}</div>', unsafe_allow_html=True)
             else:
                 st.warning("该章节的讲义内容不存在，请先返回课程大纲页面生成讲义")
                 if st.button("返回课程大纲", use_container_width=True):
@@ -1517,6 +1783,8 @@ def main_content():
                                     st.session_state.conversation_history[lecture_key].append(
                                         ("assistant", f"更新失败: {updated_content['error']}")
                                     )
+                                    # 讲义保持不变
+                                    highlighted_content = old_content
                                 else:
                                     # 加粗显示修改的内容
                                     highlighted_content = highlight_modified_content(old_content, updated_content)
@@ -1526,11 +1794,15 @@ def main_content():
                                     )
                                     st.markdown('<div class="success-box">讲义已更新！</div>', unsafe_allow_html=True)
                         
+                        # 对话列表是原地追加的，需要显式保存；先于渲染保存，渲染出错时也不会丢失本轮对话
+                        st.session_state.conversation_history.save(lecture_key)
+                        
                         # 显示更新后的内容（带加粗）
                         st.markdown("#### 更新后的讲义内容")
                         st.markdown(f'<div class="highlight">{highlighted_content}</div>', unsafe_allow_html=True)
                         
                         # 清空输入框
+                        st.session_state.pending_render[lecture_key] = time.perf_counter()
                         st.rerun()
                     else:
                         st.warning("请输入修改要求")
@@ -1577,6 +1849,10 @@ def main_content():
 # 主程序逻辑
 def main():
     """主程序入口"""
+    # 先取回已完成的后台任务，本次运行即可显示结果；进行中的任务由章节列表中的进度条和任务状态定时刷新
+    if st.session_state.lecture_jobs:
+        collect_lecture_jobs()
+    
     # 根据当前页面状态显示不同内容
     if st.session_state.current_page == "survey":
         show_satisfaction_survey()
@@ -1625,47 +1901,3 @@ if st.session_state.current_page == "main" and st.session_state.current_step !=
 # 运行主程序
 if __name__ == "__main__":
     main()
-
-# 在 app.py 的 CSS 部分添加对例题的特殊样式处理
-    st.markdown("""
-<style>
-    /* 其他样式保持不变... */
-
-    /* 新增：例题样式 */
-    .example-container {
-        background-color: #f8f9fa;
-        border-left: 4px solid #28a745;
-        padding: 15px;
-        margin: 10px 0;
-        border-radius: 5px;
-    }
-    
-    .example-question {
-        font-weight: bold;
-        color: #2c3e50;
-        margin-bottom: 8px;
-    }
-    
-    .example-answer {
-        color: #34495e;
-        background-color: #ecf0f1;
-        padding: 10px;
-        border-radius: 3px;
-        margin-top: 5px;
-    }
-    
-    /* 确保Markdown列表正确显示 */
-    .example-list {
-        list-style-type: decimal;
-        padding-left: 20px;
-    }
-    
-    .example-list li {
-        margin-bottom: 15px;
-        padding: 10px;
-        background-color: white;
-        border-radius: 5px;
-        border: 1px solid #e9ecef;
-    }
-</style>
-""", unsafe_allow_html=True)
\ No newline at end of file
@@ -0,0 +1,106 @@
+"""对比新的单遍JSON提取与旧的正则链在典型大模型响应上的耗时
+
+用法：python benchmarks/bench_json_parse.py [重复次数]
+"""
+import json
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import extract_json_from_text
+
+
+def legacy_extract_json_from_text(text):
+    """旧实现：贪婪正则 -> ```json 切分 -> ``` 切分 -> 整体解析"""
+    json_match = re.search(r'(\{[\s\S]*\}|\[[\s\S]*\])', text)
+    if json_match:
+        try:
+            return json.loads(json_match.group(1))
+        except json.JSONDecodeError:
+            pass
+    if '```json' in text:
+        parts = text.split('```json')
+        if len(parts) > 1:
+            json_part = parts[1].split('```')[0].strip()
+            try:
+                return json.loads(json_part)
+            except json.JSONDecodeError:
+                pass
+    if '```' in text:
+        parts = text.split('```')
+        if len(parts) > 1:
+            json_part = parts[1].strip()
+            try:
+                return json.loads(json_part)
+            except json.JSONDecodeError:
+                pass
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        return {"error": "无法提取有效的JSON", "raw_text": text}
+
+
+def legacy_clean_json_response(text):
+    """旧实现：资源推荐响应解析前的额外清理"""
+    cleaned = text.replace('\\"', '"')
+    cleaned = cleaned.replace('\\n', ' ')
+    cleaned = cleaned.replace('\\t', ' ')
+    cleaned = re.sub(r'(\w+)\s*:\s*{', r'"\1": {', cleaned)
+    cleaned = re.sub(r',\s*}', '}', cleaned)
+    cleaned = re.sub(r',\s*]', ']', cleaned)
+    return cleaned
+
+
+def legacy_chain(text):
+    return legacy_extract_json_from_text(legacy_clean_json_response(text))
+
+
+def build_outline_response(chapters=12):
+    outline = {
+        "课程名称": "小学数学",
+        "课程目标": "掌握基础运算",
+        "总学时": chapters * 2,
+        "章节列表": [
+            {"章节名称": f"第{i}章 运算", "重点": "加减法与应用题" * 5, "学时": 2}
+            for i in range(1, chapters + 1)
+        ],
+    }
+    body = json.dumps(outline, ensure_ascii=False, indent=2)
+    return f"好的，以下是课程大纲：\n```json\n{body}\n```\n希望对您有帮助！如有需要请告诉我。"
+
+
+def build_resources_response():
+    resources = {
+        "教材": [{"书名": f"教材{i}", "作者": "作者", "出版社": "出版社", "备注": "说明" * 10} for i in range(3)],
+        "在线视频": [{"视频标题": f"视频{i}", "发布平台": "B站搜索", "主讲人/机构": "多个来源",
+                  "链接": "https://search.bilibili.com/all?keyword=数学+教程"} for i in range(3)],
+        "工具/软件": [{"工具名称": f"工具{i}", "类型": "软件", "用途": "练习"} for i in range(3)],
+        "案例研究": [{"案例名称": f"案例{i}", "领域": "数学", "描述": "描述" * 20} for i in range(3)],
+    }
+    body = json.dumps(resources, ensure_ascii=False, indent=2)
+    # 模型常见错误：尾随逗号
+    body = body.replace('"练习"\n', '"练习",\n')
+    return f"```json\n{body}\n```"
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    cases = {
+        "课程大纲（带说明文字）": build_outline_response(),
+        "长课程大纲（60章）": build_outline_response(60),
+        "资源推荐（尾随逗号）": build_resources_response(),
+    }
+    print(f"{'用例':<20}{'长度':>8}{'旧实现(us)':>14}{'新实现(us)':>14}{'加速比':>10}")
+    for name, text in cases.items():
+        expected = extract_json_from_text(text)
+        assert "error" not in expected, name
+        legacy = timeit.timeit(lambda: legacy_chain(text), number=number) / number * 1e6
+        current = timeit.timeit(lambda: extract_json_from_text(text), number=number) / number * 1e6
+        print(f"{name:<20}{len(text):>8}{legacy:>14.1f}{current:>14.1f}{legacy / current:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
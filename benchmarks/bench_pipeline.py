@@ -0,0 +1,215 @@
+"""生成流程端到端基准测试
+
+在进程内启动本地LLM替身服务（固定首字节延迟），依次压测课程大纲、讲义生成、讲义修改、
+资源推荐以及 Word/PPT 导出，统计各并发度下的 p50/p95/p99 延迟、吞吐量和峰值内存，
+结果写入JSON文件，便于在不同提交之间对比。
+
+用法：
+    python benchmarks/bench_pipeline.py
+    python benchmarks/bench_pipeline.py --latency 0.2 --concurrency 1 4 8 --iterations 24
+    python benchmarks/bench_pipeline.py --compare benchmarks/results/pipeline_abc1234.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import resource  # Windows 上不可用，届时不统计峰值内存
+except ImportError:
+    resource = None
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import utils
+import mock_llm_server
+from logger import ROOT_LOGGER_NAME
+
+RESULTS_DIR = os.path.join(REPO_ROOT, "benchmarks", "results")
+
+
+def peak_rss_mb():
+    """进程峰值常驻内存（MB），平台不支持时返回 None"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位为 KB，macOS 为字节
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def percentile(sorted_values, pct):
+    """最近秩法百分位数"""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def is_error(result):
+    return result is None or (isinstance(result, dict) and "error" in result)
+
+
+def build_scenarios(sample_lecture):
+    """每个场景是 fn(i)，i 让每次调用的提示词不同，避免被缓存或请求合并掩盖真实耗时"""
+    return {
+        "course_outline": lambda i: utils.generate_course_outline(f"基准课程{i}", "掌握核心知识", 32, "高中"),
+        "lecture_content": lambda i: utils.generate_lecture_content(f"第{i}章 函数", "定义与性质", 2, "高中"),
+        "lecture_revision_section": lambda i: utils.update_lecture_content(
+            sample_lecture, f"把第一部分的例题改简单一些（第{i}次）", [], "高中"),
+        "lecture_revision_full": lambda i: utils.update_lecture_content(
+            sample_lecture, f"整体语言更生动一些（第{i}次）", [], "高中"),
+        "recommend_resources": lambda i: utils.recommend_resources(f"基准课程{i}", "高中"),
+        "word_export": lambda i: utils.generate_word_document(sample_lecture, f"lecture_{i}.docx"),
+        "ppt_export": lambda i: utils.generate_ppt_document(sample_lecture, f"lecture_{i}.pptx"),
+    }
+
+
+def run_scenario(fn, concurrency, iterations, offset):
+    """以给定并发度执行 iterations 次，返回延迟统计和吞吐量"""
+    latencies = []
+    errors = 0
+
+    def timed(i):
+        start = time.perf_counter()
+        result = fn(offset + i)
+        return time.perf_counter() - start, result
+
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for elapsed, result in executor.map(timed, range(iterations)):
+            latencies.append(elapsed)
+            # 导出函数返回 (文件流, 文件名)，文件流为 None 表示失败
+            if is_error(result) or (isinstance(result, tuple) and result[0] is None):
+                errors += 1
+    wall = time.perf_counter() - wall_start
+
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "iterations": iterations,
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 2),
+        "throughput_rps": round(iterations / wall, 2),
+    }
+
+
+def compare(current, baseline_path):
+    """打印与基线结果的 p50 和吞吐量对比"""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"\n与基线 {baseline.get('revision')} 对比（比值 = 当前/基线）：")
+    for name, runs in current["scenarios"].items():
+        base_runs = {r["concurrency"]: r for r in baseline.get("scenarios", {}).get(name, {}).get("runs", [])}
+        for run in runs["runs"]:
+            base = base_runs.get(run["concurrency"])
+            if not base:
+                continue
+            print(f"  {name:<26} c={run['concurrency']:<3} "
+                  f"p50 {run['p50_ms'] / base['p50_ms']:.2f}x  吞吐 {run['throughput_rps'] / base['throughput_rps']:.2f}x")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="生成流程端到端基准测试")
+    parser.add_argument("--latency", type=float, default=0.2, help="替身服务的首字节延迟（秒）")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="替身服务的生成速度，0 表示不限速")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8], help="要测试的并发度")
+    parser.add_argument("--iterations", type=int, default=16, help="每个并发度下的调用次数")
+    parser.add_argument("--scenarios", nargs="+", help="只运行指定场景")
+    parser.add_argument("--respect-rate-limits", action="store_true",
+                        help="使用 config 中的限流配置；默认放开限流，只测流程本身的开销")
+    parser.add_argument("--output", help="结果JSON路径，默认 benchmarks/results/pipeline_<提交>.json")
+    parser.add_argument("--compare", help="与之前保存的结果JSON对比")
+    parser.add_argument("--verbose", action="store_true", help="保留被测函数的日志输出")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not args.verbose:
+        # 被测函数的常规日志会淹没结果表格
+        logging.getLogger(ROOT_LOGGER_NAME).setLevel(logging.WARNING)
+        for name in list(logging.root.manager.loggerDict):
+            if name.startswith(ROOT_LOGGER_NAME + "."):
+                logging.getLogger(name).setLevel(logging.NOTSET)
+
+    server_options = mock_llm_server.parse_args(
+        ["--port", "0", "--latency", str(args.latency), "--tokens-per-second", str(args.tokens_per_second)]
+    )
+    server = mock_llm_server.start_server(server_options, block=False)
+    url = f"http://127.0.0.1:{server.server_port}/v1/chat/completions"
+    utils.set_llm_backend(utils.OpenAICompatibleBackend("bench", url, description="基准测试替身服务", require_key=False))
+
+    # 每次调用的提示词都不同，缓存只会增加磁盘写入，不参与测试
+    utils.CACHE_ENABLED = False
+    if not args.respect_rate_limits:
+        utils._request_scheduler = utils.RequestScheduler(
+            max_concurrency=max(args.concurrency) * 2, rps=100000, tpm=10 ** 12
+        )
+
+    sample_lecture = mock_llm_server.synthesize_completion(
+        "章节名称：函数的性质\n章节重点：单调性与奇偶性\n学时：2\n教育阶段：高中\n生成语言：中文"
+    )
+    scenarios = build_scenarios(sample_lecture)
+    if args.scenarios:
+        scenarios = {name: scenarios[name] for name in args.scenarios}
+
+    report = {
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {
+            "latency_s": args.latency,
+            "tokens_per_second": args.tokens_per_second,
+            "iterations": args.iterations,
+            "rate_limited": args.respect_rate_limits,
+        },
+        "scenarios": {},
+    }
+
+    offset = 0
+    for name, fn in scenarios.items():
+        runs = []
+        for concurrency in args.concurrency:
+            run = run_scenario(fn, concurrency, args.iterations, offset)
+            offset += args.iterations
+            runs.append(run)
+            print(f"{name:<26} c={concurrency:<3} p50={run['p50_ms']:>9.1f}ms p95={run['p95_ms']:>9.1f}ms "
+                  f"p99={run['p99_ms']:>9.1f}ms {run['throughput_rps']:>8.2f} req/s 错误={run['errors']}")
+        report["scenarios"][name] = {"runs": runs, "peak_rss_mb": peak_rss_mb()}
+
+    report["peak_rss_mb"] = peak_rss_mb()
+    report["requests_served"] = server.requests_served
+    server.shutdown()
+    server.server_close()
+
+    output = args.output or os.path.join(RESULTS_DIR, f"pipeline_{report['revision']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n峰值内存: {report['peak_rss_mb']} MB，结果已写入 {output}")
+
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
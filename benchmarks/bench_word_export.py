@@ -0,0 +1,142 @@
+"""Word导出耗时随讲义长度变化的基准测试
+
+构造不同长度的讲义（标题、列表、粗体段落、表格和代码块按固定比例混合），
+统计 generate_word_document 的 p50/p95 耗时、每千字耗时以及生成的段落数和文本块（run）数，
+结果写入JSON文件，便于在不同提交之间对比。
+
+用法：
+    python benchmarks/bench_word_export.py
+    python benchmarks/bench_word_export.py --sections 5 20 80 --iterations 10
+    python benchmarks/bench_word_export.py --compare benchmarks/results/word_export_abc1234.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from docx import Document
+
+import utils
+from logger import ROOT_LOGGER_NAME
+
+RESULTS_DIR = os.path.join(REPO_ROOT, "benchmarks", "results")
+
+
+def percentile(sorted_values, pct):
+    """最近秩法百分位数"""
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def build_lecture(sections, code_lines=12):
+    """构造包含 sections 个小节的讲义，每节都带列表、粗体、表格和代码块"""
+    parts = ["# 函数的性质（高中版）", ""]
+    for i in range(1, sections + 1):
+        parts += [
+            f"## 第{i}节 单调性与奇偶性",
+            "",
+            f"本节讨论函数的**单调性**，并结合例题说明判断方法。第{i}节的内容与前面各节紧密相关。",
+            "- 定义：在区间上任取 **x1 < x2**，比较 `f(x1)` 与 `f(x2)` 的大小",
+            "- 方法：作差法、作商法、导数法",
+            f"1. 例题{i}：判断 f(x) = x^3 - 3x 在 R 上的单调性",
+            "2. 解析：求导得 **f'(x) = 3x^2 - 3**，令其大于零求出增区间",
+            "| 区间 | 导数符号 | 单调性 |",
+            "|---|---|---|",
+            "| (-∞, -1) | + | 递增 |",
+            "| (-1, 1) | - | 递减 |",
+            "```",
+        ]
+        parts += [f"def f{i}_{line}(x):  # 第{line}行示例代码" for line in range(code_lines)]
+        parts += ["```", ""]
+    return "\n".join(parts)
+
+
+def run_case(content, iterations):
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        file_stream, _ = utils.generate_word_document(content)
+        latencies.append(time.perf_counter() - start)
+        if file_stream is None:
+            raise RuntimeError("generate_word_document 返回失败")
+    document = Document(file_stream)
+    latencies.sort()
+    p50 = percentile(latencies, 50)
+    return {
+        "chars": len(content),
+        "paragraphs": len(document.paragraphs),
+        "runs": sum(len(paragraph.runs) for paragraph in document.paragraphs),
+        "p50_ms": round(p50 * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "ms_per_1k_chars": round(p50 * 1000 / (len(content) / 1000), 3),
+    }
+
+
+def compare(current, baseline_path):
+    """打印与基线结果的 p50 对比"""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"\n与基线 {baseline.get('revision')} 对比（比值 = 当前/基线）：")
+    for sections, case in current["cases"].items():
+        base = baseline.get("cases", {}).get(sections)
+        if base:
+            print(f"  sections={sections:<5} p50 {case['p50_ms'] / base['p50_ms']:.2f}x  runs {case['runs']}/{base['runs']}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Word导出耗时随讲义长度变化的基准测试")
+    parser.add_argument("--sections", type=int, nargs="+", default=[5, 20, 80], help="讲义的小节数")
+    parser.add_argument("--code-lines", type=int, default=12, help="每个代码块的行数")
+    parser.add_argument("--iterations", type=int, default=10, help="每种长度的导出次数")
+    parser.add_argument("--output", help="结果JSON路径，默认 benchmarks/results/word_export_<提交>.json")
+    parser.add_argument("--compare", help="与之前保存的结果JSON对比")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # 导出失败时的异常日志仍会输出
+    logging.getLogger(ROOT_LOGGER_NAME).setLevel(logging.WARNING)
+
+    report = {
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {"iterations": args.iterations, "code_lines": args.code_lines},
+        "cases": {},
+    }
+    for sections in args.sections:
+        case = run_case(build_lecture(sections, args.code_lines), args.iterations)
+        report["cases"][str(sections)] = case
+        print(f"sections={sections:<5} chars={case['chars']:<7} paragraphs={case['paragraphs']:<6} runs={case['runs']:<6} "
+              f"p50={case['p50_ms']:>8.1f}ms p95={case['p95_ms']:>8.1f}ms {case['ms_per_1k_chars']:>7.3f}ms/千字")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"word_export_{report['revision']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已写入 {output}")
+
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -9,6 +9,26 @@ load_dotenv()
 DEEPSEEK_API_KEY = "sk-335e06b971bc470fbaf13c5dc485cddf"
 DEEPSEEK_API_URL = "https://api.deepseek.com/v1/chat/completions"
 
+# LLM后端：deepseek 为线上接口，local 为本地替身服务（python mock_llm_server.py）
+LLM_BACKEND = os.getenv("LLM_BACKEND", "deepseek")
+LOCAL_LLM_URL = os.getenv("LOCAL_LLM_URL", "http://127.0.0.1:8800/v1/chat/completions")
+LLM_RECORD_PATH = os.getenv("LLM_RECORD_PATH", "")  # 非空时把成功的补全录制到该JSONL文件，供本地服务回放
+
+# 请求耗时统计
+METRICS_ENABLED = True  # 记录各阶段耗时并累计到计数器/直方图
+METRICS_RECENT_REQUESTS = 50  # 侧边栏"请求耗时"面板保留的最近操作数
+METRICS_LOG_REQUESTS = True  # 每个操作结束时输出一行JSON格式的耗时日志
+
+# 日志配置（logger.py）
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")  # 默认级别
+LOG_LEVELS = {  # 按模块覆盖默认级别，未列出的模块使用 LOG_LEVEL
+    # "utils": "DEBUG",  # 查看提示词和原始响应
+}
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # json 或 text
+LOG_MAX_FIELD_CHARS = 500  # 提示词、响应等大段内容在日志中最多保留的字符数
+LOG_PAYLOAD_SAMPLE_RATE = 0.1  # 大段内容日志的抽样比例
+LOG_QUEUE_SIZE = 10000  # 日志队列上限，写出跟不上时丢弃新日志而不是阻塞请求线程
+
 # 网络配置
 MAX_RETRIES = 3
 CONNECT_TIMEOUT = 10
@@ -16,6 +36,66 @@ READ_TIMEOUT = 120
 BACKOFF_FACTOR = 0.5
 TIMEOUT = (CONNECT_TIMEOUT, READ_TIMEOUT)
 
+# 连接池配置（整个Streamlit进程共享一个连接池）
+POOL_CONNECTIONS = 10  # 缓存连接池的主机数量
+POOL_MAXSIZE = 20  # 每个主机保持的最大长连接数，即同时进行的API请求上限
+POOL_BLOCK = True  # 连接用尽时排队等待空闲连接，而不是临时新建连接再丢弃
+
+# LLM响应缓存配置（内存LRU + SQLite磁盘两级缓存）
+CACHE_ENABLED = True
+CACHE_TTL = 7 * 24 * 3600  # 缓存有效期（秒）
+CACHE_MEMORY_MAX_ENTRIES = 256  # 内存缓存最多保留的响应条数
+CACHE_DB_PATH = "llm_cache.sqlite3"  # 磁盘缓存文件
+CACHE_DISK_MAX_BYTES = 200 * 1024 * 1024  # 磁盘缓存总大小上限（字节）
+
+# 讲义修改配置
+SECTION_REVISION_ENABLED = True  # 用户要求指明了章节时，只重写对应小节而不是整篇讲义
+SECTION_REVISION_MAX_RATIO = 0.6  # 待修改小节超过讲义篇幅的该比例时，直接整篇修改
+
+# 请求调度配置（进程内所有DeepSeek调用统一排队限流）
+SCHEDULER_MAX_CONCURRENCY = 16  # 同时进行的API请求上限（不应超过 POOL_MAXSIZE）
+RATE_LIMIT_RPS = 5  # 每秒最多发出的请求数
+RATE_LIMIT_TPM = 500000  # 每分钟最多消耗的token数（按提示词估算）
+
+# 提示词token预算（按本地近似规则估算）
+PROMPT_TOKEN_BUDGET = 12000  # 讲义修改提示词的总预算
+HISTORY_TOKEN_BUDGET = 2000  # 其中对话历史最多占用的token数，超出部分压缩为摘要
+
+# 熔断与重试配置
+CIRCUIT_FAILURE_THRESHOLD = 5  # 连续失败多少次后熔断
+CIRCUIT_RECOVERY_TIMEOUT = 30  # 熔断后多少秒放行一个试探请求
+REQUEST_DEADLINE = 150  # 单次调用（含所有重试）的总时间预算（秒）
+RETRY_BACKOFF_BASE = 1.0  # 指数退避的基础等待时间（秒）
+RETRY_BACKOFF_MAX = 10.0  # 单次退避的最长等待时间（秒）
+
+# 流式输出配置
+STREAM_LECTURES = True  # 讲义生成时边生成边显示，缩短首字等待时间
+STREAM_RENDER_INTERVAL = 0.1  # 流式渲染的最小刷新间隔（秒），避免每个片段都重绘Markdown
+
+# 后台任务配置（讲义生成交给工作线程，页面重新运行不会中断）
+JOB_WORKERS = 8  # 同时执行的后台任务数，实际API并发仍受调度器限制
+JOB_TENANT_CONCURRENCY = 4  # 每个用户会话（租户）同时执行的任务数上限，超出的按优先级排队，避免一次批量生成占满工作线程
+JOB_DB_PATH = "jobs.sqlite3"  # 任务状态和结果的持久化文件
+JOB_POLL_INTERVAL = 1.0  # 有进行中的任务时页面刷新状态的间隔（秒）
+JOB_RETENTION = 7 * 24 * 3600  # 已结束任务的保留时间（秒），启动时清理更早的记录
+
+# 课程数据持久化配置（课程大纲、讲义、修改对话按课程ID保存，刷新页面或重启后恢复）
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sqlite")  # sqlite 或 memory
+STORAGE_DB_PATH = "courses.sqlite3"
+STORAGE_COMPRESS_LEVEL = 6  # zlib压缩级别
+STORAGE_IDLE_EVICT_SECONDS = 15 * 60  # 会话空闲超过该时间后清空其缓存的讲义和修改对话（课程大纲等基本信息不清理），下次访问时从存储中重新加载
+STORAGE_SWEEP_INTERVAL = 60  # 清理空闲会话缓存的最小间隔（秒）
+
+# 导出配置
+PPT_TEMPLATE_DIR = "templates"  # PPT模板目录，模板首次使用时解析并缓存，文件修改后自动重新加载
+PPT_TEMPLATE_COPY_MAX_RATIO = 0.8  # 复制已解析模板的耗时不超过重新解析的该比例时才用复制，否则每次从缓存的字节解析
+EXPORT_WORKERS = min(4, os.cpu_count() or 1)  # 整门课程导出时并行生成文档的进程数
+MARKDOWN_AST_CACHE_SIZE = 64  # 缓存解析结果的讲义数（按内容缓存，Word和PPT导出共用）
+PPT_CONTENT_FONT_SIZE = 18  # PPT正文字号（磅）
+PPT_LINE_SPACING = 1.2  # PPT正文行高（字号的倍数）
+PPT_PARAGRAPH_SPACING = 0.5  # PPT段前间距（字号的倍数）
+PPT_LAYOUT_FILL_RATIO = 0.95  # 按字宽表估算排版时实际使用的宽高比例，留出字体度量误差的余量
+
 # 应用配置
 APP_CONFIG = {
     "name": "AI课程设计助手",
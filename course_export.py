@@ -0,0 +1,229 @@
+# course_export.py - 整门课程导出
+#
+# 把 generated_lectures 中的全部讲义一次导出：
+#   zip     每章一个 Word/PPT 文件，打包为ZIP
+#   merged  合并为一个带目录的 Word 文档
+# python-docx / python-pptx 生成文档是纯CPU计算且持有GIL，多线程无法并行，
+# 这里把各章交给进程池生成，主进程只负责打包或合并。
+# 工作进程以 spawn 方式启动，只导入本模块及其依赖，不重新执行 app.py（见 _spawn_without_main）。
+import io
+import multiprocessing
+import re
+import sys
+import threading
+import time
+import types
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from copy import deepcopy
+
+from docx import Document
+from docx.enum.text import WD_BREAK
+from docx.oxml import OxmlElement
+from docx.oxml.ns import qn
+
+from config import EXPORT_WORKERS
+from logger import get_logger, log_fields
+import utils
+
+log = get_logger("export")
+
+EXPORT_FORMATS = ("word", "ppt")
+EXPORT_LAYOUTS = ("zip", "merged")
+
+_EXTENSIONS = {"word": ".docx", "ppt": ".pptx"}
+
+def _clean_filename(name):
+    return re.sub(r'[\\/*?:"<>|]', "", name).strip() or "untitled"
+
+def _export_chapter(fmt, content, filename, template_path=None):
+    """在工作进程中生成一章的文档，返回文件字节，失败时返回None（结果需可跨进程传递）"""
+    if fmt == "ppt":
+        file_stream, _ = utils.generate_ppt_document(content, filename, template_path)
+    else:
+        file_stream, _ = utils.generate_word_document(content, filename)
+    return None if file_stream is None else file_stream.getvalue()
+
+_export_pool = None
+_export_pool_lock = threading.Lock()
+
+def get_export_pool():
+    """获取进程级共享的导出进程池"""
+    global _export_pool
+    if _export_pool is None:
+        with _export_pool_lock:
+            if _export_pool is None:
+                # 主进程中有事件循环、日志等后台线程，fork 出的子进程可能继承被其他线程持有的锁，这里用 spawn 启动
+                _export_pool = ProcessPoolExecutor(max_workers=EXPORT_WORKERS,
+                                                   mp_context=multiprocessing.get_context("spawn"))
+    return _export_pool
+
+_spawn_lock = threading.Lock()
+
+@contextmanager
+def _spawn_without_main():
+    """在此期间启动的工作进程不重新执行主模块
+
+    spawn 启动的子进程会先以 __mp_main__ 重新执行主模块的文件。Streamlit 下主模块是 app.py，
+    每个工作进程都会重复初始化任务库（把未完成的任务标记为中断）、课程存储和PPT模板，并导入全部页面依赖。
+    进程池在提交任务时按需启动工作进程，提交期间把 __main__ 临时换成不带文件路径的空模块即可避免。
+    """
+    with _spawn_lock:
+        original = sys.modules.get("__main__")
+        placeholder = types.ModuleType("__main__")
+        sys.modules["__main__"] = placeholder
+        try:
+            yield
+        finally:
+            # 期间其他会话的页面重新运行可能已替换 __main__，这时保留新的模块
+            if sys.modules.get("__main__") is placeholder:
+                sys.modules["__main__"] = original
+
+def _reset_export_pool():
+    """工作进程异常退出后进程池不可再用，丢弃后下次重新创建"""
+    global _export_pool
+    with _export_pool_lock:
+        pool, _export_pool = _export_pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def _build_chapters(fmt, chapters, template_path):
+    """并行生成各章文档，按完成顺序逐个产出 (序号, 文件字节或None)
+
+    进程池不可用时（如受限环境无法创建子进程）退回在当前进程中逐章生成。
+    """
+    tasks = [(fmt, content, f"{_clean_filename(name)}{_EXTENSIONS[fmt]}", template_path) for name, content in chapters]
+    try:
+        with _spawn_without_main():
+            pool = get_export_pool()
+            futures = {pool.submit(_export_chapter, *task): index for index, task in enumerate(tasks)}
+    except (OSError, RuntimeError, BrokenProcessPool) as e:
+        log.warning("导出进程池不可用，改为在当前进程中生成: %s", e)
+        for index, task in enumerate(tasks):
+            yield index, _export_chapter(*task)
+        return
+
+    done = set()
+    try:
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                data = future.result()
+            except BrokenProcessPool:
+                raise
+            except Exception as e:
+                log.warning("导出第%d章失败: %s", index + 1, e)
+                data = None
+            done.add(index)
+            yield index, data
+    except BrokenProcessPool as e:
+        log.warning("导出工作进程异常退出，剩余章节改为在当前进程中生成: %s", e)
+        _reset_export_pool()
+        for index, task in enumerate(tasks):
+            if index not in done:
+                yield index, _export_chapter(*task)
+
+def _add_toc(doc, title):
+    """在文档开头添加目录域，打开文档时由Word更新页码"""
+    doc.add_heading(title, level=0)
+    paragraph = doc.add_paragraph()
+    run = paragraph.add_run()
+    begin = OxmlElement("w:fldChar")
+    begin.set(qn("w:fldCharType"), "begin")
+    instr = OxmlElement("w:instrText")
+    instr.set(qn("xml:space"), "preserve")
+    instr.text = 'TOC \\o "1-2" \\h \\z \\u'
+    separate = OxmlElement("w:fldChar")
+    separate.set(qn("w:fldCharType"), "separate")
+    placeholder = OxmlElement("w:t")
+    placeholder.text = "目录（打开文档后右键选择“更新域”显示页码）"
+    end = OxmlElement("w:fldChar")
+    end.set(qn("w:fldCharType"), "end")
+    for element in (begin, instr, separate, placeholder, end):
+        run._r.append(element)
+
+    # 让Word在打开文档时提示更新域，目录中的页码才是准确的
+    update_fields = OxmlElement("w:updateFields")
+    update_fields.set(qn("w:val"), "true")
+    doc.settings.element.append(update_fields)
+
+def _merge_word(course_name, chapters, documents):
+    """把各章文档的正文依次追加到一个带目录的文档中，每章从新的一页开始"""
+    # 以第一份导出成功的章节文档为底稿，沿用 generate_word_document 设置的字体和标题样式
+    merged = Document(io.BytesIO(next(data for data in documents.values() if data is not None)))
+    body = merged.element.body
+    # sectPr（页面设置）必须保持在正文最后，其余内容清空
+    sect_pr = body[-1] if body[-1].tag == qn("w:sectPr") else None
+    for element in list(body):
+        if element is not sect_pr:
+            body.remove(element)
+    _add_toc(merged, course_name)
+    for index, (name, content) in enumerate(chapters):
+        merged.add_paragraph().add_run().add_break(WD_BREAK.PAGE)
+        data = documents.get(index)
+        # 讲义通常以一级标题开头，没有时补上章节名，保证每章都出现在目录中
+        if data is None or not content.lstrip().startswith("# "):
+            merged.add_heading(f"第{index + 1}章 {name}", level=1)
+        if data is None:
+            merged.add_paragraph("（本章导出失败）")
+            continue
+        chapter_body = Document(io.BytesIO(data)).element.body
+        for element in chapter_body:
+            if element.tag == qn("w:sectPr"):
+                continue
+            if sect_pr is not None:
+                sect_pr.addprevious(deepcopy(element))
+            else:
+                body.append(deepcopy(element))
+    file_stream = io.BytesIO()
+    merged.save(file_stream)
+    file_stream.seek(0)
+    return file_stream
+
+def export_course(course_name, chapters, fmt="word", layout="zip", template_path=None):
+    """导出整门课程
+
+    chapters 为按章节顺序排列的 [(章节名称, 讲义内容), ...]；
+    fmt 为 word 或 ppt，layout 为 zip（每章一个文件）或 merged（合并为一个带目录的Word文档，仅支持word）。
+    返回 (文件流, 文件名, 导出失败的章节名称列表)，全部失败时文件流为None。
+    """
+    if fmt not in EXPORT_FORMATS or layout not in EXPORT_LAYOUTS:
+        raise ValueError(f"不支持的导出方式: {fmt}/{layout}")
+    if layout == "merged" and fmt != "word":
+        raise ValueError("只有Word支持合并导出")
+
+    start = time.perf_counter()
+    course_filename = _clean_filename(course_name)
+    failed = []  # 导出失败的章节序号
+
+    if layout == "merged":
+        documents = {}
+        for index, data in _build_chapters(fmt, chapters, template_path):
+            documents[index] = data
+            if data is None:
+                failed.append(index)
+        file_stream = None
+        if len(failed) < len(chapters):
+            file_stream = _merge_word(course_name, chapters, documents)
+        filename = f"{course_filename}.docx"
+    else:
+        # docx/pptx 本身已是压缩包，再压缩几乎不减小体积，直接存储
+        file_stream = io.BytesIO()
+        with zipfile.ZipFile(file_stream, "w", zipfile.ZIP_STORED) as archive:
+            for index, data in _build_chapters(fmt, chapters, template_path):
+                if data is None:
+                    failed.append(index)
+                    continue
+                archive.writestr(f"{index + 1:02d}_{_clean_filename(chapters[index][0])}{_EXTENSIONS[fmt]}", data)
+        file_stream.seek(0)
+        if len(failed) == len(chapters):
+            file_stream = None
+        filename = f"{course_filename}_{'Word' if fmt == 'word' else 'PPT'}.zip"
+
+    log.info("整门课程导出完成", extra=log_fields(format=fmt, layout=layout, chapters=len(chapters), failed=len(failed),
+                                             seconds=round(time.perf_counter() - start, 2)))
+    if file_stream is None:
+        filename = None
+    return file_stream, filename, [chapters[index][0] for index in sorted(failed)]
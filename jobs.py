@@ -0,0 +1,349 @@
+# jobs.py - 后台任务队列
+#
+# 生成一章讲义需要1~2分钟，直接在Streamlit脚本中执行时，页面重新运行、刷新或切换标签页都会
+# 丢弃进行中的请求（以及已消耗的token）。这里把生成交给进程级工作线程池：
+#   页面  submit() 提交任务并记下任务ID，之后每次运行用 get() 轮询状态，完成后取出结果
+#   工作线程  执行任务，流式生成时把已收到的文本写入 partial，供页面实时显示
+# 每个租户同时执行的任务数不超过 JOB_TENANT_CONCURRENCY，超出的任务按优先级在租户内排队，
+# 一个用户的批量生成不会占满全部工作线程，同一用户后提交的交互式任务也能插到批量任务前面。
+# 任务状态和结果持久化到SQLite，进程内的任务结束后从内存移除，之后的查询直接读库；
+# 刷新页面后可按租户（st.query_params 中的 tenant）找回任务。
+import heapq
+import itertools
+import json
+import multiprocessing
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from config import JOB_WORKERS, JOB_TENANT_CONCURRENCY, JOB_DB_PATH, JOB_RETENTION, STREAM_LECTURES
+from logger import get_logger, log_fields
+import metrics
+import utils
+
+log = get_logger("jobs")
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+JOB_INTERRUPTED = "interrupted"  # 进程重启时尚未完成的任务
+ACTIVE_STATUSES = (JOB_QUEUED, JOB_RUNNING)
+
+class JobCancelled(Exception):
+    """任务执行过程中收到取消请求"""
+
+class Job:
+    """一个后台任务；partial 是流式生成时已收到的文本片段，只保存在内存中"""
+
+    def __init__(self, job_id, kind, params, tenant_id=None, key=None, status=JOB_QUEUED,
+                 result=None, error=None, fallback=False, created=None, updated=None):
+        self.job_id = job_id
+        self.kind = kind
+        self.params = params
+        self.tenant_id = tenant_id
+        self.key = key
+        self.status = status
+        self.result = result
+        self.error = error  # 失败原因；使用备用方案完成时为最后一次API错误
+        self.fallback = fallback  # 结果是否来自备用方案
+        self.created = created or time.time()
+        self.updated = updated or self.created
+        self.partial = []
+        self.cancel_requested = False
+
+    def append(self, text):
+        """工作线程写入一段生成的文本；已请求取消时抛出 JobCancelled 中止生成"""
+        if self.cancel_requested:
+            raise JobCancelled()
+        self.partial.append(text)
+
+    def reset_partial(self):
+        self.partial = []
+
+    def snapshot(self):
+        """返回供页面使用的任务状态字典"""
+        return {
+            "job_id": self.job_id,
+            "kind": self.kind,
+            "params": self.params,
+            "tenant_id": self.tenant_id,
+            "key": self.key,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+            "fallback": self.fallback,
+            "partial": "".join(self.partial),
+            "created": self.created,
+            "updated": self.updated
+        }
+
+# 任务类型 -> 执行函数 fn(job)，返回值作为任务结果（需可JSON序列化）
+_JOB_HANDLERS = {}
+
+def register_job_kind(kind, handler):
+    """注册任务类型"""
+    _JOB_HANDLERS[kind] = handler
+
+class JobManager:
+    """进程级后台任务管理：工作线程池 + SQLite 持久化的任务状态"""
+
+    _COLUMNS = "job_id, kind, params, tenant_id, key, status, result, error, fallback, created, updated"
+
+    def __init__(self, db_path=JOB_DB_PATH, max_workers=JOB_WORKERS, tenant_concurrency=JOB_TENANT_CONCURRENCY):
+        self._jobs = {}  # 本进程中尚未结束的任务
+        self.tenant_concurrency = tenant_concurrency
+        self._running = {}  # 租户 -> 已交给工作线程的任务数
+        self._pending = {}  # 租户 -> 超出并发上限的任务堆 [(优先级, 序号, 任务)]
+        self._waiting = set()  # 在 _pending 中等待的任务ID（取消的任务从这里移除，出堆时跳过）
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._stats = {"submitted": 0, "deduplicated": 0, "done": 0, "failed": 0, "cancelled": 0, "fallback": 0}
+        self._db = None
+        if db_path:
+            try:
+                self._db = sqlite3.connect(db_path, check_same_thread=False)
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS jobs ("
+                    "job_id TEXT PRIMARY KEY, kind TEXT NOT NULL, params TEXT NOT NULL, tenant_id TEXT, key TEXT, "
+                    "status TEXT NOT NULL, result TEXT, error TEXT, fallback INTEGER NOT NULL DEFAULT 0, "
+                    "created REAL NOT NULL, updated REAL NOT NULL)"
+                )
+                self._db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_tenant ON jobs(tenant_id, created)")
+                # 只在服务进程中恢复；子进程（如导出工作进程）里执行会把服务进程中正在运行的任务标记为中断
+                if multiprocessing.parent_process() is None:
+                    self._recover()
+                self._db.commit()
+            except sqlite3.Error as e:
+                # 持久化不可用时任务只保存在内存中，页面刷新后无法找回
+                log.warning("任务数据库初始化失败，任务状态仅保存在内存中: %s", e)
+                self._db = None
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job-worker")
+
+    def _recover(self):
+        """启动时把上次进程遗留的未完成任务标记为中断，并清理过期记录"""
+        now = time.time()
+        cursor = self._db.execute(
+            "UPDATE jobs SET status = ?, error = ?, updated = ? WHERE status IN (?, ?)",
+            (JOB_INTERRUPTED, "服务重启，任务未完成", now, *ACTIVE_STATUSES)
+        )
+        if cursor.rowcount:
+            log.warning("%d 个任务因服务重启而中断", cursor.rowcount)
+        self._db.execute("DELETE FROM jobs WHERE updated < ?", (now - JOB_RETENTION,))
+
+    def submit(self, kind, params, tenant_id=None, key=None, priority=utils.PRIORITY_NORMAL):
+        """提交任务，返回任务ID；同一租户同一 key 已有未结束的任务时直接返回该任务的ID
+
+        租户执行中的任务已达上限时任务先在租户内排队，priority 越小越先执行。
+        """
+        if kind not in _JOB_HANDLERS:
+            raise ValueError(f"未知的任务类型: {kind}")
+        with self._lock:
+            if key is not None:
+                for job in self._jobs.values():
+                    if job.tenant_id == tenant_id and job.key == key and job.status in ACTIVE_STATUSES:
+                        self._stats["deduplicated"] += 1
+                        return job.job_id
+            job = Job(uuid.uuid4().hex, kind, params, tenant_id, key)
+            self._jobs[job.job_id] = job
+            self._stats["submitted"] += 1
+            # 在锁内落库：排队的任务随时可能被其他任务结束时调度执行，排队状态不能覆盖之后的状态
+            self._save(job)
+            waiting = self._running.get(tenant_id, 0) >= self.tenant_concurrency
+            if waiting:
+                heapq.heappush(self._pending.setdefault(tenant_id, []), (priority, next(self._seq), job))
+                self._waiting.add(job.job_id)
+            else:
+                self._running[tenant_id] = self._running.get(tenant_id, 0) + 1
+        if not waiting:
+            self._executor.submit(self._run, job)
+        log.info("已提交后台任务", extra=log_fields(job_id=job.job_id, kind=kind, key=key, waiting=waiting))
+        return job.job_id
+
+    def _run(self, job):
+        try:
+            if job.cancel_requested:
+                self._finish(job, JOB_CANCELLED)
+                return
+            job.status = JOB_RUNNING
+            job.updated = time.time()
+            self._save(job)
+            try:
+                job.result = _JOB_HANDLERS[job.kind](job)
+                self._finish(job, JOB_DONE)
+            except JobCancelled:
+                self._finish(job, JOB_CANCELLED)
+            except Exception as e:
+                log.exception("后台任务执行失败: %s", job.job_id)
+                job.error = f"任务执行异常: {str(e)}"
+                self._finish(job, JOB_FAILED)
+        finally:
+            self._release(job.tenant_id)
+
+    def _release(self, tenant_id):
+        """任务结束后把租户的名额交给其排队中优先级最高的任务，没有排队的任务时归还名额"""
+        next_job = None
+        with self._lock:
+            pending = self._pending.get(tenant_id)
+            while pending and next_job is None:
+                _, _, job = heapq.heappop(pending)
+                if job.job_id in self._waiting:
+                    self._waiting.discard(job.job_id)
+                    next_job = job
+            if not pending:
+                self._pending.pop(tenant_id, None)
+            if next_job is None:
+                self._running[tenant_id] -= 1
+                if not self._running[tenant_id]:
+                    del self._running[tenant_id]
+        if next_job is not None:
+            self._executor.submit(self._run, next_job)
+
+    def _finish(self, job, status):
+        job.status = status
+        job.updated = time.time()
+        # 先落库再从内存移除，期间的查询总能读到结果
+        self._save(job)
+        with self._lock:
+            self._jobs.pop(job.job_id, None)
+            self._stats[status] = self._stats.get(status, 0) + 1
+            if job.fallback:
+                self._stats["fallback"] += 1
+        log.info("后台任务结束", extra=log_fields(job_id=job.job_id, status=status, fallback=job.fallback,
+                                             seconds=round(job.updated - job.created, 1)))
+
+    def _save(self, job):
+        if self._db is None:
+            return
+        row = (
+            job.job_id, job.kind, json.dumps(job.params, ensure_ascii=False), job.tenant_id, job.key, job.status,
+            None if job.result is None else json.dumps(job.result, ensure_ascii=False),
+            job.error, int(job.fallback), job.created, job.updated
+        )
+        with self._db_lock:
+            try:
+                self._db.execute(f"INSERT OR REPLACE INTO jobs ({self._COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+                self._db.commit()
+            except sqlite3.Error as e:
+                log.warning("保存任务状态失败: %s", e)
+
+    def _load(self, where, args):
+        if self._db is None:
+            return []
+        with self._db_lock:
+            try:
+                rows = self._db.execute(f"SELECT {self._COLUMNS} FROM jobs WHERE {where}", args).fetchall()
+            except sqlite3.Error as e:
+                log.warning("读取任务状态失败: %s", e)
+                return []
+        jobs = []
+        for job_id, kind, params, tenant_id, key, status, result, error, fallback, created, updated in rows:
+            jobs.append(Job(job_id, kind, json.loads(params), tenant_id, key, status,
+                            None if result is None else json.loads(result), error, bool(fallback), created, updated))
+        return jobs
+
+    def get(self, job_id):
+        """返回任务状态字典，任务不存在时返回None"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            stored = self._load("job_id = ?", (job_id,))
+            job = stored[0] if stored else None
+        return job.snapshot() if job is not None else None
+
+    def jobs_for_tenant(self, tenant_id):
+        """返回租户的全部任务状态（按提交时间排序），用于页面刷新后找回任务"""
+        jobs = {job.job_id: job for job in self._load("tenant_id = ? ORDER BY created", (tenant_id,))}
+        with self._lock:
+            # 未结束的任务以内存中的为准，带有已生成的部分文本
+            for job in self._jobs.values():
+                if job.tenant_id == tenant_id:
+                    jobs[job.job_id] = job
+        return sorted((job.snapshot() for job in jobs.values()), key=lambda item: item["created"])
+
+    def cancel(self, job_id):
+        """请求取消任务：排队中的任务不再执行，流式生成中的任务在收到下一段文本时停止"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return False
+            job.cancel_requested = True
+            waiting = job.job_id in self._waiting
+            self._waiting.discard(job.job_id)
+        if waiting:
+            # 还在租户队列中的任务没有占用名额，直接结束
+            self._finish(job, JOB_CANCELLED)
+        return True
+
+    def stats(self):
+        """返回任务计数和当前排队/执行中的任务数"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["queued"] = sum(1 for job in self._jobs.values() if job.status == JOB_QUEUED)
+            stats["running"] = sum(1 for job in self._jobs.values() if job.status == JOB_RUNNING)
+            stats["waiting"] = len(self._waiting)  # 其中因租户并发上限而等待的任务数
+            return stats
+
+_job_manager = None
+_job_manager_lock = threading.Lock()
+
+def get_job_manager():
+    """获取进程级共享的后台任务管理器"""
+    global _job_manager
+    if _job_manager is None:
+        with _job_manager_lock:
+            if _job_manager is None:
+                _job_manager = JobManager()
+    return _job_manager
+
+def get_job_stats():
+    return get_job_manager().stats()
+
+def _run_lecture_job(job):
+    """生成一章讲义：优先流式生成（边生成边写入 partial），失败时依次退回普通生成和备用方案"""
+    params = job.params
+    args = (
+        params["chapter_name"],
+        params.get("key_points", ""),
+        params["hours"],
+        params.get("education_stage", "小学"),
+        params.get("generation_language", "中文"),
+        params.get("policy_requirements", "")
+    )
+    priority = params.get("priority", utils.PRIORITY_NORMAL)
+
+    with metrics.request_trace("lecture"):
+        if utils.is_api_circuit_open():
+            job.error = "API暂时不可用（已熔断）"
+        else:
+            if STREAM_LECTURES:
+                error = None
+                for chunk in utils.generate_lecture_content_stream(*args, priority=priority):
+                    if isinstance(chunk, dict) and "error" in chunk:
+                        error = chunk["error"]
+                        break
+                    job.append(chunk)
+                if error is None and job.partial:
+                    return "".join(job.partial)
+                # 流式调用失败，丢弃已收到的部分内容，改用普通生成（含重试）
+                log.warning("流式生成失败，改用普通生成: %s", error)
+                job.reset_partial()
+                job.error = error
+
+            response = utils.generate_lecture_content(*args, priority=priority)
+            if job.cancel_requested:
+                raise JobCancelled()
+            if isinstance(response, str) and response:
+                job.error = None
+                return response
+            job.error = response.get("error") if isinstance(response, dict) else "API返回空内容"
+
+        job.fallback = True
+        metrics.set_status("fallback")
+        return utils.generate_mock_lecture_content(*args)
+
+register_job_kind("lecture", _run_lecture_job)
@@ -0,0 +1,153 @@
+# logger.py - 结构化日志
+#
+# 业务线程只把日志记录放入队列，由后台线程格式化并写出，避免同步写stdout阻塞请求。
+# 用法：
+#   from logger import get_logger, truncate, log_fields, sampled
+#   log = get_logger("utils")
+#   log.info("API调用成功，耗时 %.2fs", elapsed)                      # 参数在级别启用时才格式化
+#   log.debug("提示词: %s", truncate(prompt), extra=sampled())        # 大段内容截断并抽样
+#   log.info("llm_request", extra=log_fields(request_id=..., total_ms=...))  # 附加结构化字段
+import atexit
+import copy
+import json
+import logging
+import queue
+import random
+import sys
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+from config import LOG_LEVEL, LOG_LEVELS, LOG_FORMAT, LOG_MAX_FIELD_CHARS, LOG_QUEUE_SIZE, LOG_PAYLOAD_SAMPLE_RATE
+
+ROOT_LOGGER_NAME = "courseware"
+
+class Truncated:
+    """延迟截断的日志参数：只有日志真正输出时才转换为字符串并截断"""
+    __slots__ = ("value", "limit")
+
+    def __init__(self, value, limit=None):
+        self.value = value
+        self.limit = limit or LOG_MAX_FIELD_CHARS
+
+    def __str__(self):
+        text = self.value if isinstance(self.value, str) else repr(self.value)
+        if len(text) <= self.limit:
+            return text
+        return f"{text[:self.limit]}...（共{len(text)}字符）"
+
+    __repr__ = __str__
+
+def truncate(value, limit=None):
+    return Truncated(value, limit)
+
+def log_fields(**values):
+    """构造 extra 参数，附加结构化字段"""
+    return {"fields": values}
+
+def sampled(rate=None, **values):
+    """构造 extra 参数：按比例抽样输出（默认 LOG_PAYLOAD_SAMPLE_RATE），用于提示词、原始响应等大段内容"""
+    return {"sample_rate": LOG_PAYLOAD_SAMPLE_RATE if rate is None else rate, "fields": values}
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出为一行JSON"""
+
+    def format(self, record):
+        payload = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name[len(ROOT_LOGGER_NAME) + 1:] or record.name,
+            "thread": record.threadName,
+            "msg": record.getMessage()
+        }
+        extra_fields = getattr(record, "fields", None)
+        if extra_fields:
+            payload.update(extra_fields)
+        if record.exc_text:
+            payload["exc"] = record.exc_text
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+class TextFormatter(logging.Formatter):
+    """人类可读的单行格式，结构化字段以 key=value 追加在末尾"""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s [%(name)s] %(message)s")
+
+    def format(self, record):
+        text = super().format(record)
+        extra_fields = getattr(record, "fields", None)
+        if extra_fields:
+            text += " " + " ".join(f"{key}={json.dumps(value, ensure_ascii=False, default=str)}" for key, value in extra_fields.items())
+        return text
+
+class _SamplingFilter(logging.Filter):
+    """带 sample_rate 的记录按比例保留；在级别检查之后执行，未启用的级别不会走到这里"""
+
+    def filter(self, record):
+        rate = getattr(record, "sample_rate", None)
+        return rate is None or random.random() < rate
+
+class _AsyncQueueHandler(QueueHandler):
+    """只在调用方线程合成消息文本，JSON序列化和写出交给后台线程；队列满时丢弃并计数"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        # 参数可能是之后会被修改的对象，入队前先合成消息文本
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+_configured = False
+_configure_lock = threading.Lock()
+_handler = None
+_listener = None
+
+def _configure():
+    global _configured, _handler, _listener
+    with _configure_lock:
+        if _configured:
+            return
+        root = logging.getLogger(ROOT_LOGGER_NAME)
+        root.setLevel(LOG_LEVEL)
+        root.propagate = False  # 不经过 Streamlit 等第三方配置的根日志器
+
+        log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        _handler = _AsyncQueueHandler(log_queue)
+        _handler.addFilter(_SamplingFilter())
+        root.addHandler(_handler)
+
+        output = logging.StreamHandler(sys.stdout)
+        output.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+        _listener = QueueListener(log_queue, output, respect_handler_level=True)
+        _listener.start()
+        # 进程退出前写完队列中剩余的日志
+        atexit.register(_listener.stop)
+
+        for name, level in LOG_LEVELS.items():
+            logging.getLogger(f"{ROOT_LOGGER_NAME}.{name}").setLevel(level)
+        _configured = True
+
+def get_logger(name):
+    """获取模块日志器，级别可在 config.LOG_LEVELS 中按模块名单独配置"""
+    if not _configured:
+        _configure()
+    return logging.getLogger(f"{ROOT_LOGGER_NAME}.{name}")
+
+def get_log_stats():
+    """返回日志队列积压和因队列满丢弃的条数"""
+    if _handler is None:
+        return {"configured": False}
+    return {"queued": _handler.queue.qsize(), "dropped": _handler.dropped}
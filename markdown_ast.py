@@ -0,0 +1,124 @@
+# markdown_ast.py - 讲义Markdown解析
+#
+# Word 和 PPT 导出共用同一份解析结果：parse_markdown() 把讲义解析为块列表，按内容缓存，
+# 同一版讲义先后导出两种格式（或整门课程导出时重复导出）只解析一次。
+# 块类型：
+#   heading   标题，level 为 1~6
+#   paragraph 普通段落
+#   bullet    无序列表项（- 或 * 开头）
+#   numbered  有序列表项（如 "1. "、例题编号），number 为编号
+#   code      代码块，lines 为代码行（不含 ``` 行）
+#   table     表格，rows 为各行单元格文本（不含 |---| 分隔行）
+#   blank     空行
+# 行内格式解析为 spans：[(文本, 是否粗体, 是否行内代码), ...]，text 为去掉标记后的纯文本。
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+from config import MARKDOWN_AST_CACHE_SIZE
+
+# lineno 为块起始行号（从0开始），raw 为去掉首尾空白的原始行
+Block = namedtuple("Block", "kind lineno raw level number spans text lines rows",
+                   defaults=(0, None, (), "", (), ()))
+
+_HEADING_RE = re.compile(r"(#{1,6})\s+(.*)")
+_NUMBERED_RE = re.compile(r"(\d+)\.\s+(.*)")
+_TABLE_SEPARATOR_RE = re.compile(r"[\s|:-]+")
+_INLINE_RE = re.compile(r"\*\*(.+?)\*\*|`([^`]+)`")
+
+def parse_inline(text):
+    """解析行内的 **粗体** 和 `代码`，返回 (spans, 纯文本)"""
+    if "*" not in text and "`" not in text:
+        return ((text, False, False),), text
+    spans = []
+    position = 0
+    for match in _INLINE_RE.finditer(text):
+        if match.start() > position:
+            spans.append((text[position:match.start()], False, False))
+        if match.group(1) is not None:
+            spans.append((match.group(1), True, False))
+        else:
+            spans.append((match.group(2), False, True))
+        position = match.end()
+    if position < len(text):
+        spans.append((text[position:], False, False))
+    spans = tuple(spans)
+    return spans, "".join(span[0] for span in spans)
+
+def _text_block(kind, lineno, raw, content, **fields):
+    spans, text = parse_inline(content)
+    return Block(kind, lineno, raw, spans=spans, text=text, **fields)
+
+def _split_table_row(line):
+    return tuple(cell.strip() for cell in line.split("|") if cell.strip())
+
+@lru_cache(maxsize=MARKDOWN_AST_CACHE_SIZE)
+def parse_markdown(content):
+    """把讲义Markdown解析为块元组；按内容缓存，返回值不可修改"""
+    blocks = []
+    code_lines = None  # 代码块内为已收集的代码行
+    code_start = 0
+    table_rows = None  # 连续的表格行
+    table_start = 0
+
+    def flush_table():
+        nonlocal table_rows
+        if table_rows:
+            blocks.append(Block("table", table_start, "", rows=tuple(table_rows)))
+        table_rows = None
+
+    for lineno, line in enumerate(content.split("\n")):
+        line = line.strip()
+
+        if line.startswith("```"):
+            flush_table()
+            if code_lines is None:
+                code_lines = []
+                code_start = lineno
+            else:
+                blocks.append(Block("code", code_start, "", lines=tuple(code_lines)))
+                code_lines = None
+            continue
+        if code_lines is not None:
+            code_lines.append(line)
+            continue
+
+        if "|" in line and not line.startswith(("#", "- ", "* ")):
+            if _TABLE_SEPARATOR_RE.fullmatch(line):
+                continue  # |---|---| 分隔行
+            cells = _split_table_row(line)
+            if cells:
+                if table_rows is None:
+                    table_rows = []
+                    table_start = lineno
+                table_rows.append(cells)
+                continue
+        flush_table()
+
+        if not line:
+            blocks.append(Block("blank", lineno, ""))
+            continue
+        if line.startswith("#"):
+            match = _HEADING_RE.match(line)
+            if match:
+                blocks.append(_text_block("heading", lineno, line, match.group(2).strip(), level=len(match.group(1))))
+                continue
+        if line.startswith(("- ", "* ")):
+            blocks.append(_text_block("bullet", lineno, line, line[2:].strip()))
+            continue
+        if line[0].isdigit():
+            match = _NUMBERED_RE.match(line)
+            if match:
+                blocks.append(_text_block("numbered", lineno, line, match.group(2), number=int(match.group(1))))
+                continue
+        blocks.append(_text_block("paragraph", lineno, line, line))
+
+    flush_table()
+    if code_lines is not None:
+        # 未闭合的代码块按代码处理，和编辑器中的显示一致
+        blocks.append(Block("code", code_start, "", lines=tuple(code_lines)))
+    return tuple(blocks)
+
+def get_parse_cache_stats():
+    info = parse_markdown.cache_info()
+    return {"hits": info.hits, "misses": info.misses, "size": info.currsize, "max_size": info.maxsize}
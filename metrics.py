@@ -0,0 +1,308 @@
+# metrics.py - 请求耗时分段统计
+#
+# 一次"生成讲义"之类的操作对应一个 RequestTrace，按阶段累计耗时：
+#   prompt_build  构建提示词
+#   queue         在调度器中排队等待
+#   connect       建立TCP/TLS连接（复用连接池中的连接时不出现）
+#   ttfb          请求发出到收到响应头/首个数据块（包含 connect）
+#   download      接收响应体
+#   parse         解析JSON
+#   render        Streamlit 渲染
+#   rerun         生成完成后页面重新运行到讲义显示出来之间的耗时
+# 结束时输出一行结构化日志，并累加到 Prometheus 风格的计数器和直方图中。
+# 当前操作保存在 ContextVar 中：线程之间互不影响，同一线程上的多个协程也各自独立。
+import contextvars
+import functools
+import inspect
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from config import METRICS_ENABLED, METRICS_RECENT_REQUESTS, METRICS_LOG_REQUESTS
+from logger import get_logger, log_fields
+
+log = get_logger("metrics")
+
+SPAN_NAMES = ["prompt_build", "queue", "connect", "ttfb", "download", "parse", "render", "rerun"]
+
+# 直方图桶上界（秒），覆盖从本地解析到长讲义生成的耗时范围
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+class Counter:
+    """按标签累加的计数器"""
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+class Histogram:
+    """按标签分组的累积直方图"""
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self._series = {}  # 标签 -> [各桶计数..., 总数, 总和]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f"{self.name}_bucket{_format_labels(key + (('le', str(bound)),))} {count}")
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', '+Inf'),))} {series[-2]}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {series[-2]}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {series[-1]:.6f}")
+        return lines
+
+def _format_labels(key):
+    if not key:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in key) + "}"
+
+REQUESTS_TOTAL = Counter("llm_requests_total", "按操作类型和结果统计的请求数")
+SPAN_SECONDS = Histogram("llm_request_span_seconds", "各阶段耗时（秒）")
+REQUEST_SECONDS = Histogram("llm_request_duration_seconds", "整个操作的耗时（秒）")
+
+_recent_requests = deque(maxlen=METRICS_RECENT_REQUESTS)
+_recent_lock = threading.Lock()
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+
+class RequestTrace:
+    """一次操作的分段耗时记录，可跨线程传递（调度器工作线程中记录连接和下载耗时）"""
+
+    def __init__(self, kind):
+        self.request_id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self.spans = {}
+        self.status = "ok"
+        self.finished = False
+        self._lock = threading.Lock()
+
+    def add_span(self, name, seconds):
+        """累加某阶段的耗时，同一阶段多次出现（如重试、分批渲染）时求和"""
+        with self._lock:
+            self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.add_span(name, time.perf_counter() - start)
+
+    def finish(self, status=None):
+        """结束记录：写入最近请求列表、指标和结构化日志，重复调用无效"""
+        with self._lock:
+            if self.finished:
+                return
+            self.finished = True
+            if status is not None:
+                self.status = status
+            total = time.perf_counter() - self._start
+            spans = dict(self.spans)
+
+        if not METRICS_ENABLED:
+            return
+        REQUESTS_TOTAL.inc(kind=self.kind, status=self.status)
+        REQUEST_SECONDS.observe(total, kind=self.kind)
+        for name, seconds in spans.items():
+            SPAN_SECONDS.observe(seconds, span=name)
+
+        record = {
+            "event": "llm_request",
+            "request_id": self.request_id,
+            "kind": self.kind,
+            "status": self.status,
+            "started": time.strftime("%H:%M:%S", time.localtime(self.started)),
+            "total_ms": round(total * 1000, 1),
+            "spans_ms": {name: round(seconds * 1000, 1) for name, seconds in spans.items()}
+        }
+        with _recent_lock:
+            _recent_requests.append(record)
+        if METRICS_LOG_REQUESTS:
+            log.info("llm_request", extra=log_fields(**{k: v for k, v in record.items() if k != "event"}))
+
+def current_trace():
+    """当前线程（或协程）正在记录的操作，没有时返回None"""
+    return _current_trace.get()
+
+@contextmanager
+def use_trace(trace):
+    """在当前线程（如调度器工作线程）或协程中临时指定当前操作"""
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+@contextmanager
+def request_trace(kind):
+    """记录一次操作；外层已有操作时直接复用外层的记录，保证一次点击只产生一条记录"""
+    outer = current_trace()
+    if outer is not None:
+        yield outer
+        return
+    trace = RequestTrace(kind)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    except Exception:
+        trace.status = "exception"
+        raise
+    finally:
+        _current_trace.reset(token)
+        trace.finish()
+
+@contextmanager
+def span(name):
+    """在当前操作中记录一个阶段，没有当前操作时不做任何事"""
+    trace = current_trace()
+    if trace is None:
+        yield None
+        return
+    with trace.span(name):
+        yield trace
+
+def _mark_error(trace, result):
+    if isinstance(result, dict) and "error" in result and trace.status == "ok":
+        trace.status = "error"
+
+def traced(kind):
+    """装饰器：把函数调用记录为一次操作，返回 {"error": ...} 时标记为 error，同时支持协程函数"""
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with request_trace(kind) as trace:
+                    result = await fn(*args, **kwargs)
+                    _mark_error(trace, result)
+                    return result
+            return async_wrapper
+        
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with request_trace(kind) as trace:
+                result = fn(*args, **kwargs)
+                _mark_error(trace, result)
+                return result
+        return wrapper
+    return decorator
+
+def timed(span_name):
+    """装饰器：把函数耗时记到当前操作的某个阶段，同时支持协程函数"""
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+        
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def set_status(status):
+    """标记当前操作的结果（如 cache_hit、error、fallback）"""
+    trace = current_trace()
+    if trace is not None:
+        trace.status = status
+
+def get_recent_requests(limit=None):
+    """返回最近完成的操作耗时记录，最新的在前"""
+    with _recent_lock:
+        records = list(_recent_requests)
+    records.reverse()
+    return records[:limit] if limit else records
+
+def render_prometheus():
+    """以 Prometheus 文本格式导出全部指标"""
+    lines = []
+    for metric in (REQUESTS_TOTAL, REQUEST_SECONDS, SPAN_SECONDS):
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+# 建立连接计时：替换连接池使用的连接类，把 connect() 的耗时记到当前操作的 connect 阶段
+class TimedHTTPConnection(HTTPConnection):
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            trace = current_trace()
+            if trace is not None:
+                trace.add_span("connect", time.perf_counter() - start)
+
+class TimedHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            trace = current_trace()
+            if trace is not None:
+                trace.add_span("connect", time.perf_counter() - start)
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+TIMED_POOL_CLASSES = {"http": TimedHTTPConnectionPool, "https": TimedHTTPSConnectionPool}
+
+def connect_tracer():
+    """返回 httpx 请求的 trace 扩展回调，把建立TCP/TLS连接的耗时记到当前操作的 connect 阶段"""
+    started = {}
+    
+    async def on_event(event_name, info):
+        stage, _, phase = event_name.rpartition(".")
+        if stage not in ("connection.connect_tcp", "connection.start_tls"):
+            return
+        if phase == "started":
+            started[stage] = time.perf_counter()
+        elif stage in started:
+            trace = current_trace()
+            if trace is not None:
+                trace.add_span("connect", time.perf_counter() - started.pop(stage))
+    
+    return on_event
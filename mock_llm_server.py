@@ -0,0 +1,236 @@
+# mock_llm_server.py - 本地 OpenAI 兼容的LLM替身服务
+#
+# 用于无网络环境下压测和基准测试课程大纲、讲义生成、讲义修改等流程：
+#   python mock_llm_server.py --port 8800 --latency 0.5 --tokens-per-second 60
+#   LLM_BACKEND=local streamlit run app.py
+#
+# 配合 LLM_RECORD_PATH 录制的线上补全（--replay 文件）可以按提示词原样回放；
+# 没有录制结果的提示词由 utils 中的备用方案生成结构相同的内容。
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from utils import completion_record_key, estimate_tokens
+from utils import generate_mock_course_outline, generate_mock_lecture_content, recommend_mock_resources
+from utils import update_lecture_with_mock
+
+
+def load_replay(path):
+    """读取录制文件，返回 {提示词指纹: 补全内容}，同一提示词以最后一次录制为准"""
+    replay = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            replay[record["key"]] = record["content"]
+    print(f"已加载 {len(replay)} 条录制的补全")
+    return replay
+
+
+def _field(prompt, label, default=""):
+    match = re.search(rf"{label}[：:]\s*(.+)", prompt)
+    return match.group(1).strip() if match else default
+
+
+def synthesize_completion(prompt):
+    """没有录制结果时，按提示词类型用备用方案生成结构相同的内容"""
+    if "需要修正的字段" in prompt:
+        return "{}"
+    if "推荐教学资源" in prompt:
+        match = re.search(r"《(.+?)》", prompt)
+        course_name = match.group(1) if match else "课程"
+        return json.dumps(recommend_mock_resources(course_name), ensure_ascii=False)
+    if "课程大纲" in prompt and "章节列表" in prompt:
+        hours = _field(prompt, "学时数", "32")
+        outline = generate_mock_course_outline(
+            _field(prompt, "课程名称", "课程"),
+            _field(prompt, "教学目标"),
+            int(hours) if hours.isdigit() else 32,
+            _field(prompt, "教育阶段", "小学")
+        )
+        return json.dumps(outline, ensure_ascii=False)
+    if "待修改小节的当前内容" in prompt:
+        match = re.search(r"待修改小节的当前内容：\n(.*?)\n\n(?:重要政策要求|对话历史)", prompt, re.S)
+        section = match.group(1).strip() if match else "## 小节"
+        return f"{section}\n\n（已根据要求修改：{_field(prompt, '用户最新要求')}）"
+    if "当前讲义内容" in prompt:
+        match = re.search(r"当前讲义内容：\n(.*?)\n\n(?:重要政策要求|对话历史)", prompt, re.S)
+        current = match.group(1).strip() if match else ""
+        return update_lecture_with_mock(current, _field(prompt, "用户最新要求"))
+    if "章节名称" in prompt:
+        hours = _field(prompt, "学时", "2")
+        return generate_mock_lecture_content(
+            _field(prompt, "章节名称", "章节"),
+            _field(prompt, "章节重点"),
+            int(hours) if hours.isdigit() else 2,
+            _field(prompt, "教育阶段", "小学"),
+            _field(prompt, "生成语言", "中文")
+        )
+    return "这是本地LLM替身服务的回复。"
+
+
+def split_into_chunks(text, size=8):
+    return [text[i:i + size] for i in range(0, len(text), size)] or [""]
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    """处理 POST /v1/chat/completions，支持流式和非流式两种响应"""
+    protocol_version = "HTTP/1.1"  # 支持长连接，与线上接口的连接复用行为一致
+    disable_nagle_algorithm = True  # 响应头和响应体分两次写出，避免 Nagle 与延迟确认叠加出约40ms的额外延迟
+    server_version = "MockLLM/1.0"
+
+    def log_message(self, format, *args):
+        if self.server.options.verbose:
+            super().log_message(format, *args)
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"未知路径: {self.path}"}})
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+            prompt = "\n".join(m.get("content", "") for m in body.get("messages", []))
+        except (json.JSONDecodeError, AttributeError):
+            self._send_json(400, {"error": {"message": "请求体不是有效的JSON"}})
+            return
+
+        options = self.server.options
+        self.server.count_request()
+        if options.failure_rate and random.random() < options.failure_rate:
+            headers = {"Retry-After": str(options.retry_after)} if options.failure_status == 429 else {}
+            self._send_json(options.failure_status, {"error": {"message": "注入的故障"}}, headers)
+            return
+
+        content = self.server.replay.get(completion_record_key(prompt))
+        if content is None:
+            content = synthesize_completion(prompt)
+        usage = {
+            "prompt_tokens": estimate_tokens(prompt),
+            "completion_tokens": estimate_tokens(content),
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+
+        # 首字节延迟
+        if options.latency:
+            time.sleep(options.latency)
+        if body.get("stream"):
+            self._stream(body, content, usage)
+        else:
+            if options.tokens_per_second:
+                time.sleep(usage["completion_tokens"] / options.tokens_per_second)
+            self._send_json(200, {
+                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "mock"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+
+    def _stream(self, body, content, usage):
+        options = self.server.options
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def send_event(payload):
+            data = f"data: {payload}\n\n".encode("utf-8")
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+        def chunk(delta, finish_reason=None, **extra):
+            event = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get("model", "mock"),
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            event.update(extra)
+            return json.dumps(event, ensure_ascii=False)
+
+        send_event(chunk({"role": "assistant"}))
+        for piece in split_into_chunks(content):
+            if options.tokens_per_second:
+                time.sleep(estimate_tokens(piece) / options.tokens_per_second)
+            send_event(chunk({"content": piece}))
+        send_event(chunk({}, finish_reason="stop"))
+        if (body.get("stream_options") or {}).get("include_usage"):
+            send_event(json.dumps({"id": completion_id, "object": "chat.completion.chunk", "choices": [], "usage": usage}))
+        send_event("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class MockLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, options, replay=None):
+        super().__init__(address, MockLLMHandler)
+        self.options = options
+        self.replay = replay or {}
+        self.requests_served = 0
+        self._lock = threading.Lock()
+
+    def count_request(self):
+        with self._lock:
+            self.requests_served += 1
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="本地 OpenAI 兼容的LLM替身服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--latency", type=float, default=0.0, help="首字节延迟（秒）")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="生成速度，0 表示不限速")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="按该概率注入错误响应（0~1）")
+    parser.add_argument("--failure-status", type=int, default=500, help="注入错误时返回的状态码，429 会附带 Retry-After")
+    parser.add_argument("--retry-after", type=int, default=1, help="注入 429 时的 Retry-After 秒数")
+    parser.add_argument("--replay", help="LLM_RECORD_PATH 录制的JSONL文件，按提示词回放")
+    parser.add_argument("--verbose", action="store_true", help="打印每个请求的访问日志")
+    return parser.parse_args(argv)
+
+
+def start_server(options, block=True):
+    """启动替身服务；block=False 时在后台线程运行并返回 server，供基准测试脚本内嵌使用"""
+    replay = load_replay(options.replay) if options.replay else {}
+    server = MockLLMServer((options.host, options.port), options, replay)
+    if not block:
+        threading.Thread(target=server.serve_forever, name="mock-llm-server", daemon=True).start()
+        return server
+    print(f"本地LLM替身服务已启动: http://{options.host}:{server.server_port}/v1/chat/completions")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return server
+
+
+if __name__ == "__main__":
+    start_server(parse_args())
@@ -1,5 +1,8 @@
 # prompts.py - 更新所有提示词模板
 
+# 提示词模板版本：修改任意模板后请递增，使旧模板生成的缓存结果失效
+PROMPT_TEMPLATE_VERSION = 3
+
 PROMPT_COURSE_OUTLINE = """
 你是一名课程设计专家。请根据以下信息生成一门课程的结构化大纲：
 
@@ -199,4 +202,54 @@ PROMPT_UPDATE_LECTURE = """
 7. 必须严格符合教育政策/考试大纲的要求！
 
 请直接返回更新后的完整讲义内容，不要添加额外的说明。
-"""
\ No newline at end of file
+"""
+# 新增：只修改讲义中被点名章节的提示词，其余部分以提纲形式提供上下文
+PROMPT_UPDATE_SECTION = """
+你是一名教师，正在根据用户反馈修改讲义中的一个小节。
+
+教育阶段：{education_stage}
+生成语言：{generation_language}
+讲义提纲（标记为【待修改】的是本次需要修改的小节）：
+{lecture_outline}
+
+待修改小节的当前内容：
+{section_content}
+
+{policy_requirements}
+
+对话历史：
+{conversation_history}
+
+用户最新要求：
+{user_input}
+
+{education_stage_guidance}
+
+请只修改上面这一个小节，要求：
+1. 以原来的标题行开头，保持标题级别和Markdown格式不变
+2. 确保每个例题都有清晰的题目和解析部分，用数字编号
+3. 根据用户要求和教育阶段特点进行修改，内容与提纲中的其他小节衔接
+4. 使用{generation_language}生成内容
+5. 必须严格符合教育政策/考试大纲的要求！
+
+请直接返回修改后的这一小节，不要返回讲义的其他部分，也不要添加额外的说明。
+"""
+
+# 新增：结构化输出校验失败时，只重新生成不合格字段的提示词
+PROMPT_REPAIR_JSON = """
+你之前根据下面的任务生成了JSON，但其中部分字段不符合要求。
+
+原始任务：
+{task_prompt}
+
+需要修正的字段及问题：
+{field_errors}
+
+这些字段应满足的结构（JSON Schema）：
+{field_schema}
+
+这些字段当前的值：
+{current_values}
+
+请只重新生成上述需要修正的顶层字段，以JSON对象返回，例如 {{"字段名": 修正后的值}}，不要包含其他字段和说明文字。
+"""
@@ -0,0 +1,292 @@
+# storage.py - 课程数据持久化
+#
+# 课程大纲、讲义、修改对话等数据按课程ID保存到存储后端（默认SQLite），值为zlib压缩的JSON：
+#   课程基本信息   save_course / load_course
+#   讲义、修改对话  按 (类别, 键) 存放的条目，通过 LazyCourseMap 按需加载
+# 会话中只缓存访问过的条目，空闲超过 STORAGE_IDLE_EVICT_SECONDS 的会话缓存会被清空，
+# 服务器内存不再随会话数增长；服务重启或刷新页面后按课程ID恢复。
+# 清理只针对讲义和修改对话（LazyCourseMap 中的条目，占会话内存的绝大部分）。课程基本信息
+# （大纲、资源、政策要求等）每次页面运行都要用到且体积小，仍保存在 st.session_state 中，
+# 随 Streamlit 会话结束释放。
+import json
+import sqlite3
+import threading
+import time
+import uuid
+import weakref
+import zlib
+from abc import ABC, abstractmethod
+from collections.abc import MutableMapping
+
+from config import STORAGE_BACKEND, STORAGE_DB_PATH, STORAGE_COMPRESS_LEVEL
+from config import STORAGE_IDLE_EVICT_SECONDS, STORAGE_SWEEP_INTERVAL
+from logger import get_logger
+
+log = get_logger("storage")
+
+def pack(value):
+    """序列化为压缩的JSON字节串"""
+    raw = json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return zlib.compress(raw, STORAGE_COMPRESS_LEVEL)
+
+def unpack(blob):
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+def new_course_id():
+    return uuid.uuid4().hex[:16]
+
+class CourseStorage(ABC):
+    """存储后端接口：课程基本信息 + 按 (类别, 键) 存放的条目，值均为可JSON序列化的对象"""
+    name = "base"
+
+    @abstractmethod
+    def load_course(self, course_id):
+        """返回课程基本信息，不存在时返回None"""
+
+    @abstractmethod
+    def save_course(self, course_id, data):
+        """保存课程基本信息"""
+
+    @abstractmethod
+    def item_keys(self, course_id, kind):
+        """返回课程某类条目的全部键（不加载内容）"""
+
+    @abstractmethod
+    def load_item(self, course_id, kind, key):
+        """返回条目内容，不存在时返回None"""
+
+    @abstractmethod
+    def save_item(self, course_id, kind, key, value):
+        """保存条目"""
+
+    @abstractmethod
+    def delete_item(self, course_id, kind, key):
+        """删除条目"""
+
+class MemoryStorage(CourseStorage):
+    """进程内存储（不落盘），用于不需要持久化的部署；同样保存压缩后的数据"""
+    name = "memory"
+
+    def __init__(self):
+        self._courses = {}
+        self._items = {}  # (course_id, kind) -> {key: blob}
+        self._lock = threading.Lock()
+
+    def load_course(self, course_id):
+        with self._lock:
+            blob = self._courses.get(course_id)
+        return None if blob is None else unpack(blob)
+
+    def save_course(self, course_id, data):
+        blob = pack(data)
+        with self._lock:
+            self._courses[course_id] = blob
+
+    def item_keys(self, course_id, kind):
+        with self._lock:
+            return list(self._items.get((course_id, kind), {}))
+
+    def load_item(self, course_id, kind, key):
+        with self._lock:
+            blob = self._items.get((course_id, kind), {}).get(key)
+        return None if blob is None else unpack(blob)
+
+    def save_item(self, course_id, kind, key, value):
+        blob = pack(value)
+        with self._lock:
+            self._items.setdefault((course_id, kind), {})[key] = blob
+
+    def delete_item(self, course_id, kind, key):
+        with self._lock:
+            self._items.get((course_id, kind), {}).pop(key, None)
+
+class SQLiteStorage(CourseStorage):
+    """SQLite存储：所有会话共用一个连接，读写加锁"""
+    name = "sqlite"
+
+    def __init__(self, db_path=STORAGE_DB_PATH):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        # WAL 模式下读写互不阻塞，崩溃时也不会损坏已提交的数据
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS courses ("
+            "course_id TEXT PRIMARY KEY, data BLOB NOT NULL, updated REAL NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS course_items ("
+            "course_id TEXT NOT NULL, kind TEXT NOT NULL, key TEXT NOT NULL, data BLOB NOT NULL, updated REAL NOT NULL, "
+            "PRIMARY KEY (course_id, kind, key))"
+        )
+        self._db.commit()
+
+    def _execute(self, sql, args=(), fetch=None):
+        with self._lock:
+            cursor = self._db.execute(sql, args)
+            if fetch == "one":
+                return cursor.fetchone()
+            if fetch == "all":
+                return cursor.fetchall()
+            self._db.commit()
+
+    def load_course(self, course_id):
+        row = self._execute("SELECT data FROM courses WHERE course_id = ?", (course_id,), fetch="one")
+        return None if row is None else unpack(row[0])
+
+    def save_course(self, course_id, data):
+        self._execute("INSERT OR REPLACE INTO courses (course_id, data, updated) VALUES (?, ?, ?)",
+                      (course_id, pack(data), time.time()))
+
+    def item_keys(self, course_id, kind):
+        rows = self._execute("SELECT key FROM course_items WHERE course_id = ? AND kind = ?", (course_id, kind), fetch="all")
+        return [row[0] for row in rows]
+
+    def load_item(self, course_id, kind, key):
+        row = self._execute("SELECT data FROM course_items WHERE course_id = ? AND kind = ? AND key = ?",
+                            (course_id, kind, key), fetch="one")
+        return None if row is None else unpack(row[0])
+
+    def save_item(self, course_id, kind, key, value):
+        self._execute("INSERT OR REPLACE INTO course_items (course_id, kind, key, data, updated) VALUES (?, ?, ?, ?, ?)",
+                      (course_id, kind, key, pack(value), time.time()))
+
+    def delete_item(self, course_id, kind, key):
+        self._execute("DELETE FROM course_items WHERE course_id = ? AND kind = ? AND key = ?", (course_id, kind, key))
+
+_MISSING = object()
+
+# 所有会话中的 LazyCourseMap，用于清理空闲会话的缓存
+_live_maps = weakref.WeakSet()
+_live_maps_lock = threading.Lock()
+_last_sweep = 0.0
+
+class LazyCourseMap(MutableMapping):
+    """按需加载的课程条目字典（讲义、修改对话），写入时同步保存到存储后端
+
+    只缓存访问过的条目，判断键是否存在不加载内容。
+    原地修改条目（如向对话列表追加消息）后需调用 save(key) 保存。
+    """
+
+    def __init__(self, storage, course_id, kind):
+        self.storage = storage
+        self.course_id = course_id
+        self.kind = kind
+        self._keys = set(storage.item_keys(course_id, kind))
+        self._cache = {}
+        self.last_access = time.time()
+        with _live_maps_lock:
+            _live_maps.add(self)
+
+    def __getitem__(self, key):
+        self.last_access = time.time()
+        value = self._cache.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        if key not in self._keys:
+            raise KeyError(key)
+        value = self.storage.load_item(self.course_id, self.kind, key)
+        if value is None:
+            self._keys.discard(key)
+            raise KeyError(key)
+        self._cache[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self.last_access = time.time()
+        self.storage.save_item(self.course_id, self.kind, key, value)
+        self._keys.add(key)
+        self._cache[key] = value
+
+    def __delitem__(self, key):
+        if key not in self._keys:
+            raise KeyError(key)
+        self.storage.delete_item(self.course_id, self.kind, key)
+        self._keys.discard(key)
+        self._cache.pop(key, None)
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __iter__(self):
+        return iter(list(self._keys))
+
+    def __len__(self):
+        return len(self._keys)
+
+    # Mapping 默认按内容比较（会加载全部条目）且不可哈希；这里按对象身份比较，以便放入 WeakSet
+    def __eq__(self, other):
+        return self is other
+
+    __hash__ = object.__hash__
+
+    def save(self, key):
+        """保存被原地修改过的条目"""
+        value = self._cache.get(key, _MISSING)
+        if value is not _MISSING:
+            self.storage.save_item(self.course_id, self.kind, key, value)
+
+    def evict(self):
+        """清空缓存的条目内容，下次访问时重新从存储后端加载"""
+        self._cache.clear()
+
+def evict_idle_sessions(max_idle=STORAGE_IDLE_EVICT_SECONDS):
+    """清空空闲超过 max_idle 秒的会话缓存的讲义和修改对话，返回清理的条目数
+
+    课程基本信息保存在各会话的 st.session_state 中，不在清理范围内。
+    """
+    now = time.time()
+    with _live_maps_lock:
+        maps = list(_live_maps)
+    evicted = 0
+    for course_map in maps:
+        if course_map._cache and now - course_map.last_access > max_idle:
+            evicted += len(course_map._cache)
+            course_map.evict()
+    if evicted:
+        log.info("已清理空闲会话缓存的 %d 个条目", evicted)
+    return evicted
+
+def maybe_evict_idle_sessions():
+    """每隔 STORAGE_SWEEP_INTERVAL 秒最多清理一次，供每次页面运行时调用"""
+    global _last_sweep
+    now = time.time()
+    if now - _last_sweep < STORAGE_SWEEP_INTERVAL:
+        return 0
+    _last_sweep = now
+    return evict_idle_sessions()
+
+def get_storage_stats():
+    """返回存储后端名称、活跃的条目字典数和缓存中的条目数"""
+    with _live_maps_lock:
+        maps = list(_live_maps)
+    return {
+        "backend": get_storage().name,
+        "maps": len(maps),
+        "cached_items": sum(len(course_map._cache) for course_map in maps),
+        "stored_keys": sum(len(course_map._keys) for course_map in maps)
+    }
+
+_storage_backends = {
+    "sqlite": SQLiteStorage,
+    "memory": MemoryStorage
+}
+_storage = None
+_storage_lock = threading.Lock()
+
+def register_storage_backend(name, factory):
+    """注册存储后端，factory 无参调用后返回 CourseStorage 实例"""
+    _storage_backends[name] = factory
+
+def get_storage():
+    """获取进程级共享的存储后端（由 STORAGE_BACKEND 选择），SQLite不可用时退化为内存存储"""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                factory = _storage_backends.get(STORAGE_BACKEND, SQLiteStorage)
+                try:
+                    _storage = factory()
+                except sqlite3.Error as e:
+                    log.warning("存储后端初始化失败，课程数据仅保存在内存中: %s", e)
+                    _storage = MemoryStorage()
+    return _storage
@@ -0,0 +1,121 @@
+# text_layout.py - PPT文本排版测量
+#
+# 按模板中内容占位符的实际尺寸和字号计算每行能放下多少文字，再把段落依次装入幻灯片：
+#   字宽      ASCII 使用 Arial/Helvetica 的字宽表，全角字符（中日韩文字和全角标点）按 1em 计算，
+#             其余字符按 east_asian_width 归类后缓存
+#   折行      逐字累加宽度，中文可在任意字之间折行，西文在空格处折行（单词超过整行时强制断开）
+#   分页      贪心装箱：段落按顺序放入当前页，放不下的行移到续页，一次线性扫描完成
+# 不需要反复渲染试排，字体度量为近似值，排版时留出 PPT_LAYOUT_FILL_RATIO 的余量。
+import unicodedata
+from functools import lru_cache
+
+from config import PPT_LINE_SPACING, PPT_PARAGRAPH_SPACING, PPT_LAYOUT_FILL_RATIO
+
+EMU_PER_PT = 12700
+
+# 文本框默认内边距：左右 0.1 英寸，上下 0.05 英寸
+_INSET_X = 91440
+_INSET_Y = 45720
+# 内容占位符首级段落的默认左缩进（项目符号位置）
+_BULLET_INDENT = 342900
+
+# Arial/Helvetica 字宽（1/1000 em），依次对应 ASCII 32~126
+_LATIN_WIDTHS = (
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+    1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+    333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+    556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584
+)
+_GLYPH_WIDTHS = {chr(32 + index): width / 1000 for index, width in enumerate(_LATIN_WIDTHS)}
+_GLYPH_WIDTHS["\t"] = 4 * _GLYPH_WIDTHS[" "]
+
+@lru_cache(maxsize=8192)
+def _wide_glyph_width(ch):
+    if unicodedata.combining(ch):
+        return 0.0
+    # 全角（F）、宽字符（W）和中文字体中按全角显示的歧义字符（A，如“”、×）
+    return 1.0 if unicodedata.east_asian_width(ch) in ("F", "W", "A") else 0.556
+
+def glyph_width(ch):
+    """单个字符的宽度（em）"""
+    width = _GLYPH_WIDTHS.get(ch)
+    return width if width is not None else _wide_glyph_width(ch)
+
+def _is_wide(ch):
+    return ch not in _GLYPH_WIDTHS and _wide_glyph_width(ch) == 1.0
+
+class TextLayout:
+    """某个文本区域在给定字号下的折行和分页计算；宽、高、字号和缩进的单位均为EMU"""
+
+    def __init__(self, width, height, font_size, indent=_BULLET_INDENT):
+        self.font_size = font_size / EMU_PER_PT  # 字号（磅）
+        # 可用行宽，单位 em，留出字体度量误差的余量
+        self.line_width = max(1.0, (width - 2 * _INSET_X - indent) / font_size * PPT_LAYOUT_FILL_RATIO)
+        self.height = max(0.0, (height - 2 * _INSET_Y) / EMU_PER_PT * PPT_LAYOUT_FILL_RATIO)  # 可用高度（磅）
+        self.line_height = self.font_size * PPT_LINE_SPACING
+        self.paragraph_spacing = self.font_size * PPT_PARAGRAPH_SPACING
+
+    def _line_spans(self, text):
+        """折行结果：各行在文本中的 (起, 止) 位置；空文本返回一个空行"""
+        spans = []
+        start = 0
+        width = 0.0
+        last_break = -1  # 最近一个可折行位置（该位置之前的文字留在本行）
+        previous_wide = False
+        for index, ch in enumerate(text):
+            wide = _is_wide(ch)
+            if ch == " ":
+                last_break = index + 1
+            elif (wide or previous_wide) and index > start:
+                # 全角字符前后都可以折行
+                last_break = index
+            previous_wide = wide
+            width += glyph_width(ch)
+            if width > self.line_width and index > start:
+                cut = last_break if start < last_break <= index else index
+                spans.append((start, cut))
+                start = cut
+                # 重新计算被挪到下一行的文字的宽度
+                width = sum(glyph_width(c) for c in text[start:index + 1])
+                last_break = -1
+        spans.append((start, len(text)))
+        return spans
+
+    def wrap(self, text):
+        """把一段文本折成若干行，返回各行文本"""
+        return [text[start:end].rstrip(" ") for start, end in self._line_spans(text)]
+
+    def line_count(self, text):
+        return len(self._line_spans(text))
+
+    def paginate(self, paragraphs):
+        """把段落依次装入页面，返回每页的段落列表；放不下的段落在行边界处拆到下一页"""
+        pages = []
+        page = []
+        used = 0.0
+        for paragraph in paragraphs:
+            spans = self._line_spans(paragraph)
+            while spans:
+                available = int((self.height - used - self.paragraph_spacing) // self.line_height)
+                if available <= 0 and page:
+                    pages.append(page)
+                    page, used = [], 0.0
+                    continue
+                # 空白页至少放一行，避免极端的模板尺寸导致死循环
+                taken = spans[:max(1, available)]
+                spans = spans[len(taken):]
+                page.append(paragraph[taken[0][0]:taken[-1][1]].strip(" "))
+                used += self.paragraph_spacing + len(taken) * self.line_height
+                if spans:
+                    pages.append(page)
+                    page, used = [], 0.0
+        if page:
+            pages.append(page)
+        return pages
+
+@lru_cache(maxsize=64)
+def get_text_layout(width, height, font_size, indent=_BULLET_INDENT):
+    """按区域尺寸和字号缓存 TextLayout，同一模板的各页共用"""
+    return TextLayout(width, height, font_size, indent)
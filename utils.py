@@ -1,20 +1,54 @@
 # utils.py - 工具函数（优化网络连接和重试策略，兼容不同版本urllib3）
+import asyncio
+import httpx
 import requests
 import json
 import time
 import random
 import re
 import os
+import threading
+import hashlib
+import sqlite3
+import weakref
+import heapq
+import itertools
+import copy
+import multiprocessing
+from collections import OrderedDict
+from functools import lru_cache
+from concurrent.futures import Future
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 from docx import Document
 from docx.shared import Inches, Pt
 from docx.enum.text import WD_ALIGN_PARAGRAPH
+from docx.enum.style import WD_STYLE_TYPE
+from pptx import Presentation
+from pptx.util import Inches as PptInches, Pt as PptPt
+from pptx.enum.text import PP_ALIGN
+from pptx.dml.color import RGBColor
 import io
+from urllib.parse import urlparse
 import PyPDF2
 from docx import Document
 # 更新导入语句，使用新的配置变量
 from config import DEEPSEEK_API_KEY, DEEPSEEK_API_URL, MAX_RETRIES, CONNECT_TIMEOUT, READ_TIMEOUT, BACKOFF_FACTOR
+from config import POOL_CONNECTIONS, POOL_MAXSIZE, POOL_BLOCK
+from config import CACHE_ENABLED, CACHE_TTL, CACHE_MEMORY_MAX_ENTRIES, CACHE_DB_PATH, CACHE_DISK_MAX_BYTES
+from config import SECTION_REVISION_ENABLED, SECTION_REVISION_MAX_RATIO
+from config import SCHEDULER_MAX_CONCURRENCY, RATE_LIMIT_RPS, RATE_LIMIT_TPM
+from config import PROMPT_TOKEN_BUDGET, HISTORY_TOKEN_BUDGET
+from config import LLM_BACKEND, LOCAL_LLM_URL, LLM_RECORD_PATH
+from config import METRICS_ENABLED
+from config import PPT_TEMPLATE_DIR, PPT_TEMPLATE_COPY_MAX_RATIO, PPT_CONTENT_FONT_SIZE
+from markdown_ast import parse_markdown
+from text_layout import get_text_layout
+import metrics
+from logger import get_logger, truncate, log_fields, sampled
+from config import CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RECOVERY_TIMEOUT, REQUEST_DEADLINE, RETRY_BACKOFF_BASE, RETRY_BACKOFF_MAX
+
+log = get_logger("utils")
 
 # 添加文件解析函数
 def parse_uploaded_file(uploaded_file):
@@ -79,15 +113,25 @@ def extract_key_requirements(content, max_length=1000):
     
     return result_content
 
-def create_session_with_retries():
-    """创建带有重试机制的会话，兼容不同版本的 urllib3"""
+def create_session_with_retries(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, pool_block=POOL_BLOCK):
+    """创建带有重试机制和连接池的会话，兼容不同版本的 urllib3"""
     session = requests.Session()
+    # 显式声明长连接，复用TCP/TLS连接
+    session.headers.update({"Connection": "keep-alive"})
     
     # 尝试不同的参数组合以适应不同版本的 urllib3
+    # urllib3 只重试建立连接阶段的失败（请求尚未发出，重试是安全且快速的）；
+    # 读取超时和 5xx 由 call_deepseek 在熔断器和时间预算内统一重试，避免两层重试叠加
     retry_params = {
         "total": MAX_RETRIES,
+        "connect": MAX_RETRIES,
+        "read": 0,
+        "status": 0,
         "backoff_factor": BACKOFF_FACTOR,
-        "status_forcelist": [429, 500, 502, 503, 504],
+        # 带 Retry-After 的 429/503 也不由 urllib3 自行等待重试，交给 call_deepseek 的退避和调度器处理
+        "respect_retry_after_header": False,
+        # 状态码重试次数用尽时返回响应本身而不是抛出 RetryError，由调用方按状态码处理
+        "raise_on_status": False,
     }
     
     # 尝试添加方法限制参数，使用不同版本的参数名
@@ -113,12 +157,33 @@ def create_session_with_retries():
             retry_strategy = Retry(**retry_params)
     
     # 创建适配器并挂载到会话
-    adapter = HTTPAdapter(max_retries=retry_strategy, pool_connections=10, pool_maxsize=10)
+    adapter = HTTPAdapter(
+        max_retries=retry_strategy,
+        pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize,
+        pool_block=pool_block
+    )
+    if METRICS_ENABLED:
+        # 换用会记录建立连接耗时的连接池类
+        adapter.poolmanager.pool_classes_by_scheme = metrics.TIMED_POOL_CLASSES
     session.mount("https://", adapter)
     session.mount("http://", adapter)
     
     return session
 
+# 含拉丁字母的讲义使用英文字体
+_LATIN_CHAR_RE = re.compile(r"[A-Za-z]")
+
+def _contains_latin(content):
+    return _LATIN_CHAR_RE.search(content) is not None
+
+# Word 字符样式：代码块和行内代码共用，每个文档只定义一次，文本块只引用样式ID
+WORD_CODE_STYLE = "Lecture Code"
+
+def _set_paragraph_style(paragraph, style_id):
+    """直接写入段落样式ID；python-docx 按名称或样式对象赋值时每次都要遍历文档的全部样式"""
+    paragraph._p.get_or_add_pPr().style = style_id
+
 # 添加Word文档生成函数
 def generate_word_document(content, filename="lecture.docx"):
     """将Markdown内容转换为格式规范的Word文档"""
@@ -127,9 +192,9 @@ def generate_word_document(content, filename="lecture.docx"):
         doc = Document()
         
         # 检测内容语言，设置相应的字体
-        is_english = any(char in 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ' for char in content)
+        is_english = _contains_latin(content)
         
-        # 设置文档默认样式
+        # 设置文档默认样式：正文文本块不再逐个设置字体，统一继承 Normal 样式
         style = doc.styles['Normal']
         font = style.font
         if is_english:
@@ -144,9 +209,17 @@ def generate_word_document(content, filename="lecture.docx"):
         style.paragraph_format.space_after = Pt(6)
         style.paragraph_format.line_spacing = 1.5
         
-        # 设置标题样式
-        for i in range(1, 6):
+        # 设置标题样式（含段前段后间距，一级标题居中）
+        heading_ids = {}
+        for i in range(1, 7):
             heading_style = doc.styles[f'Heading {i}']
+            heading_ids[i] = heading_style.style_id
+            heading_style.paragraph_format.space_before = Pt(12)
+            heading_style.paragraph_format.space_after = Pt(6)
+            if i == 1:
+                heading_style.paragraph_format.alignment = WD_ALIGN_PARAGRAPH.CENTER
+            if i > 5:
+                continue
             heading_font = heading_style.font
             heading_font.name = heading_font_name
             heading_font.bold = True
@@ -157,107 +230,65 @@ def generate_word_document(content, filename="lecture.docx"):
             else:
                 heading_font.size = Pt(12)
         
-        # 分割内容为行
-        lines = content.split('\n')
-        in_code_block = False
-        code_lines = []
+        # 列表样式
+        list_ids = {}
+        for kind, name in (("bullet", 'List Bullet'), ("numbered", 'List Number')):
+            list_style = doc.styles[name]
+            list_style.paragraph_format.space_after = Pt(3)
+            list_ids[kind] = list_style.style_id
         
-        # 处理每一行
-        for line in lines:
-            line = line.strip()
-            if not line:
+        # 代码字符样式：代码块使用等宽字体
+        code_style = doc.styles.add_style(WORD_CODE_STYLE, WD_STYLE_TYPE.CHARACTER)
+        code_style.font.name = 'Consolas' if is_english else '宋体'
+        code_style.font.size = Pt(10)
+        code_style_id = code_style.style_id
+        table_style_id = doc.styles['Table Grid'].style_id
+
+        def add_spans(paragraph, spans):
+            """按解析出的行内格式添加文本（粗体、行内代码）"""
+            for text, bold, code in spans:
+                if not text:
+                    continue
+                run = paragraph.add_run(text)
+                if code:
+                    run._r.style = code_style_id
+                if bold:
+                    run.bold = True
+
+        # 按解析好的块逐个渲染（解析结果与PPT导出共用）
+        for block in parse_markdown(content):
+            kind = block.kind
+            if kind == "blank":
                 # 空行添加间距
                 doc.add_paragraph()
-                continue
-                
-            # 处理代码块
-            if line.startswith('```'):
-                if in_code_block:
-                    # 结束代码块
-                    in_code_block = False
-                    if code_lines:
-                        code_paragraph = doc.add_paragraph()
-                        code_paragraph.alignment = WD_ALIGN_PARAGRAPH.LEFT
-                        for code_line in code_lines:
-                            code_run = code_paragraph.add_run(code_line + '\n')
-                            # 代码块使用等宽字体
-                            code_run.font.name = 'Consolas' if is_english else '宋体'
-                            code_run.font.size = Pt(10)
-                        code_lines = []
-                else:
-                    # 开始代码块
-                    in_code_block = True
-                continue
-            
-            if in_code_block:
-                code_lines.append(line)
-                continue
-                
-            # 处理标题 - 改进正则表达式匹配
-            heading_match = re.match(r'^(#{1,6})\s+(.*)', line)
-            if heading_match:
-                level = len(heading_match.group(1))
-                heading_text = heading_match.group(2).strip()
-                # 限制标题级别在1-6之间
-                level = max(1, min(6, level))
-                heading = doc.add_heading(heading_text, level=level)
-                if level == 1:
-                    heading.alignment = WD_ALIGN_PARAGRAPH.CENTER
-                heading.paragraph_format.space_before = Pt(12)
-                heading.paragraph_format.space_after = Pt(6)
-                continue
-            
-            # 处理列表项
-            elif line.startswith('- ') or line.startswith('* '):
-                p = doc.add_paragraph(style='List Bullet')
-                run = p.add_run(line[2:])
-                run.font.name = 'Times New Roman' if is_english else '宋体'
-                p.paragraph_format.left_indent = Inches(0.25)
-                p.paragraph_format.space_after = Pt(3)
-            # 处理数字列表
-            elif re.match(r'^\d+\.\s', line):
-                p = doc.add_paragraph(style='List Number')
-                run = p.add_run(line[line.find(' ')+1:])
-                run.font.name = 'Times New Roman' if is_english else '宋体'
-                p.paragraph_format.left_indent = Inches(0.25)
-                p.paragraph_format.space_after = Pt(3)
-            # 处理表格行
-            elif '|' in line and re.match(r'^[\s|:-]+$', line) is None:
-                # 简单的表格处理
-                cells = [cell.strip() for cell in line.split('|') if cell.strip()]
-                if cells and not any(cell.startswith('--') for cell in cells):
-                    # 添加表格
-                    if 'table' not in locals():
-                        table = doc.add_table(rows=1, cols=len(cells))
-                        table.style = 'Table Grid'
-                        hdr_cells = table.rows[0].cells
-                        for i, cell in enumerate(cells):
-                            p = hdr_cells[i].paragraphs[0]
-                            run = p.add_run(cell)
-                            run.font.bold = True
-                            run.font.name = 'Times New Roman' if is_english else '宋体'
-                    else:
-                        row_cells = table.add_row().cells
-                        for i, cell in enumerate(cells):
-                            p = row_cells[i].paragraphs[0]
-                            run = p.add_run(cell)
-                            run.font.name = 'Times New Roman' if is_english else '宋体'
-            # 处理粗体文本
-            elif '**' in line:
+            elif kind == "heading":
+                heading = doc.add_paragraph()
+                _set_paragraph_style(heading, heading_ids[block.level])
+                heading.add_run(block.text)
+            elif kind == "code":
+                if block.lines:
+                    # 整个代码块放在一个文本块中，行之间为换行符
+                    code_paragraph = doc.add_paragraph()
+                    code_paragraph.add_run("\n".join(block.lines))._r.style = code_style_id
+            elif kind in ("bullet", "numbered"):
                 p = doc.add_paragraph()
-                parts = line.split('**')
-                for i, part in enumerate(parts):
-                    if part:  # 跳过空字符串
-                        run = p.add_run(part)
-                        run.font.name = 'Times New Roman' if is_english else '宋体'
-                        if i % 2 == 1:  # 奇数索引部分是粗体
+                _set_paragraph_style(p, list_ids[kind])
+                add_spans(p, block.spans)
+                # 列表缩进由编号定义决定，样式中的缩进会被覆盖，这里仍需直接设置
+                p.paragraph_format.left_indent = Inches(0.25)
+            elif kind == "table":
+                columns = len(block.rows[0])
+                table = doc.add_table(rows=1, cols=columns)
+                table._tbl.tblPr.style = table_style_id
+                for row_index, cells in enumerate(block.rows):
+                    row_cells = table.rows[0].cells if row_index == 0 else table.add_row().cells
+                    # 列数以表头为准，多出的单元格忽略
+                    for i, cell in enumerate(cells[:columns]):
+                        run = row_cells[i].paragraphs[0].add_run(cell)
+                        if row_index == 0:
                             run.bold = True
-            # 普通段落
             else:
-                p = doc.add_paragraph()
-                run = p.add_run(line)
-                run.font.name = 'Times New Roman' if is_english else '宋体'
-                p.paragraph_format.space_after = Pt(6)
+                add_spans(doc.add_paragraph(), block.spans)
         
         # 保存到字节流
         file_stream = io.BytesIO()
@@ -267,9 +298,7 @@ def generate_word_document(content, filename="lecture.docx"):
         return file_stream, filename
         
     except Exception as e:
-        print(f"生成Word文档时出错: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception("生成Word文档时出错: %s", e)
         return None, None
 
 # 添加保存Word文档的函数
@@ -279,55 +308,1014 @@ def save_lecture_to_word(lecture_content, chapter_name):
     return file_stream, filename
 
 
-# 创建全局会话
-session = create_session_with_retries()
+# 进程级共享会话：所有Streamlit会话和线程共用同一个连接池
+# urllib3 的连接池本身是线程安全的，会话只在首次使用时创建一次
+_shared_session = None
+_shared_session_lock = threading.Lock()
+
+# 连接池使用统计（请求总数、进行中的请求数、失败数）
+_pool_counters = {"requests": 0, "in_flight": 0, "errors": 0}
+_pool_counters_lock = threading.Lock()
+
+def get_shared_session():
+    """获取进程级共享的HTTP会话（带连接池和重试机制）"""
+    global _shared_session
+    if _shared_session is None:
+        with _shared_session_lock:
+            if _shared_session is None:
+                _shared_session = create_session_with_retries()
+    return _shared_session
+
+def _track_pool_request(delta_in_flight, failed=False):
+    """更新连接池使用计数"""
+    with _pool_counters_lock:
+        if delta_in_flight > 0:
+            _pool_counters["requests"] += 1
+        _pool_counters["in_flight"] += delta_in_flight
+        if failed:
+            _pool_counters["errors"] += 1
+
+def get_pool_stats():
+    """返回共享连接池的健康状况，用于诊断连接复用情况"""
+    with _pool_counters_lock:
+        stats = dict(_pool_counters)
+    
+    pools = []
+    if _shared_session is not None:
+        adapter = _shared_session.get_adapter("https://")
+        for key in adapter.poolmanager.pools.keys():
+            pool = adapter.poolmanager.pools.get(key)
+            if pool is None:
+                continue
+            # 队列中预置了None占位符，只统计真正保持着的空闲连接
+            idle = sum(1 for conn in list(pool.pool.queue) if conn is not None) if pool.pool is not None else 0
+            pools.append({
+                "host": f"{pool.host}:{pool.port}",
+                "connections_created": pool.num_connections,  # 新建连接（握手）次数
+                "requests": pool.num_requests,
+                "idle_connections": idle,
+                "maxsize": pool.pool.maxsize if pool.pool is not None else 0,
+            })
+    
+    created = sum(p["connections_created"] for p in pools)
+    served = sum(p["requests"] for p in pools)
+    stats["pools"] = pools
+    # 连接复用率：越接近1说明握手越少
+    stats["reuse_ratio"] = round(1 - created / served, 3) if served else None
+    return stats
+
+# 异步运行时：非流式LLM请求都在事件循环中发出，几十个长时间请求只占用协程而不是线程。
+# 同步接口（call_deepseek、generate_course_outline 等）是对 *_async 版本的薄封装，
+# 把协程提交到进程级后台事件循环执行，同步和异步调用方因此共用同一个连接池和调度器。
+_async_loop = None
+_async_loop_thread = None
+_async_loop_lock = threading.Lock()
+
+# httpx 客户端不能跨事件循环使用：后台事件循环一个，调用方自己的事件循环（如异步Web服务）各一个
+_async_clients = weakref.WeakKeyDictionary()
+
+def _get_async_loop():
+    """获取进程级后台事件循环，首次调用时在守护线程中启动"""
+    global _async_loop, _async_loop_thread
+    if _async_loop is None:
+        with _async_loop_lock:
+            if _async_loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name="llm-event-loop", daemon=True)
+                thread.start()
+                _async_loop_thread = thread
+                _async_loop = loop
+    return _async_loop
+
+def run_sync(coro):
+    """在后台事件循环中执行协程并等待结果，供同步调用方使用
+    
+    调用方正在记录的操作会传入协程，耗时仍记到同一条记录上。
+    """
+    loop = _get_async_loop()
+    if threading.current_thread() is _async_loop_thread:
+        coro.close()
+        raise RuntimeError("不能在后台事件循环中调用同步接口，请改用对应的 *_async 函数")
+    trace = metrics.current_trace()
+    
+    async def runner():
+        with metrics.use_trace(trace):
+            return await coro
+    
+    return asyncio.run_coroutine_threadsafe(runner(), loop).result()
+
+def get_async_client():
+    """获取当前事件循环共享的 httpx.AsyncClient（带连接池和长连接）"""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        limits = httpx.Limits(max_connections=POOL_MAXSIZE, max_keepalive_connections=POOL_MAXSIZE)
+        # 与同步会话一致：传输层只重试建立连接阶段的失败，读取超时和 5xx 由 call_deepseek_async 统一重试
+        transport = httpx.AsyncHTTPTransport(retries=MAX_RETRIES, limits=limits)
+        client = httpx.AsyncClient(transport=transport, timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT))
+        _async_clients[loop] = client
+    return client
+
+class LLMResponseCache:
+    """LLM响应缓存：内存LRU + SQLite磁盘两级缓存，支持TTL过期和容量淘汰
+    
+    以 (模型, 温度, 提示词, 提示词模板版本) 的哈希作为键，只缓存成功的文本响应。
+    """
+    
+    def __init__(self, db_path=CACHE_DB_PATH, ttl=CACHE_TTL,
+                 memory_max_entries=CACHE_MEMORY_MAX_ENTRIES, disk_max_bytes=CACHE_DISK_MAX_BYTES):
+        self.ttl = ttl
+        self.memory_max_entries = memory_max_entries
+        self.disk_max_bytes = disk_max_bytes
+        self._memory = OrderedDict()  # key -> (value, created)
+        self._lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0, "memory_evictions": 0, "disk_evictions": 0}
+        self._db = None
+        if db_path:
+            try:
+                self._db = sqlite3.connect(db_path, check_same_thread=False)
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS llm_cache ("
+                    "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                    "created REAL NOT NULL, last_access REAL NOT NULL)"
+                )
+                self._db.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_access ON llm_cache(last_access)")
+                self._db.commit()
+            except sqlite3.Error as e:
+                # 磁盘缓存不可用时退化为纯内存缓存
+                log.warning("磁盘缓存初始化失败，仅使用内存缓存: %s", e)
+                self._db = None
+    
+    @staticmethod
+    def make_key(model, temperature, prompt, template_version, response_format=None):
+        """根据模型、温度、提示词、模板版本和输出格式生成内容寻址的缓存键"""
+        key_parts = [model, temperature, template_version, prompt]
+        if response_format is not None:
+            key_parts.append(response_format)
+        raw = json.dumps(key_parts, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+    
+    def get(self, key):
+        """读取缓存，未命中或已过期返回None"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, created = entry
+                if now - created <= self.ttl:
+                    self._memory.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    return value
+                del self._memory[key]
+            
+            if self._db is not None:
+                try:
+                    row = self._db.execute(
+                        "SELECT value, created FROM llm_cache WHERE key = ?", (key,)
+                    ).fetchone()
+                    if row is not None:
+                        value, created = row
+                        if now - created <= self.ttl:
+                            self._db.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+                            self._db.commit()
+                            self._remember(key, value, created)
+                            self._stats["disk_hits"] += 1
+                            return value
+                        self._db.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                        self._db.commit()
+                except sqlite3.Error as e:
+                    log.warning("读取磁盘缓存失败: %s", e)
+            
+            self._stats["misses"] += 1
+            return None
+    
+    def set(self, key, value):
+        """写入两级缓存，并按容量淘汰最久未使用的条目"""
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, now)
+            self._stats["writes"] += 1
+            if self._db is None:
+                return
+            try:
+                size = len(value.encode("utf-8"))
+                self._db.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, value, size, created, last_access) VALUES (?, ?, ?, ?, ?)",
+                    (key, value, size, now, now)
+                )
+                self._db.execute("DELETE FROM llm_cache WHERE created < ?", (now - self.ttl,))
+                total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+                if total > self.disk_max_bytes:
+                    # 按最近访问时间从旧到新删除，直到总大小回到上限以内
+                    rows = self._db.execute("SELECT key, size FROM llm_cache ORDER BY last_access").fetchall()
+                    stale_keys = []
+                    for stale_key, stale_size in rows:
+                        if total <= self.disk_max_bytes:
+                            break
+                        stale_keys.append((stale_key,))
+                        total -= stale_size
+                    self._db.executemany("DELETE FROM llm_cache WHERE key = ?", stale_keys)
+                    self._stats["disk_evictions"] += len(stale_keys)
+                self._db.commit()
+            except sqlite3.Error as e:
+                log.warning("写入磁盘缓存失败: %s", e)
+    
+    def _remember(self, key, value, created):
+        """写入内存LRU（调用方需持有锁）"""
+        self._memory[key] = (value, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_max_entries:
+            self._memory.popitem(last=False)
+            self._stats["memory_evictions"] += 1
+    
+    def stats(self):
+        """返回命中/未命中计数和当前缓存规模"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+            lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+            stats["hit_rate"] = round((stats["memory_hits"] + stats["disk_hits"]) / lookups, 3) if lookups else None
+            if self._db is not None:
+                try:
+                    count, total = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache").fetchone()
+                    stats["disk_entries"] = count
+                    stats["disk_bytes"] = total
+                except sqlite3.Error:
+                    pass
+            return stats
+
+_llm_cache = None
+_llm_cache_lock = threading.Lock()
+
+def get_llm_cache():
+    """获取进程级共享的LLM响应缓存，缓存被禁用时返回None"""
+    global _llm_cache
+    if not CACHE_ENABLED:
+        return None
+    if _llm_cache is None:
+        with _llm_cache_lock:
+            if _llm_cache is None:
+                _llm_cache = LLMResponseCache()
+    return _llm_cache
+
+class LLMBackend:
+    """LLM后端：决定请求发往哪个 chat-completions 接口以及如何鉴权
+    
+    请求体和响应格式统一使用 OpenAI 兼容协议，调度、重试、熔断和缓存与后端无关。
+    """
+    name = "base"
+    description = "LLM服务"
+    
+    def __init__(self, url):
+        self.url = url
+    
+    def is_configured(self):
+        return True
+    
+    def config_error(self):
+        return {"error": f"{self.description}未配置"}
+    
+    def headers(self, stream=False):
+        headers = {"Content-Type": "application/json"}
+        if stream:
+            headers["Accept"] = "text/event-stream"
+        return headers
+    
+    def address(self):
+        """返回 (主机, 端口)，用于连接失败时的网络诊断"""
+        parsed = urlparse(self.url)
+        return parsed.hostname, parsed.port or (443 if parsed.scheme == "https" else 80)
+
+class OpenAICompatibleBackend(LLMBackend):
+    """使用 Bearer 密钥鉴权的 OpenAI 兼容接口（DeepSeek、本地替身服务等）"""
+    
+    def __init__(self, name, url, api_key=None, description=None, require_key=True):
+        super().__init__(url)
+        self.name = name
+        self.api_key = api_key
+        self.description = description or name
+        self.require_key = require_key
+    
+    def is_configured(self):
+        if not self.require_key:
+            return True
+        return bool(self.api_key) and self.api_key != "你的API密钥"
+    
+    def config_error(self):
+        if self.name == "deepseek":
+            return {"error": "未设置DeepSeek API密钥，请在.env文件中设置DEEPSEEK_API_KEY"}
+        return {"error": f"未设置{self.description}的API密钥"}
+    
+    def headers(self, stream=False):
+        headers = super().headers(stream)
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        return headers
+
+_llm_backends = {
+    "deepseek": OpenAICompatibleBackend("deepseek", DEEPSEEK_API_URL, DEEPSEEK_API_KEY, description="DeepSeek API"),
+    # 本地替身服务（mock_llm_server.py），用于离线压测和基准测试
+    "local": OpenAICompatibleBackend("local", LOCAL_LLM_URL, description="本地LLM服务", require_key=False)
+}
+_active_llm_backend = _llm_backends.get(LLM_BACKEND, _llm_backends["deepseek"])
+
+def register_llm_backend(backend):
+    """注册一个可通过名称切换的后端"""
+    _llm_backends[backend.name] = backend
+
+def set_llm_backend(backend):
+    """切换进程内使用的LLM后端，可传名称或 LLMBackend 实例"""
+    global _active_llm_backend
+    if isinstance(backend, str):
+        if backend not in _llm_backends:
+            raise ValueError(f"未知的LLM后端: {backend}，可选: {', '.join(_llm_backends)}")
+        backend = _llm_backends[backend]
+    _active_llm_backend = backend
+    log.info("LLM后端已切换为: %s (%s)", backend.name, backend.url)
+
+def get_llm_backend():
+    """返回当前使用的LLM后端"""
+    return _active_llm_backend
+
+def completion_record_key(prompt):
+    """录制/回放补全结果时使用的提示词指纹"""
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+_record_lock = threading.Lock()
+
+def _record_completion(prompt, content):
+    """配置了 LLM_RECORD_PATH 时把成功的补全追加到录制文件，供本地替身服务回放"""
+    if not LLM_RECORD_PATH:
+        return
+    record = {"key": completion_record_key(prompt), "prompt_chars": len(prompt), "content": content}
+    try:
+        with _record_lock, open(LLM_RECORD_PATH, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    except OSError as e:
+        log.warning("写入LLM录制文件失败: %s", e)
+
+def _llm_cache_key(prompt, model, temperature, response_format=None):
+    """计算一次调用的缓存键（包含后端、提示词模板版本和输出格式）"""
+    from prompts import PROMPT_TEMPLATE_VERSION
+    model_id = f"{get_llm_backend().name}/{model}"
+    return LLMResponseCache.make_key(model_id, temperature, prompt, PROMPT_TEMPLATE_VERSION, response_format)
+
+def get_cache_stats():
+    """返回LLM响应缓存的命中统计"""
+    cache = get_llm_cache()
+    return cache.stats() if cache is not None else {"enabled": False}
+
+# 请求优先级：数值越小越先发出
+PRIORITY_INTERACTIVE = 0  # 多轮对话修改讲义等交互请求
+PRIORITY_NORMAL = 1  # 单个大纲/讲义/资源生成
+PRIORITY_BULK = 2  # 批量生成全部讲义
+
+# 中日韩文字及全角标点，按DeepSeek分词器约0.6 token/字计算，其余字符约0.3 token/字符
+_CJK_CHAR_RE = re.compile(r'[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]')
+
+def estimate_tokens(text):
+    """用本地近似规则估算文本的token数（无需加载分词器）"""
+    if not text:
+        return 0
+    cjk = len(_CJK_CHAR_RE.findall(text))
+    return int((cjk * 0.6 + (len(text) - cjk) * 0.3) + 0.999)
+
+def _estimate_request_tokens(prompt):
+    """估算一次请求消耗的token数，用于每分钟token限流"""
+    return max(1, estimate_tokens(prompt))
+
+def fit_conversation_history(conversation_history, token_budget, latest_user_input=None):
+    """将对话历史格式化并压缩到token预算以内
+    
+    从最近的对话往前保留完整内容；放不下的早期对话压缩为一行摘要，只保留用户要求的开头。
+    latest_user_input 已单独放入提示词时，历史末尾与之相同的用户消息不再重复。
+    """
+    history = list(conversation_history)
+    if history and latest_user_input is not None and history[-1] == ("user", latest_user_input):
+        history = history[:-1]
+    
+    kept = []
+    used = 0
+    index = len(history)
+    while index > 0:
+        role, message = history[index - 1]
+        line = f"{role}: {message}\n"
+        cost = estimate_tokens(line)
+        if used + cost > token_budget:
+            break
+        kept.append(line)
+        used += cost
+        index -= 1
+    kept.reverse()
+    
+    if index == 0:
+        return "".join(kept)
+    
+    # 早期对话只保留用户要求的摘要，并同样受剩余预算约束
+    summary = f"（更早的{index}条对话已省略"
+    requests_summary = []
+    for role, message in history[:index]:
+        if role != "user":
+            continue
+        brief = message if len(message) <= 30 else message[:30] + "..."
+        if estimate_tokens(summary + "；".join(requests_summary + [brief])) + used > token_budget:
+            break
+        requests_summary.append(brief)
+    if requests_summary:
+        summary += "，其中用户要求包括：" + "；".join(requests_summary)
+    summary += "）\n"
+    return summary + "".join(kept)
+
+# 实际token用量统计（来自API响应的usage字段）
+_token_usage = {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0, "estimated_prompt_tokens": 0}
+_token_usage_lock = threading.Lock()
+
+def _record_token_usage(prompt, usage):
+    """记录一次调用的实际token用量，并与本地估算值对比"""
+    if not usage:
+        return
+    prompt_tokens = usage.get("prompt_tokens", 0)
+    completion_tokens = usage.get("completion_tokens", 0)
+    estimated = estimate_tokens(prompt)
+    with _token_usage_lock:
+        _token_usage["requests"] += 1
+        _token_usage["prompt_tokens"] += prompt_tokens
+        _token_usage["completion_tokens"] += completion_tokens
+        _token_usage["estimated_prompt_tokens"] += estimated
+    log.debug("本次token用量: 提示词 %d（估算 %d），生成 %d", prompt_tokens, estimated, completion_tokens)
+
+def get_token_usage_stats():
+    """返回累计token用量和本地估算的偏差"""
+    with _token_usage_lock:
+        stats = dict(_token_usage)
+    if stats["estimated_prompt_tokens"]:
+        # 实际值/估算值，接近1说明本地估算准确
+        stats["estimate_ratio"] = round(stats["prompt_tokens"] / stats["estimated_prompt_tokens"], 3)
+    return stats
+
+def _parse_retry_after(value, default=5.0):
+    """解析 Retry-After 响应头（秒数），无法解析时使用默认值"""
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return default
+
+class TokenBucket:
+    """令牌桶：容量为 capacity，每秒补充 rate 个令牌（调用方负责加锁）"""
+    
+    def __init__(self, capacity, rate):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated = time.monotonic()
+    
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def delay(self, amount):
+        """返回凑够 amount 个令牌还需等待的秒数，0 表示可以立即放行"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+    
+    def consume(self, amount):
+        self.tokens -= min(amount, self.capacity)
+
+class _ScheduledRequest:
+    """调度队列中等待放行的一个请求，放行后由调用方自己发出"""
+    
+    def __init__(self, priority, cost):
+        self.priority = priority
+        self.cost = cost
+        self.enqueued = time.monotonic()
+        self.future = Future()
+
+class RequestScheduler:
+    """进程级DeepSeek请求调度器
+    
+    - 令牌桶限制每秒请求数和每分钟token数
+    - 按优先级排队：交互式修改优先于批量生成
+    - 收到429后按 Retry-After 暂停放行
+    相同请求的合并由 SingleFlight 在进入调度器之前完成。
+    """
+    
+    def __init__(self, max_concurrency=SCHEDULER_MAX_CONCURRENCY, rps=RATE_LIMIT_RPS, tpm=RATE_LIMIT_TPM):
+        self.max_concurrency = max_concurrency
+        self._request_bucket = TokenBucket(capacity=max(1, rps), rate=rps)
+        self._token_bucket = TokenBucket(capacity=tpm, rate=tpm / 60.0)
+        self._cond = threading.Condition()
+        self._heap = []
+        self._seq = itertools.count()
+        self._active = 0
+        self._paused_until = 0.0
+        self._wait_samples = []  # 最近的排队等待时间（秒）
+        self._stats = {"submitted": 0, "dispatched": 0, "rate_limited": 0}
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, name="deepseek-scheduler", daemon=True)
+        self._dispatcher.start()
+    
+    def acquire(self, priority=PRIORITY_NORMAL, cost=1):
+        """阻塞等待放行后由调用方自行发出请求，完成后必须调用 release()"""
+        request = _ScheduledRequest(priority, cost)
+        with self._cond:
+            self._stats["submitted"] += 1
+            heapq.heappush(self._heap, (priority, next(self._seq), request))
+            self._cond.notify_all()
+        request.future.result()
+    
+    async def acquire_async(self, priority=PRIORITY_NORMAL, cost=1):
+        """协程版 acquire：等待放行期间不占用线程，放行后同样必须调用 release()"""
+        request = _ScheduledRequest(priority, cost)
+        with self._cond:
+            self._stats["submitted"] += 1
+            heapq.heappush(self._heap, (priority, next(self._seq), request))
+            self._cond.notify_all()
+        try:
+            await asyncio.wrap_future(request.future)
+        except asyncio.CancelledError:
+            # 排队中被取消时撤销请求；已经放行的归还名额
+            if not request.future.cancel():
+                self.release()
+            raise
+    
+    def release(self):
+        """归还一个并发名额"""
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+    
+    def penalize(self, seconds):
+        """收到429时暂停放行新请求"""
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._stats["rate_limited"] += 1
+            self._cond.notify_all()
+    
+    def _dispatch_loop(self):
+        while True:
+            with self._cond:
+                request = self._next_ready()
+            # 等待方（协程）已取消时归还刚占用的名额
+            if request.future.set_running_or_notify_cancel():
+                request.future.set_result(None)
+            else:
+                self.release()
+    
+    def _next_ready(self):
+        """等待并取出下一个可以放行的请求（调用方需持有锁）"""
+        while True:
+            if not self._heap:
+                self._cond.wait()
+                continue
+            
+            request = self._heap[0][2]
+            now = time.monotonic()
+            wait = max(
+                self._paused_until - now,
+                self._request_bucket.delay(1),
+                self._token_bucket.delay(request.cost)
+            )
+            if self._active >= self.max_concurrency:
+                self._cond.wait()
+                continue
+            if wait > 0:
+                # 等待期间可能有更高优先级的请求入队，醒来后重新选择
+                self._cond.wait(wait)
+                continue
+            
+            heapq.heappop(self._heap)
+            self._request_bucket.consume(1)
+            self._token_bucket.consume(request.cost)
+            self._active += 1
+            self._stats["dispatched"] += 1
+            self._wait_samples.append(now - request.enqueued)
+            if len(self._wait_samples) > 200:
+                del self._wait_samples[:-200]
+            return request
+    
+    def stats(self):
+        """返回队列深度、等待时间等调度指标"""
+        with self._cond:
+            depth_by_priority = {"interactive": 0, "normal": 0, "bulk": 0}
+            names = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_NORMAL: "normal", PRIORITY_BULK: "bulk"}
+            for _, _, request in self._heap:
+                depth_by_priority[names.get(request.priority, "normal")] += 1
+            samples = sorted(self._wait_samples)
+            stats = dict(self._stats)
+            stats.update({
+                "queue_depth": sum(depth_by_priority.values()),
+                "queue_depth_by_priority": depth_by_priority,
+                "active": self._active,
+                "paused_for": round(max(0.0, self._paused_until - time.monotonic()), 1),
+                "wait_avg": round(sum(samples) / len(samples), 3) if samples else None,
+                "wait_p95": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3) if samples else None,
+                "wait_max": round(samples[-1], 3) if samples else None,
+            })
+            return stats
+
+class SingleFlight:
+    """相同请求合并：同一个key同一时刻只发出一次请求，并发的其他调用方等待并共享其结果"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}  # key -> 进行中请求的 Future
+        self._stats = {"leaders": 0, "shared": 0}
+    
+    def begin(self, key):
+        """登记一次调用，返回 (future, is_leader)；非leader只需等待 future 的结果"""
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self._stats["shared"] += 1
+                return future, False
+            future = Future()
+            self._calls[key] = future
+            self._stats["leaders"] += 1
+            return future, True
+    
+    def finish(self, key, result=None, error=None):
+        """leader完成请求后发布结果，唤醒所有等待的调用方"""
+        with self._lock:
+            future = self._calls.pop(key, None)
+        if future is None:
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+    
+    async def do_async(self, key, coro_fn):
+        """执行 coro_fn；已有相同key的请求在进行时直接等待其结果，与同步调用方（begin/finish）共用进行中请求表"""
+        future, is_leader = self.begin(key)
+        if not is_leader:
+            # shield：某个等待方被取消时不能连带取消共享的 Future
+            return await asyncio.shield(asyncio.wrap_future(future))
+        try:
+            result = await coro_fn()
+        except asyncio.CancelledError:
+            self.finish(key, {"error": "请求已取消"})
+            raise
+        except Exception as e:
+            self.finish(key, error=e)
+            raise
+        self.finish(key, result)
+        return result
+    
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._calls)
+            return stats
+
+_single_flight = SingleFlight()
+
+def get_single_flight_stats():
+    """返回请求合并的统计（发出的请求数、被合并的调用数、进行中的请求数）"""
+    return _single_flight.stats()
+
+_request_scheduler = None
+_request_scheduler_lock = threading.Lock()
+
+def get_request_scheduler():
+    """获取进程级共享的请求调度器"""
+    global _request_scheduler
+    if _request_scheduler is None:
+        with _request_scheduler_lock:
+            if _request_scheduler is None:
+                _request_scheduler = RequestScheduler()
+    return _request_scheduler
+
+def get_scheduler_stats():
+    """返回请求调度器的队列深度和等待时间指标"""
+    return get_request_scheduler().stats()
+
+class CircuitBreaker:
+    """进程级熔断器：连续失败达到阈值后熔断，一段时间后放行一个试探请求
+    
+    - closed：正常放行
+    - open：直接拒绝，调用方立即使用备用方案
+    - half_open：只放行一个试探请求，成功则恢复，失败则重新熔断
+    """
+    
+    def __init__(self, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, recovery_timeout=CIRCUIT_RECOVERY_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self._lock = threading.Lock()
+        self._state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._stats = {"rejected": 0, "opened": 0}
+    
+    def allow_request(self):
+        with self._lock:
+            if self._state == "open":
+                if time.monotonic() - self._opened_at < self.recovery_timeout:
+                    self._stats["rejected"] += 1
+                    return False
+                self._state = "half_open"
+                self._trial_in_flight = False
+            if self._state == "half_open":
+                if self._trial_in_flight:
+                    self._stats["rejected"] += 1
+                    return False
+                self._trial_in_flight = True
+            return True
+    
+    def record_success(self):
+        with self._lock:
+            self._state = "closed"
+            self._failures = 0
+            self._trial_in_flight = False
+    
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._state == "half_open" or self._failures >= self.failure_threshold:
+                if self._state != "open":
+                    self._stats["opened"] += 1
+                self._state = "open"
+                self._opened_at = time.monotonic()
+    
+    def release_trial(self):
+        """请求未得出结果（如被调用方取消）时归还半开状态的试探名额，不改变熔断状态和失败计数"""
+        with self._lock:
+            self._trial_in_flight = False
+    
+    def is_open(self):
+        """当前是否处于熔断状态（不消耗试探名额）"""
+        with self._lock:
+            return self._state == "open" and time.monotonic() - self._opened_at < self.recovery_timeout
+    
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["state"] = self._state
+            stats["consecutive_failures"] = self._failures
+            if self._state == "open":
+                stats["retry_in"] = round(max(0.0, self.recovery_timeout - (time.monotonic() - self._opened_at)), 1)
+            return stats
+
+_circuit_breaker = CircuitBreaker()
+
+def _circuit_open_error():
+    return {"error": "DeepSeek API暂时不可用（已熔断），请稍后重试", "circuit_open": True}
+
+def _backoff_delay(attempt):
+    """带随机抖动的指数退避时间（full jitter），避免大量请求同时重试"""
+    return random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * (2 ** attempt)))
+
+def is_api_circuit_open():
+    """API是否处于熔断状态，熔断时应直接使用备用方案"""
+    return _circuit_breaker.is_open()
+
+def get_circuit_breaker_stats():
+    """返回熔断器状态"""
+    return _circuit_breaker.stats()
+
+_JSON_DECODER = json.JSONDecoder()
+_JSON_START_RE = re.compile(r'[\[{]')
+# 字符串内部只需关心引号、转义和裸控制字符，其余字符整段跳过
+_JSON_STRING_SPECIAL_RE = re.compile(r'["\\\n\r\t]')
+_JSON_STRING_CONTROL_ESCAPES = {"\n": "\\n", "\r": "\\r", "\t": "\\t"}
+# 字符串外只有这些字符会改变扫描状态，其余的数字、字面量、冒号和空白整段复制
+_JSON_STRUCTURAL_RE = re.compile(r'["{}\[\],\\]')
+_JSON_WHITESPACE_RE = re.compile(r'\s+')
+_JSON_CLOSERS = {"{": "}", "[": "]"}
+
+def _is_bare_key_char(ch):
+    return ch.isalnum() or ch in "_-$"
+
+def _scan_json_candidate(text, start):
+    """从 start 处的 { 或 [ 开始扫描一个JSON值，同时修复模型常见的格式错误
+    
+    修复内容：对象/数组的尾随逗号、未加引号的键、字符串中的裸换行/制表符、
+    字符串外的字面 \\n 转义，以及输出被截断时缺失的右括号。
+    返回 (修复后的文本, 结束位置)；括号不匹配时返回 (None, 出错位置)。
+    """
+    out = []
+    stack = []
+    expect_key = False
+    i = start
+    n = len(text)
+    while i < n:
+        ch = text[i]
+        if ch == '"':
+            # 跳到字符串结尾，途中转义裸控制字符
+            out.append('"')
+            i += 1
+            while True:
+                match = _JSON_STRING_SPECIAL_RE.search(text, i)
+                if match is None:
+                    out.append(text[i:])
+                    i = n
+                    break
+                pos = match.start()
+                out.append(text[i:pos])
+                special = text[pos]
+                if special == '"':
+                    out.append('"')
+                    i = pos + 1
+                    break
+                if special == "\\":
+                    out.append(text[pos:pos + 2])
+                    i = pos + 2
+                else:
+                    out.append(_JSON_STRING_CONTROL_ESCAPES[special])
+                    i = pos + 1
+            expect_key = False
+            continue
+        if ch in "{[":
+            stack.append(_JSON_CLOSERS[ch])
+            expect_key = ch == "{"
+            out.append(ch)
+        elif ch in "}]":
+            if not stack or stack[-1] != ch:
+                return None, i
+            stack.pop()
+            # 去掉尾随逗号
+            k = len(out) - 1
+            while k >= 0 and out[k].isspace():
+                k -= 1
+            if k >= 0 and out[k] == ",":
+                del out[k]
+            out.append(ch)
+            expect_key = False
+            if not stack:
+                return "".join(out), i + 1
+        elif ch == ",":
+            expect_key = stack[-1] == "}"
+            out.append(ch)
+        elif ch == "\\" and text[i + 1:i + 2] in ("n", "r", "t"):
+            # 字符串外的字面转义只可能是多转义了一层的空白
+            out.append(" ")
+            i += 2
+            continue
+        elif ch.isspace():
+            k = _JSON_WHITESPACE_RE.match(text, i).end()
+            out.append(text[i:k])
+            i = k
+            continue
+        elif expect_key and _is_bare_key_char(ch):
+            # 未加引号的键：读到冒号前为止补上引号
+            k = i
+            while k < n and _is_bare_key_char(text[k]):
+                k += 1
+            out.append(f'"{text[i:k]}"')
+            expect_key = False
+            i = k
+            continue
+        else:
+            match = _JSON_STRUCTURAL_RE.search(text, i + 1)
+            k = match.start() if match else n
+            out.append(text[i:k])
+            expect_key = False
+            i = k
+            continue
+        i += 1
+    
+    # 输出被截断：补齐缺失的右括号
+    return "".join(out) + "".join(reversed(stack)), n
 
 def extract_json_from_text(text):
-    """从文本中提取JSON内容"""
-    # 尝试找到JSON对象或数组
-    json_match = re.search(r'(\{[\s\S]*\}|\[[\s\S]*\])', text)
-    if json_match:
+    """从文本中提取第一个有效的JSON对象或数组
+    
+    先按标准JSON直接解码；失败时用单遍扫描器修复常见格式错误后再解码，
+    某个候选修复后仍无法解析就从它之后继续寻找下一个候选，整体为线性扫描。
+    """
+    if not isinstance(text, str):
+        return {"error": "无法提取有效的JSON", "raw_text": text}
+    
+    pos = 0
+    while True:
+        match = _JSON_START_RE.search(text, pos)
+        if match is None:
+            return {"error": "无法提取有效的JSON", "raw_text": text}
+        start = match.start()
         try:
-            return json.loads(json_match.group(1))
+            return _JSON_DECODER.raw_decode(text, start)[0]
         except json.JSONDecodeError:
             pass
-    
-    # 如果上述方法失败，尝试找到被```json包裹的内容
-    if '```json' in text:
-        parts = text.split('```json')
-        if len(parts) > 1:
-            json_part = parts[1].split('```')[0].strip()
+        
+        repaired, end = _scan_json_candidate(text, start)
+        if repaired is not None:
             try:
-                return json.loads(json_part)
+                return json.loads(repaired)
             except json.JSONDecodeError:
                 pass
+        pos = max(end, start + 1)
+
+def call_deepseek(prompt, model="deepseek-chat", temperature=0.7, use_cache=True, priority=PRIORITY_NORMAL, response_format=None):
+    """调用DeepSeek API（同步接口），参数和返回值同 call_deepseek_async"""
+    return run_sync(call_deepseek_async(prompt, model, temperature, use_cache, priority, response_format))
+
+@metrics.traced("call_deepseek")
+async def call_deepseek_async(prompt, model="deepseek-chat", temperature=0.7, use_cache=True, priority=PRIORITY_NORMAL, response_format=None):
+    """调用DeepSeek API，包含完整的错误处理和重试机制，相同请求直接返回缓存结果
+    
+    请求统一经过进程级调度器按 priority 和限流配额排队，等待放行和响应期间不占用线程。
+    response_format 传 {"type": "json_object"} 时要求API直接返回JSON。
+    """
+    # 检查API密钥是否设置
+    backend = get_llm_backend()
+    if not backend.is_configured():
+        return backend.config_error()
     
-    # 如果还是失败，尝试找到被```包裹的内容
-    if '```' in text:
-        parts = text.split('```')
-        if len(parts) > 1:
-            json_part = parts[1].strip()
+    cache_key = _llm_cache_key(prompt, model, temperature, response_format)
+    cache = get_llm_cache() if use_cache else None
+    if cache is not None:
+        # 缓存可能读磁盘，放到线程池中执行，不阻塞事件循环
+        cached = await asyncio.to_thread(cache.get, cache_key)
+        if cached is not None:
+            log.info("命中LLM响应缓存，跳过API调用")
+            metrics.set_status("cache_hit")
+            return cached
+    
+    async def request():
+        scheduler = get_request_scheduler()
+        deadline = time.monotonic() + REQUEST_DEADLINE
+        attempt = 0
+        result = None
+        while True:
+            if not _circuit_breaker.allow_request():
+                # 本次调用的重试过程中触发熔断时，返回最后一次的真实错误
+                return result if result is not None else _circuit_open_error()
+            
+            # 每次尝试的读取超时不超过剩余的时间预算
+            remaining = deadline - time.monotonic()
+            read_timeout = max(1.0, min(READ_TIMEOUT, remaining))
+            with metrics.span("queue"):
+                await scheduler.acquire_async(priority=priority, cost=_estimate_request_tokens(prompt))
             try:
-                return json.loads(json_part)
-            except json.JSONDecodeError:
-                pass
+                result = await _post_chat_completion_async(prompt, model, temperature, read_timeout, response_format, backend)
+            except asyncio.CancelledError:
+                # 调用方取消（如客户端断开）既不算成功也不算失败，只释放半开状态的试探名额
+                _circuit_breaker.release_trial()
+                raise
+            finally:
+                scheduler.release()
+            
+            if not isinstance(result, dict):
+                _circuit_breaker.record_success()
+                break
+            if result.get("rate_limited"):
+                # 被限流说明服务可用，不计入熔断；调度器已暂停放行，重新排队即可
+                _circuit_breaker.record_success()
+            elif result.get("retryable"):
+                _circuit_breaker.record_failure()
+            else:
+                # 参数或鉴权等错误重试无意义
+                _circuit_breaker.record_success()
+                break
+            
+            attempt += 1
+            delay = _backoff_delay(attempt)
+            if attempt > MAX_RETRIES or time.monotonic() + delay >= deadline:
+                break
+            log.warning("API调用失败，%.1f秒后进行第%d次重试", delay, attempt)
+            await asyncio.sleep(delay)
+        
+        if cache is not None and isinstance(result, str) and result:
+            await asyncio.to_thread(cache.set, cache_key, result)
+        return result
     
-    # 最后尝试直接解析整个文本
+    # 相同请求正在进行时（如重复点击、多位教师同时生成同一章节）直接共享其结果
+    return await _single_flight.do_async(cache_key, request)
+
+def _diagnose_connection(backend):
+    """连接失败时检查DNS解析和TCP连通性，返回诊断信息（会阻塞数秒，协程中应放到线程池执行）"""
+    import socket
+    host, port = backend.address()
     try:
-        return json.loads(text)
-    except json.JSONDecodeError:
-        return {"error": "无法提取有效的JSON", "raw_text": text}
+        # 测试是否能解析域名
+        socket.gethostbyname(host)
+        dns_status = "DNS解析正常"
+    except socket.gaierror:
+        dns_status = "DNS解析失败"
+    
+    try:
+        # 测试是否能连接到API服务器
+        test_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        test_socket.settimeout(5)
+        test_socket.connect((host, port))
+        test_socket.close()
+        connect_status = "可以连接到API服务器"
+    except Exception as e:
+        connect_status = f"无法连接到API服务器: {str(e)}"
+    
+    return f"诊断信息: {dns_status}, {connect_status}"
 
-def call_deepseek(prompt, model="deepseek-chat", temperature=0.7):
-    """调用DeepSeek API，包含完整的错误处理和重试机制"""
-    # 检查API密钥是否设置
-    if not DEEPSEEK_API_KEY or DEEPSEEK_API_KEY == "你的API密钥":
-        return {"error": "未设置DeepSeek API密钥，请在.env文件中设置DEEPSEEK_API_KEY"}
+async def _post_chat_completion_async(prompt, model, temperature, read_timeout=READ_TIMEOUT, response_format=None, backend=None):
+    """通过共享的异步客户端发送一次非流式的 chat-completions 请求，返回文本内容或 {"error": ...}
     
-    headers = {
-        "Authorization": f"Bearer {DEEPSEEK_API_KEY}",
-        "Content-Type": "application/json"
-    }
+    错误字典中的 retryable 表示该错误是否值得重试（超时、连接错误、5xx）。
+    """
+    backend = backend or get_llm_backend()
+    headers = backend.headers()
     
     data = {
         "model": model,
@@ -335,73 +1323,252 @@ def call_deepseek(prompt, model="deepseek-chat", temperature=0.7):
         "temperature": temperature,
         "stream": False  # 确保不使用流式传输，减少连接问题
     }
+    if response_format is not None:
+        data["response_format"] = response_format
     
-    # 创建新的会话，避免使用全局会话可能的问题
-    session = create_session_with_retries()
+    client = get_async_client()
+    _track_pool_request(1)
+    failed = True
+    response = None
     
     try:
-        print(f"正在调用DeepSeek API，提示词长度: {len(prompt)}")
-        response = session.post(
-            DEEPSEEK_API_URL,
+        log.info("正在调用LLM API", extra=log_fields(backend=backend.name, prompt_chars=len(prompt), request_id=getattr(metrics.current_trace(), "request_id", None)))
+        request = client.build_request(
+            "POST",
+            backend.url,
             headers=headers,
             json=data,
-            timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)  # 分别设置连接和读取超时
+            timeout=httpx.Timeout(read_timeout, connect=CONNECT_TIMEOUT),  # 分别设置连接和读取超时
+            extensions={"trace": metrics.connect_tracer()} if METRICS_ENABLED else None
         )
+        # stream=True 让 send 在收到响应头时返回，以便分别统计首字节和下载耗时
+        with metrics.span("ttfb"):
+            response = await client.send(request, stream=True)
+        with metrics.span("download"):
+            await response.aread()
         
-        print(f"API响应状态码: {response.status_code}")
+        log.debug("API响应状态码: %d", response.status_code)
         
         if response.status_code == 200:
             result = response.json()
             content = result["choices"][0]["message"]["content"]
-            print("API调用成功!")
+            log.info("API调用成功")
+            _record_token_usage(prompt, result.get("usage"))
+            _record_completion(prompt, content)
+            failed = False
             return content
+        elif response.status_code == 429:
+            # 触发限流：按 Retry-After 暂停调度器放行新请求
+            retry_after = _parse_retry_after(response.headers.get("Retry-After"))
+            get_request_scheduler().penalize(retry_after)
+            error_msg = f"API限流: 状态码 429，{retry_after:.0f}秒后重试"
+            log.warning(error_msg)
+            return {"error": error_msg, "rate_limited": True}
         else:
             error_msg = f"API错误: 状态码 {response.status_code}, 响应: {response.text}"
-            print(error_msg)
-            return {"error": error_msg}
+            log.warning("%s", truncate(error_msg))
+            return {"error": error_msg, "retryable": response.status_code >= 500}
             
-    except requests.exceptions.Timeout:
-        error_msg = f"API调用超时（连接:{CONNECT_TIMEOUT}s, 读取:{READ_TIMEOUT}s），请检查网络连接或稍后重试"
-        print(error_msg)
-        return {"error": error_msg}
+    except httpx.TimeoutException:
+        error_msg = f"API调用超时（连接:{CONNECT_TIMEOUT}s, 读取:{read_timeout:.0f}s），请检查网络连接或稍后重试"
+        log.warning("%s", truncate(error_msg))
+        return {"error": error_msg, "retryable": True}
         
-    except requests.exceptions.ConnectionError as e:
+    except httpx.NetworkError as e:
         error_msg = f"网络连接错误: {str(e)}，请检查网络设置"
-        print(error_msg)
-        
+        log.warning("%s", truncate(error_msg))
         # 尝试诊断连接问题
-        try:
-            # 测试是否能解析域名
-            import socket
-            socket.gethostbyname("api.deepseek.com")
-            dns_status = "DNS解析正常"
-        except socket.gaierror:
-            dns_status = "DNS解析失败"
+        error_msg += "\n" + await asyncio.to_thread(_diagnose_connection, backend)
+        return {"error": error_msg, "retryable": True}
         
-        try:
-            # 测试是否能连接到API服务器
-            test_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            test_socket.settimeout(5)
-            test_socket.connect(("api.deepseek.com", 443))
-            test_socket.close()
-            connect_status = "可以连接到API服务器"
-        except Exception as e:
-            connect_status = f"无法连接到API服务器: {str(e)}"
+    except httpx.HTTPError as e:
+        error_msg = f"网络请求异常: {str(e)}"
+        log.warning("%s", truncate(error_msg))
+        return {"error": error_msg, "retryable": True}
         
-        error_msg += f"\n诊断信息: {dns_status}, {connect_status}"
+    except Exception as e:
+        error_msg = f"API调用异常: {str(e)}"
+        log.warning("%s", truncate(error_msg))
         return {"error": error_msg}
+    finally:
+        # 不关闭共享客户端，连接归还连接池供后续请求复用
+        if response is not None:
+            await response.aclose()
+        _track_pool_request(-1, failed)
+
+def call_deepseek_stream(prompt, model="deepseek-chat", temperature=0.7, use_cache=True, priority=PRIORITY_NORMAL):
+    """以流式（SSE）方式调用DeepSeek API，逐个产出增量文本片段
+    
+    出错时产出一个 {"error": ...} 字典后结束，调用方据此切换到备用方案。
+    命中缓存时一次性产出完整内容。
+    """
+    # 检查API密钥是否设置
+    backend = get_llm_backend()
+    if not backend.is_configured():
+        yield backend.config_error()
+        return
+    
+    cache_key = _llm_cache_key(prompt, model, temperature)
+    cache = get_llm_cache() if use_cache else None
+    if cache is not None:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            log.info("命中LLM响应缓存，跳过API调用")
+            metrics.set_status("cache_hit")
+            yield cached
+            return
+    
+    # 相同请求正在进行时等待其完成，一次性产出结果
+    flight, is_leader = _single_flight.begin(cache_key)
+    if not is_leader:
+        log.info("相同请求正在进行，等待其结果")
+        yield flight.result()
+        return
+    
+    headers = backend.headers(stream=True)
+    
+    data = {
+        "model": model,
+        "messages": [{"role": "user", "content": prompt}],
+        "temperature": temperature,
+        "stream": True,
+        "stream_options": {"include_usage": True}  # 最后一个数据块附带token用量
+    }
+    
+    if not _circuit_breaker.allow_request():
+        outcome = _circuit_open_error()
+        _single_flight.finish(cache_key, outcome)
+        yield outcome
+        return
+    
+    # 调用方没有记录操作时单独记录这次流式调用
+    trace = metrics.current_trace()
+    owns_trace = trace is None
+    if owns_trace:
+        trace = metrics.RequestTrace("call_deepseek_stream")
+    
+    # 流式请求在调用方线程中执行，但同样要经过调度器的限流和并发控制
+    scheduler = get_request_scheduler()
+    with trace.span("queue"):
+        scheduler.acquire(priority=priority, cost=_estimate_request_tokens(prompt))
+    session = get_shared_session()
+    _track_pool_request(1)
+    failed = True
+    breaker_failure = True
+    response = None
+    interrupted = {"error": "流式调用被中断"}
+    outcome = interrupted  # 发布给合并等待的调用方的最终结果
+    request_sent = time.perf_counter()
+    first_chunk_at = None
+    consumer_time = 0.0  # 生成器挂起、调用方在渲染的时间，不计入下载耗时
+    
+    try:
+        log.info("正在以流式方式调用LLM API", extra=log_fields(backend=backend.name, prompt_chars=len(prompt), request_id=trace.request_id))
+        request_sent = time.perf_counter()
+        with metrics.use_trace(trace):
+            response = session.post(
+                backend.url,
+                headers=headers,
+                json=data,
+                timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),  # 读取超时作用于相邻两个数据块之间
+                stream=True
+            )
+        
+        log.debug("API响应状态码: %d", response.status_code)
+        
+        if response.status_code == 429:
+            # 限流不代表服务故障，只暂停调度器放行新请求，不计入熔断
+            scheduler.penalize(_parse_retry_after(response.headers.get("Retry-After")))
+            breaker_failure = False
+        elif response.status_code < 500:
+            # 只有超时、连接错误和 5xx 计入熔断
+            breaker_failure = False
+        if response.status_code != 200:
+            error_msg = f"API错误: 状态码 {response.status_code}, 响应: {response.text}"
+            log.warning("%s", truncate(error_msg))
+            outcome = {"error": error_msg}
+            yield outcome
+            return
+        
+        # SSE 数据固定为 UTF-8，避免 requests 按 ISO-8859-1 解码中文
+        response.encoding = "utf-8"
+        received = []
+        for line in response.iter_lines(decode_unicode=True):
+            # 跳过空行和 ": keep-alive" 之类的注释行
+            if not line or not line.startswith("data:"):
+                continue
+            payload = line[len("data:"):].strip()
+            if payload == "[DONE]":
+                break
+            try:
+                chunk = json.loads(payload)
+            except json.JSONDecodeError:
+                continue
+            if chunk.get("usage"):
+                _record_token_usage(prompt, chunk["usage"])
+            choices = chunk.get("choices") or []
+            if not choices:
+                continue
+            delta = choices[0].get("delta", {}).get("content")
+            if delta:
+                if first_chunk_at is None:
+                    first_chunk_at = time.perf_counter()
+                    trace.add_span("ttfb", first_chunk_at - request_sent)
+                received.append(delta)
+                paused = time.perf_counter()
+                yield delta
+                consumer_time += time.perf_counter() - paused
+        
+        if received:
+            log.info("API流式调用完成")
+            failed = False
+            breaker_failure = False
+            outcome = "".join(received)
+            _record_completion(prompt, outcome)
+            if cache is not None:
+                cache.set(cache_key, outcome)
+        else:
+            outcome = {"error": "API流式响应为空"}
+            yield outcome
+            
+    except requests.exceptions.Timeout:
+        error_msg = f"API调用超时（连接:{CONNECT_TIMEOUT}s, 读取:{READ_TIMEOUT}s），请检查网络连接或稍后重试"
+        log.warning("%s", truncate(error_msg))
+        outcome = {"error": error_msg}
+        yield outcome
         
     except requests.exceptions.RequestException as e:
         error_msg = f"网络请求异常: {str(e)}"
-        print(error_msg)
-        return {"error": error_msg}
+        log.warning("%s", truncate(error_msg))
+        outcome = {"error": error_msg}
+        yield outcome
         
     except Exception as e:
         error_msg = f"API调用异常: {str(e)}"
-        print(error_msg)
-        return {"error": error_msg}
+        log.warning("%s", truncate(error_msg))
+        outcome = {"error": error_msg}
+        yield outcome
     finally:
-        session.close()
+        # 关闭响应即把连接归还共享连接池
+        if response is not None:
+            response.close()
+        _track_pool_request(-1, failed)
+        scheduler.release()
+        if first_chunk_at is not None:
+            trace.add_span("download", time.perf_counter() - first_chunk_at - consumer_time)
+        if isinstance(outcome, dict):
+            trace.status = "error"
+        if owns_trace:
+            trace.finish()
+        if outcome is interrupted:
+            # 调用方中途停止读取（如页面重新运行、任务被取消）时没有得出结果，只释放半开状态的试探名额
+            _circuit_breaker.release_trial()
+        elif isinstance(outcome, dict) and breaker_failure:
+            _circuit_breaker.record_failure()
+        else:
+            # 完整收到响应（包括429和其他4xx，说明服务可用）
+            _circuit_breaker.record_success()
+        _single_flight.finish(cache_key, outcome)
 
 def parse_json_response(response_text):
     """尝试解析JSON响应 - 增强版"""
@@ -414,18 +1581,157 @@ def parse_json_response(response_text):
         result = extract_json_from_text(response_text)
         
         if isinstance(result, dict) and "error" in result:
-            print(f"JSON解析失败，原始响应: {response_text}")
+            log.warning("JSON解析失败，响应长度 %d，内容: %s", len(response_text), truncate(response_text, 200))
             return result
             
         return result
         
     except Exception as e:
         error_msg = f"解析响应时发生异常: {str(e)}"
-        print(error_msg)
-        print(f"原始响应: {response_text}")
+        log.warning("%s", truncate(error_msg))
         return {"error": error_msg, "raw_response": response_text}
 
+# 结构化输出的校验规则（JSON Schema 的子集：type/required/properties/items/minItems）
+COURSE_OUTLINE_SCHEMA = {
+    "type": "object",
+    "required": ["章节列表"],
+    "properties": {
+        "章节列表": {
+            "type": "array",
+            "minItems": 1,
+            "items": {
+                "type": "object",
+                "required": ["章节名称", "学时", "重点内容"],
+                "properties": {
+                    "章节名称": {"type": "string"},
+                    "学时": {"type": ["number", "string"]},
+                    "重点内容": {"type": ["string", "array"]}
+                }
+            }
+        }
+    }
+}
+
+def _resource_list_schema(*required_fields):
+    return {
+        "type": "array",
+        "minItems": 1,
+        "items": {
+            "type": "object",
+            "required": list(required_fields),
+            "properties": {field: {"type": "string"} for field in required_fields}
+        }
+    }
+
+RESOURCES_SCHEMA = {
+    "type": "object",
+    "required": ["教材", "在线视频", "工具/软件", "案例研究"],
+    "properties": {
+        "教材": _resource_list_schema("书名", "作者", "出版社"),
+        "在线视频": _resource_list_schema("视频标题", "发布平台", "链接"),
+        "工具/软件": _resource_list_schema("工具名称", "类型", "用途"),
+        "案例研究": _resource_list_schema("案例名称", "领域", "描述")
+    }
+}
+
+_JSON_SCHEMA_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "number": (int, float),
+    "integer": int,
+    "boolean": bool
+}
+
+def _matches_schema_type(value, expected):
+    if isinstance(expected, list):
+        return any(_matches_schema_type(value, t) for t in expected)
+    if isinstance(value, bool) and expected != "boolean":
+        return False
+    return isinstance(value, _JSON_SCHEMA_TYPES[expected])
+
+def validate_json_schema(value, schema, path=""):
+    """按简化的JSON Schema校验结果，返回 [(字段路径, 问题描述), ...]，为空表示通过"""
+    expected = schema.get("type")
+    if expected is not None and not _matches_schema_type(value, expected):
+        return [(path or "$", f"类型应为{expected}，实际为{type(value).__name__}")]
+    
+    errors = []
+    if isinstance(value, dict):
+        for key in schema.get("required", []):
+            if key not in value:
+                errors.append((f"{path}.{key}" if path else key, "缺少该字段"))
+        for key, sub_schema in schema.get("properties", {}).items():
+            if key in value:
+                errors.extend(validate_json_schema(value[key], sub_schema, f"{path}.{key}" if path else key))
+    elif isinstance(value, list):
+        if len(value) < schema.get("minItems", 0):
+            errors.append((path or "$", f"至少需要{schema['minItems']}项"))
+        item_schema = schema.get("items")
+        if item_schema is not None:
+            for index, item in enumerate(value):
+                errors.extend(validate_json_schema(item, item_schema, f"{path}[{index}]"))
+    return errors
+
+def _top_level_field(path):
+    return re.split(r'[.\[]', path, 1)[0]
+
+def generate_structured_json(prompt, schema, priority=PRIORITY_NORMAL):
+    """同步接口，见 generate_structured_json_async"""
+    return run_sync(generate_structured_json_async(prompt, schema, priority))
+
+async def generate_structured_json_async(prompt, schema, priority=PRIORITY_NORMAL):
+    """以JSON输出模式调用API并按 schema 校验
+    
+    校验不通过时只针对不合格的顶层字段发起一次修复调用并合并结果，不整体重新生成。
+    返回 (结果, 剩余的校验错误)；API调用失败时结果为 {"error": ...}。
+    """
+    from prompts import PROMPT_REPAIR_JSON
+    
+    response = await call_deepseek_async(prompt, priority=priority, response_format={"type": "json_object"})
+    if isinstance(response, dict) and "error" in response:
+        return response, []
+    
+    with metrics.span("parse"):
+        result = parse_json_response(response)
+    if not isinstance(result, dict) or "error" in result:
+        # 整体无法解析时按空对象处理，由修复调用补齐所有必需字段
+        result = {}
+    errors = validate_json_schema(result, schema)
+    if not errors:
+        return result, []
+    
+    fields = []
+    for path, _ in errors:
+        field = _top_level_field(path)
+        if field not in fields:
+            fields.append(field)
+    log.info("结构化输出校验未通过，修复字段: %s", ", ".join(fields))
+    
+    properties = schema.get("properties", {})
+    repair_prompt = PROMPT_REPAIR_JSON.format(
+        task_prompt=prompt,
+        field_errors="\n".join(f"- {path}: {message}" for path, message in errors),
+        field_schema=json.dumps({field: properties.get(field, {}) for field in fields}, ensure_ascii=False),
+        current_values=json.dumps({field: result.get(field) for field in fields}, ensure_ascii=False)
+    )
+    repair = await call_deepseek_async(repair_prompt, temperature=0.2, priority=priority, response_format={"type": "json_object"})
+    if isinstance(repair, str):
+        with metrics.span("parse"):
+            repaired = parse_json_response(repair)
+        if isinstance(repaired, dict) and "error" not in repaired:
+            for field in fields:
+                if field in repaired:
+                    result[field] = repaired[field]
+    
+    return result, validate_json_schema(result, schema)
+
 def generate_course_outline(course_name, objectives, hours, education_stage="小学", policy_requirements=""):
+    """生成课程大纲（同步接口）"""
+    return run_sync(generate_course_outline_async(course_name, objectives, hours, education_stage, policy_requirements))
+
+@metrics.traced("course_outline")
+async def generate_course_outline_async(course_name, objectives, hours, education_stage="小学", policy_requirements=""):
     """生成课程大纲"""
     from prompts import PROMPT_COURSE_OUTLINE, EDUCATION_STAGE_GUIDANCE
     
@@ -441,22 +1747,27 @@ def generate_course_outline(course_name, objectives, hours, education_stage="小
 请确保课程大纲严格符合上述教育政策/考试大纲的要求！
 """
     
-    prompt = PROMPT_COURSE_OUTLINE.format(
-        course_name=course_name,
-        education_stage=education_stage,
-        objectives=objectives,
-        hours=hours,
-        education_stage_guidance=guidance,
-        policy_requirements=policy_section  # 新增政策要求
-    )
+    with metrics.span("prompt_build"):
+        prompt = PROMPT_COURSE_OUTLINE.format(
+            course_name=course_name,
+            education_stage=education_stage,
+            objectives=objectives,
+            hours=hours,
+            education_stage_guidance=guidance,
+            policy_requirements=policy_section  # 新增政策要求
+        )
     
-    print(f"生成课程大纲提示词: {prompt}")
-    response = call_deepseek(prompt)
-    return parse_json_response(response)
+    log.debug("生成课程大纲提示词: %s", truncate(prompt), extra=sampled())
+    outline, errors = await generate_structured_json_async(prompt, COURSE_OUTLINE_SCHEMA)
+    if errors:
+        # 修复后章节列表仍不可用，交给调用方使用备用方案
+        return {"error": "课程大纲格式不符合要求: " + "; ".join(f"{path} {message}" for path, message in errors[:5])}
+    return outline
 
 # 修改 generate_lecture_content 函数
-def generate_lecture_content(chapter_name, key_points, hours, education_stage="小学", generation_language="中文", policy_requirements=""):
-    """生成讲义内容"""
+@metrics.timed("prompt_build")
+def build_lecture_prompt(chapter_name, key_points, hours, education_stage="小学", generation_language="中文", policy_requirements=""):
+    """构建讲义生成提示词（普通调用和流式调用共用）"""
     from prompts import PROMPT_LECTURE_CONTENT, EDUCATION_STAGE_GUIDANCE
     
     guidance = EDUCATION_STAGE_GUIDANCE.get(education_stage, "")
@@ -469,7 +1780,7 @@ def generate_lecture_content(chapter_name, key_points, hours, education_stage="
 {policy_requirements}
 """
     
-    prompt = PROMPT_LECTURE_CONTENT.format(
+    return PROMPT_LECTURE_CONTENT.format(
         education_stage=education_stage,
         chapter_name=chapter_name,
         key_points=key_points,
@@ -478,39 +1789,54 @@ def generate_lecture_content(chapter_name, key_points, hours, education_stage="
         generation_language=generation_language,
         policy_requirements=policy_section  # 新增政策要求
     )
-    
-    response = call_deepseek(prompt)
+
+def generate_lecture_content(chapter_name, key_points, hours, education_stage="小学", generation_language="中文", policy_requirements="", priority=PRIORITY_NORMAL):
+    """生成讲义内容（同步接口）"""
+    return run_sync(generate_lecture_content_async(chapter_name, key_points, hours, education_stage,
+                                                   generation_language, policy_requirements, priority))
+
+@metrics.traced("lecture")
+async def generate_lecture_content_async(chapter_name, key_points, hours, education_stage="小学", generation_language="中文", policy_requirements="", priority=PRIORITY_NORMAL):
+    """生成讲义内容"""
+    prompt = build_lecture_prompt(chapter_name, key_points, hours, education_stage, generation_language, policy_requirements)
+    response = await call_deepseek_async(prompt, priority=priority)
     return response
 
+def generate_lecture_content_stream(chapter_name, key_points, hours, education_stage="小学", generation_language="中文", policy_requirements="", priority=PRIORITY_NORMAL):
+    """流式生成讲义内容，逐段产出Markdown文本片段（出错时产出 {"error": ...}）"""
+    prompt = build_lecture_prompt(chapter_name, key_points, hours, education_stage, generation_language, policy_requirements)
+    yield from call_deepseek_stream(prompt, priority=priority)
+
 def recommend_resources(course_name, education_stage="小学"):
+    """推荐教学资源（同步接口）"""
+    return run_sync(recommend_resources_async(course_name, education_stage))
+
+@metrics.traced("recommend_resources")
+async def recommend_resources_async(course_name, education_stage="小学"):
     """推荐教学资源 - 完全重写：更好的格式处理和错误处理"""
     from prompts import PROMPT_RECOMMEND_RESOURCES, EDUCATION_STAGE_GUIDANCE
     
     guidance = EDUCATION_STAGE_GUIDANCE.get(education_stage, "")
     
-    prompt = PROMPT_RECOMMEND_RESOURCES.format(
-        course_name=course_name,
-        education_stage=education_stage,
-        education_stage_guidance=guidance
-    )
+    with metrics.span("prompt_build"):
+        prompt = PROMPT_RECOMMEND_RESOURCES.format(
+            course_name=course_name,
+            education_stage=education_stage,
+            education_stage_guidance=guidance
+        )
     
-    print(f"正在获取教学资源，课程: {course_name}, 教育阶段: {education_stage}")
+    log.info("正在获取教学资源，课程: %s, 教育阶段: %s", course_name, education_stage)
     
     try:
-        response = call_deepseek(prompt)
-        print(f"API原始响应: {response}")
+        resources, errors = await generate_structured_json_async(prompt, RESOURCES_SCHEMA)
         
         # 如果API调用失败，直接返回模拟数据
-        if isinstance(response, dict) and "error" in response:
-            print(f"API调用失败，使用备用方案: {response['error']}")
+        if "error" in resources:
+            log.warning("API调用失败，使用备用方案: %s", truncate(resources["error"]))
             return recommend_mock_resources(course_name, education_stage)
         
-        # 清理响应文本，移除可能的问题字符
-        cleaned_response = clean_json_response(response)
-        
-        # 尝试解析JSON响应
-        resources = parse_json_response(cleaned_response)
-        print(f"解析后的资源: {resources}")
+        if errors:
+            log.warning("修复后仍有%d处资源字段不符合要求，缺失的类别使用备用数据", len(errors))
         
         # 检查解析结果并标准化格式
         standardized_resources = standardize_resources_format(resources, course_name)
@@ -518,26 +1844,9 @@ def recommend_resources(course_name, education_stage="小学"):
         return standardized_resources
             
     except Exception as e:
-        print(f"获取教学资源时发生异常: {e}")
+        log.exception("获取教学资源时发生异常: %s", e)
         return recommend_mock_resources(course_name, education_stage)
 
-def clean_json_response(text):
-    """清理JSON响应，修复常见格式问题"""
-    if not isinstance(text, str):
-        return text
-    
-    # 移除可能的问题字符和格式
-    cleaned = text.replace('\\"', '"')
-    cleaned = cleaned.replace('\\n', ' ')
-    cleaned = cleaned.replace('\\t', ' ')
-    
-    # 修复常见的JSON格式错误
-    cleaned = re.sub(r'(\w+)\s*:\s*{', r'"\1": {', cleaned)  # 为键添加引号
-    cleaned = re.sub(r',\s*}', '}', cleaned)  # 移除尾随逗号
-    cleaned = re.sub(r',\s*]', ']', cleaned)  # 移除数组尾随逗号
-    
-    return cleaned
-
 def standardize_resources_format(resources, course_name):
     """标准化资源格式，确保前端可以正确显示"""
     if not isinstance(resources, dict):
@@ -545,7 +1854,7 @@ def standardize_resources_format(resources, course_name):
         return recommend_mock_resources(course_name)
     
     # 确保包含所有必需的键
-    required_keys = ["教材", "在线视频", "工具/软件", "案例研究"]
+    required_keys = RESOURCES_SCHEMA["required"]
     standardized = {}
     
     for key in required_keys:
@@ -568,161 +1877,312 @@ def standardize_resources_format(resources, course_name):
             else:
                 standardized[key] = [str(value)]
         else:
-            # 如果键不存在，使用模拟数据
-            mock_data = recommend_mock_resources(course_name)
-            standardized[key] = mock_data.get(key, [f"暂无{key}信息"])
+            # 如果键不存在，从备用资源目录中取对应类别
+            standardized[key] = get_mock_resources(course_name, key) or [f"暂无{key}信息"]
     
     return standardized
 
-def recommend_mock_resources(course_name, education_stage="小学"):
-    """推荐模拟教学资源（标准化格式版本）"""
-    print(f"使用备用方案生成教学资源: {course_name}")
-    
-    course_name_lower = course_name.lower()
-    
+# 备用教学资源目录：按课程类别预先整理，{course_name} 在查询时替换为课程名
+_MOCK_RESOURCE_TEMPLATES = {
     # 金融类课程资源
-    if any(keyword in course_name_lower for keyword in ["金融", "经济", "货币", "银行", "投资"]):
-        return {
-            "教材": [
-                {
-                    "书名": "金融学原理",
-                    "作者": "李健",
-                    "出版社": "高等教育出版社",
-                    "备注": "系统讲解金融学基础理论"
-                },
-                {
-                    "书名": "货币银行学", 
-                    "作者": "黄达",
-                    "出版社": "中国人民大学出版社",
-                    "备注": "经典货币银行学教材"
-                }
-            ],
-            "在线视频": [
-                {
-                    "视频标题": "金融学原理相关视频",
-                    "发布平台": "B站搜索",
-                    "主讲人/机构": "多个来源",
-                    "链接": f"https://search.bilibili.com/all?keyword={course_name}+金融学+视频"
-                },
-                {
-                    "视频标题": "经济学教学视频",
-                    "发布平台": "百度搜索", 
-                    "主讲人/机构": "多个来源",
-                    "链接": f"https://www.baidu.com/s?wd={course_name}+经济学+教学视频"
-                }
-            ],
-            "工具/软件": [
-                {
-                    "工具名称": "Wind金融终端",
-                    "类型": "专业金融数据平台",
-                    "用途": "金融市场数据分析"
-                }
-            ],
-            "案例研究": [
-                {
-                    "案例名称": "2008年金融危机分析",
-                    "领域": "金融风险",
-                    "描述": "分析金融危机成因和应对措施"
-                }
-            ]
-        }
+    "金融": {
+        "教材": [
+            {
+                "书名": "金融学原理",
+                "作者": "李健",
+                "出版社": "高等教育出版社",
+                "备注": "系统讲解金融学基础理论"
+            },
+            {
+                "书名": "货币银行学", 
+                "作者": "黄达",
+                "出版社": "中国人民大学出版社",
+                "备注": "经典货币银行学教材"
+            }
+        ],
+        "在线视频": [
+            {
+                "视频标题": "金融学原理相关视频",
+                "发布平台": "B站搜索",
+                "主讲人/机构": "多个来源",
+                "链接": "https://search.bilibili.com/all?keyword={course_name}+金融学+视频"
+            },
+            {
+                "视频标题": "经济学教学视频",
+                "发布平台": "百度搜索", 
+                "主讲人/机构": "多个来源",
+                "链接": "https://www.baidu.com/s?wd={course_name}+经济学+教学视频"
+            }
+        ],
+        "工具/软件": [
+            {
+                "工具名称": "Wind金融终端",
+                "类型": "专业金融数据平台",
+                "用途": "金融市场数据分析"
+            }
+        ],
+        "案例研究": [
+            {
+                "案例名称": "2008年金融危机分析",
+                "领域": "金融风险",
+                "描述": "分析金融危机成因和应对措施"
+            }
+        ]
+    },
     
     # 编程类课程资源
-    elif any(keyword in course_name_lower for keyword in ["python", "编程", "计算机"]):
-        return {
-            "教材": [
-                {
-                    "书名": "Python编程：从入门到实践",
-                    "作者": "Eric Matthes",
-                    "出版社": "人民邮电出版社",
-                    "备注": "适合初学者的Python教材"
-                }
-            ],
-            "在线视频": [
-                {
-                    "视频标题": "Python编程教学视频",
-                    "发布平台": "B站搜索",
-                    "主讲人/机构": "多个来源",
-                    "链接": f"https://search.bilibili.com/all?keyword={course_name}+Python+编程+教程"
-                },
-                {
-                    "视频标题": "计算机科学教学资源",
-                    "发布平台": "百度搜索",
-                    "主讲人/机构": "多个来源", 
-                    "链接": f"https://www.baidu.com/s?wd={course_name}+计算机+教学视频"
-                }
-            ],
-            "工具/软件": [
-                {
-                    "工具名称": "PyCharm",
-                    "类型": "IDE",
-                    "用途": "Python开发环境"
-                }
-            ],
-            "案例研究": [
-                {
-                    "案例名称": "Python数据分析实战",
-                    "领域": "数据分析",
-                    "描述": "使用Python进行数据分析和可视化"
-                }
-            ]
-        }
+    "编程": {
+        "教材": [
+            {
+                "书名": "Python编程：从入门到实践",
+                "作者": "Eric Matthes",
+                "出版社": "人民邮电出版社",
+                "备注": "适合初学者的Python教材"
+            }
+        ],
+        "在线视频": [
+            {
+                "视频标题": "Python编程教学视频",
+                "发布平台": "B站搜索",
+                "主讲人/机构": "多个来源",
+                "链接": "https://search.bilibili.com/all?keyword={course_name}+Python+编程+教程"
+            },
+            {
+                "视频标题": "计算机科学教学资源",
+                "发布平台": "百度搜索",
+                "主讲人/机构": "多个来源", 
+                "链接": "https://www.baidu.com/s?wd={course_name}+计算机+教学视频"
+            }
+        ],
+        "工具/软件": [
+            {
+                "工具名称": "PyCharm",
+                "类型": "IDE",
+                "用途": "Python开发环境"
+            }
+        ],
+        "案例研究": [
+            {
+                "案例名称": "Python数据分析实战",
+                "领域": "数据分析",
+                "描述": "使用Python进行数据分析和可视化"
+            }
+        ]
+    },
     
     # 通用资源模板
-    else:
-        return {
-            "教材": [
-                {
-                    "书名": f"{course_name}导论",
-                    "作者": "多位专家",
-                    "出版社": "高等教育出版社",
-                    "备注": f"{course_name}领域入门教材"
-                }
-            ],
-            "在线视频": [
-                {
-                    "视频标题": f"{course_name}教学视频",
-                    "发布平台": "B站搜索",
-                    "主讲人/机构": "多个来源",
-                    "链接": f"https://search.bilibili.com/all?keyword={course_name}+教学视频"
-                },
-                {
-                    "视频标题": f"{course_name}学习资源",
-                    "发布平台": "百度搜索",
-                    "主讲人/机构": "多个来源",
-                    "链接": f"https://www.baidu.com/s?wd={course_name}+学习+视频"
-                }
-            ],
-            "工具/软件": [
-                {
-                    "工具名称": "相关专业软件",
-                    "type": "专业工具",
-                    "用途": f"{course_name}领域专业应用"
-                }
-            ],
-            "案例研究": [
-                {
-                    "案例名称": f"{course_name}应用案例",
-                    "领域": "实践应用",
-                    "描述": f"{course_name}在实际中的应用分析"
-                }
-            ]
-        }
+    "通用": {
+        "教材": [
+            {
+                "书名": "{course_name}导论",
+                "作者": "多位专家",
+                "出版社": "高等教育出版社",
+                "备注": "{course_name}领域入门教材"
+            }
+        ],
+        "在线视频": [
+            {
+                "视频标题": "{course_name}教学视频",
+                "发布平台": "B站搜索",
+                "主讲人/机构": "多个来源",
+                "链接": "https://search.bilibili.com/all?keyword={course_name}+教学视频"
+            },
+            {
+                "视频标题": "{course_name}学习资源",
+                "发布平台": "百度搜索",
+                "主讲人/机构": "多个来源",
+                "链接": "https://www.baidu.com/s?wd={course_name}+学习+视频"
+            }
+        ],
+        "工具/软件": [
+            {
+                "工具名称": "相关专业软件",
+                "类型": "专业工具",
+                "用途": "{course_name}领域专业应用"
+            }
+        ],
+        "案例研究": [
+            {
+                "案例名称": "{course_name}应用案例",
+                "领域": "实践应用",
+                "描述": "{course_name}在实际中的应用分析"
+            }
+        ]
+    }
+}
+
+# 关键词 -> 课程类别；课程名同时命中多个类别时按 _MOCK_RESOURCE_CATEGORY_ORDER 取第一个
+_MOCK_RESOURCE_KEYWORDS = {
+    "金融": "金融", "经济": "金融", "货币": "金融", "银行": "金融", "投资": "金融",
+    "python": "编程", "编程": "编程", "计算机": "编程"
+}
+_MOCK_RESOURCE_CATEGORY_ORDER = ["金融", "编程"]
+_MOCK_RESOURCE_KEYWORD_RE = re.compile("|".join(re.escape(keyword) for keyword in _MOCK_RESOURCE_KEYWORDS))
+
+def _mock_resource_category(course_name):
+    """用一次正则扫描找出课程名命中的资源类别"""
+    matched = {_MOCK_RESOURCE_KEYWORDS[keyword] for keyword in _MOCK_RESOURCE_KEYWORD_RE.findall(course_name.lower())}
+    for category in _MOCK_RESOURCE_CATEGORY_ORDER:
+        if category in matched:
+            return category
+    return "通用"
+
+@lru_cache(maxsize=256)
+def _mock_resources_for_course(course_name):
+    """按课程名生成一次备用资源并缓存，之后的查询只是字典查找"""
+    template = _MOCK_RESOURCE_TEMPLATES[_mock_resource_category(course_name)]
+    return {
+        key: tuple({field: value.replace("{course_name}", course_name) for field, value in item.items()} for item in items)
+        for key, items in template.items()
+    }
+
+def get_mock_resources(course_name, key):
+    """返回某一类别的备用资源（列表副本，调用方可随意修改）"""
+    return [dict(item) for item in _mock_resources_for_course(course_name).get(key, ())]
+
+def recommend_mock_resources(course_name, education_stage="小学"):
+    """推荐模拟教学资源（标准化格式版本）"""
+    log.info("使用备用方案生成教学资源: %s", course_name)
+    return {key: get_mock_resources(course_name, key) for key in _mock_resources_for_course(course_name)}
 
 # 新增函数：根据用户反馈更新讲义内容
+_LECTURE_HEADING_RE = re.compile(r'^(#{1,3})\s+(.+?)\s*#*\s*$')
+_SECTION_TITLE_SPLIT_RE = re.compile(r'[：:]')
+
+def parse_lecture_sections(content):
+    """把Markdown讲义按 #/##/### 标题切分成小节
+    
+    返回按出现顺序排列的列表，每项包含 level、title、start、end；
+    [start, end) 覆盖标题行及其下属的所有子小节，代码块中的 # 不视为标题。
+    """
+    sections = []
+    offset = 0
+    in_code_block = False
+    for line in content.splitlines(keepends=True):
+        stripped = line.strip()
+        if stripped.startswith("```"):
+            in_code_block = not in_code_block
+        elif not in_code_block:
+            match = _LECTURE_HEADING_RE.match(stripped)
+            if match:
+                sections.append({
+                    "level": len(match.group(1)),
+                    "title": match.group(2).strip(),
+                    "start": offset,
+                    "end": len(content),
+                })
+        offset += len(line)
+    
+    # 每个小节结束于下一个同级或更高级标题
+    for index, section in enumerate(sections):
+        for following in sections[index + 1:]:
+            if following["level"] <= section["level"]:
+                section["end"] = following["start"]
+                break
+    return sections
+
+def _section_contains(outer, inner):
+    return outer is not inner and outer["start"] <= inner["start"] and inner["end"] <= outer["end"]
+
+def find_target_sections(sections, user_input):
+    """找出用户要求中点名的小节
+    
+    标题全文或冒号前的部分（如"第二部分"）出现在要求里即视为点名，一级标题（讲义名）不参与匹配。
+    同时点名了父小节和其中的子小节时（如"第二部分的例题"），只取该父小节下的子小节。
+    """
+    matched = []
+    for section in sections:
+        if section["level"] == 1:
+            continue
+        title = section["title"]
+        keys = {title, _SECTION_TITLE_SPLIT_RE.split(title, 1)[0].strip()}
+        if any(len(key) >= 2 and key in user_input for key in keys):
+            matched.append(section)
+    
+    qualified = [s for s in matched if any(_section_contains(other, s) for other in matched)]
+    targets = qualified or matched
+    # 只保留最具体的小节，避免父子小节被重复修改
+    return [s for s in targets if not any(_section_contains(s, other) for other in targets)]
+
+def _format_lecture_outline(sections, target):
+    lines = []
+    for section in sections:
+        marker = " 【待修改】" if section is target else ""
+        lines.append(f"{'  ' * (section['level'] - 1)}- {section['title']}{marker}")
+    return "\n".join(lines)
+
+def _normalize_section_response(response, section, original_text):
+    """去掉模型可能包裹的代码块标记，缺少标题行时补回原标题"""
+    text = response.strip()
+    if text.startswith("```"):
+        text = re.sub(r'^```[a-zA-Z]*\n?', '', text)
+        text = re.sub(r'\n?```$', '', text).strip()
+    if not _LECTURE_HEADING_RE.match(text.split("\n", 1)[0].strip()):
+        heading = original_text.split("\n", 1)[0].rstrip("\r")
+        text = f"{heading}\n{text}"
+    return text
+
+async def _update_lecture_sections(current_content, sections, targets, user_input, conversation_history,
+                                   education_stage, generation_language, policy_section, guidance):
+    """只重写被点名的小节并拼接回原讲义，多个小节并发修改"""
+    from prompts import PROMPT_UPDATE_SECTION
+    
+    async def revise(section):
+        original_text = current_content[section["start"]:section["end"]]
+        
+        def render(formatted_history):
+            return PROMPT_UPDATE_SECTION.format(
+                education_stage=education_stage,
+                generation_language=generation_language,
+                lecture_outline=_format_lecture_outline(sections, section),
+                section_content=original_text,
+                policy_requirements=policy_section,
+                conversation_history=formatted_history,
+                user_input=user_input,
+                education_stage_guidance=guidance
+            )
+        
+        with metrics.span("prompt_build"):
+            fixed_tokens = estimate_tokens(render(""))
+            history_budget = max(0, min(HISTORY_TOKEN_BUDGET, PROMPT_TOKEN_BUDGET - fixed_tokens))
+            formatted_history = fit_conversation_history(conversation_history, history_budget, latest_user_input=user_input)
+            prompt = render(formatted_history)
+        response = await call_deepseek_async(prompt, priority=PRIORITY_INTERACTIVE)
+        if isinstance(response, dict):
+            return response
+        return _normalize_section_response(response, section, original_text)
+    
+    # 各小节作为子任务并发修改，子任务继承当前操作，耗时仍记到发起修改的操作上
+    revised = await asyncio.gather(*(revise(section) for section in targets))
+    
+    for result in revised:
+        if isinstance(result, dict) and "error" in result:
+            return result
+    
+    # 从后往前拼接，前面小节的偏移量不受影响
+    updated = current_content
+    for section, text in sorted(zip(targets, revised), key=lambda item: item[0]["start"], reverse=True):
+        separator = "\n\n" if section["end"] < len(updated) else "\n"
+        updated = updated[:section["start"]] + text + separator + updated[section["end"]:]
+    return updated
+
 def update_lecture_content(current_content, user_input, conversation_history, education_stage="小学", generation_language="中文", policy_requirements=""):
-    """根据用户反馈更新讲义内容"""
+    """根据用户反馈更新讲义内容（同步接口）"""
+    return run_sync(update_lecture_content_async(current_content, user_input, conversation_history,
+                                                 education_stage, generation_language, policy_requirements))
+
+@metrics.traced("lecture_revision")
+async def update_lecture_content_async(current_content, user_input, conversation_history, education_stage="小学", generation_language="中文", policy_requirements=""):
+    """根据用户反馈更新讲义内容
+    
+    要求中点名了具体小节时只重写这些小节，否则整篇修改。
+    """
     try:
         from prompts import PROMPT_UPDATE_LECTURE, EDUCATION_STAGE_GUIDANCE
     except ImportError:
-        print("警告：PROMPT_UPDATE_LECTURE 未定义，使用备用方案")
+        log.warning("PROMPT_UPDATE_LECTURE 未定义，使用备用方案")
         return update_lecture_with_mock(current_content, user_input)
     
-    # 格式化对话历史
-    formatted_history = ""
-    for role, message in conversation_history:
-        formatted_history += f"{role}: {message}\n"
-    
     guidance = EDUCATION_STAGE_GUIDANCE.get(education_stage, "")
     
     # 构建政策要求部分
@@ -733,21 +2193,42 @@ def update_lecture_content(current_content, user_input, conversation_history, ed
 {policy_requirements}
 """
     
-    prompt = PROMPT_UPDATE_LECTURE.format(
-        education_stage=education_stage,
-        current_content=current_content,
-        conversation_history=formatted_history,
-        user_input=user_input,
-        education_stage_guidance=guidance,
-        generation_language=generation_language,
-        policy_requirements=policy_section  # 新增政策要求
-    )
+    if SECTION_REVISION_ENABLED:
+        sections = parse_lecture_sections(current_content)
+        targets = find_target_sections(sections, user_input)
+        target_size = sum(s["end"] - s["start"] for s in targets)
+        if targets and target_size <= len(current_content) * SECTION_REVISION_MAX_RATIO:
+            log.info("按小节修改讲义: %s", ", ".join(s["title"] for s in targets))
+            return await _update_lecture_sections(current_content, sections, targets, user_input, conversation_history,
+                                                  education_stage, generation_language, policy_section, guidance)
     
-    response = call_deepseek(prompt)
+    def render(formatted_history):
+        return PROMPT_UPDATE_LECTURE.format(
+            education_stage=education_stage,
+            current_content=current_content,
+            conversation_history=formatted_history,
+            user_input=user_input,
+            education_stage_guidance=guidance,
+            generation_language=generation_language,
+            policy_requirements=policy_section  # 新增政策要求
+        )
+    
+    # 讲义、政策和最新要求必须完整保留，对话历史只使用剩余的token预算
+    with metrics.span("prompt_build"):
+        fixed_tokens = estimate_tokens(render(""))
+        history_budget = max(0, min(HISTORY_TOKEN_BUDGET, PROMPT_TOKEN_BUDGET - fixed_tokens))
+        if fixed_tokens > PROMPT_TOKEN_BUDGET:
+            log.warning("讲义修改提示词约%d tokens，已超过预算%d，对话历史将被省略", fixed_tokens, PROMPT_TOKEN_BUDGET)
+        formatted_history = fit_conversation_history(conversation_history, history_budget, latest_user_input=user_input)
+        prompt = render(formatted_history)
+    
+    # 教师正在等待的交互式修改，优先于批量生成发出
+    response = await call_deepseek_async(prompt, priority=PRIORITY_INTERACTIVE)
     return response
+
 def update_lecture_with_mock(current_content, user_input):
     """使用备用方案更新讲义内容"""
-    print(f"使用备用方案更新讲义，用户输入: {user_input}")
+    log.info("使用备用方案更新讲义，用户输入: %s", truncate(user_input))
     
     # 简单地在现有内容基础上添加用户要求的注释
     updated_content = f"{current_content}\n\n---\n\n## 根据用户反馈更新\n\n**用户要求:** {user_input}\n\n**更新说明:** 已根据用户反馈对讲义内容进行相应调整和优化。"
@@ -772,13 +2253,13 @@ def save_survey_result(survey_data):
         with open("survey_results.json", "w", encoding="utf-8") as f:
             json.dump(data, f, ensure_ascii=False, indent=2)
             
-        print(f"调查结果已保存到 survey_results.json，当前共有 {len(data)} 条记录")
+        log.info("调查结果已保存到 survey_results.json，当前共有 %d 条记录", len(data))
         return True
             
     except Exception as e:
-        print(f"保存调查结果时出错: {e}")
+        log.error("保存调查结果时出错: %s", e)
         # 如果出错，至少打印出来
-        print(f"调查数据: {survey_data}")
+        log.error("调查数据: %s", json.dumps(survey_data, ensure_ascii=False, default=str))
         return False
 
 def load_survey_results():
@@ -790,7 +2271,7 @@ def load_survey_results():
     except FileNotFoundError:
         return []
     except Exception as e:
-        print(f"加载调查结果时出错: {e}")
+        log.warning("加载调查结果时出错: %s", e)
         return []
     
 # 模拟数据函数（作为备用方案）
@@ -948,28 +2429,158 @@ def generate_mock_lecture_content(chapter_name, key_points, hours, education_sta
 - 积极参与课堂讨论和实践
 """
     
+# PPT模板缓存
+class PptTemplateRegistry:
+    """PPT模板缓存：缓存模板文件的字节和解析结果，导出时拿到一份独立的 Presentation
+
+    深拷贝已解析的对象树是否比重新解析 .pptx 快，取决于模板内容和运行环境，有的模板两者相差无几，
+    甚至复制更慢。因此加载模板时各计时几次，只有复制明显更快（见 PPT_TEMPLATE_COPY_MAX_RATIO）
+    的模板才用复制，其余每次从缓存的字节重新解析（同样省去读盘）。
+    文件修改时间变化后重新加载；深拷贝失败时退回重新解析。
+    """
+
+    def __init__(self, template_dir=PPT_TEMPLATE_DIR):
+        self.template_dir = template_dir
+        self._entries = {}  # 模板路径（None 为python-pptx默认模板）-> 缓存项
+        self._lock = threading.Lock()
+        self._stats = {"loads": 0, "reloads": 0, "hits": 0, "copies": 0, "parses": 0, "copy_fallbacks": 0}
+        self._preload_started = False
+
+    def list_templates(self):
+        """模板目录下的全部 .pptx 文件路径（按文件名排序）"""
+        if not os.path.isdir(self.template_dir):
+            return []
+        return sorted(
+            os.path.join(self.template_dir, name) for name in os.listdir(self.template_dir)
+            if name.lower().endswith(".pptx") and not name.startswith("~$")
+        )
+
+    def preload(self):
+        """解析模板目录下的全部模板，返回成功加载的数量"""
+        loaded = 0
+        for path in [None] + self.list_templates():
+            try:
+                self._entry(path)
+                loaded += 1
+            except Exception as e:
+                log.warning("预加载PPT模板失败 %s: %s", path, e)
+        return loaded
+
+    def preload_in_background(self):
+        """在后台线程中预加载全部模板（每个进程只执行一次），不阻塞页面运行"""
+        if multiprocessing.parent_process() is not None:
+            # 导出工作进程只用到一个模板，按需解析即可
+            return
+        with self._lock:
+            if self._preload_started:
+                return
+            self._preload_started = True
+        threading.Thread(target=self.preload, name="ppt-template-preload", daemon=True).start()
+
+    def _entry(self, path):
+        """返回模板的缓存项，首次使用或文件修改后重新解析"""
+        mtime = os.path.getmtime(path) if path else None
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry["mtime"] == mtime:
+                self._stats["hits"] += 1
+                return entry
+            # 解析在锁内进行，并发导出时同一模板不会被重复解析
+            entry = {"mtime": mtime, "lock": threading.Lock(), "data": None, "presentation": None, "use_copy": False}
+            if path:
+                with open(path, "rb") as f:
+                    entry["data"] = f.read()
+            entry["presentation"] = self._parse(entry)
+            parse_seconds, copy_seconds = self._calibrate(entry)
+            entry["use_copy"] = copy_seconds is not None and copy_seconds <= parse_seconds * PPT_TEMPLATE_COPY_MAX_RATIO
+            self._stats["reloads" if path in self._entries else "loads"] += 1
+            self._entries[path] = entry
+        log.info("已解析PPT模板 %s", path or "（默认）",
+                 extra=log_fields(parse_ms=round(parse_seconds * 1000, 2),
+                                  copy_ms=None if copy_seconds is None else round(copy_seconds * 1000, 2),
+                                  use_copy=entry["use_copy"]))
+        return entry
+
+    @staticmethod
+    def _parse(entry):
+        if entry["data"] is None:
+            return Presentation()
+        return Presentation(io.BytesIO(entry["data"]))
+
+    def _calibrate(self, entry, rounds=3):
+        """分别计时重新解析和深拷贝，各取最快的一次，返回 (解析秒数, 复制秒数)；无法复制时复制秒数为None"""
+        def best_of(fn):
+            best = None
+            for _ in range(rounds):
+                start = time.perf_counter()
+                fn()
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            return best
+
+        parse_seconds = best_of(lambda: self._parse(entry))
+        try:
+            copy_seconds = best_of(lambda: copy.deepcopy(entry["presentation"]))
+        except Exception as e:
+            log.warning("PPT模板无法复制，导出时改为重新解析: %s", e)
+            copy_seconds = None
+        return parse_seconds, copy_seconds
+
+    def get(self, path=None):
+        """返回模板的一份独立副本，可直接添加幻灯片并保存；path 为空或文件不存在时使用默认模板"""
+        if path and not os.path.exists(path):
+            path = None
+        entry = self._entry(path)
+        if entry["use_copy"]:
+            # 复制时只读缓存的对象树，同一模板的复制加锁，避免多个线程同时遍历同一棵lxml树
+            with entry["lock"]:
+                try:
+                    presentation = copy.deepcopy(entry["presentation"])
+                except Exception as e:
+                    log.warning("复制PPT模板失败，改为重新解析 %s: %s", path, e)
+                    presentation = None
+            with self._lock:
+                self._stats["copies" if presentation is not None else "copy_fallbacks"] += 1
+            if presentation is not None:
+                return presentation
+        else:
+            with self._lock:
+                self._stats["parses"] += 1
+        return self._parse(entry)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["templates"] = len(self._entries)
+            stats["copied_templates"] = sum(1 for entry in self._entries.values() if entry["use_copy"])
+            return stats
+
+_ppt_templates = None
+_ppt_templates_lock = threading.Lock()
+
+def get_ppt_templates():
+    """获取进程级共享的PPT模板缓存"""
+    global _ppt_templates
+    if _ppt_templates is None:
+        with _ppt_templates_lock:
+            if _ppt_templates is None:
+                _ppt_templates = PptTemplateRegistry()
+    return _ppt_templates
+
+def get_ppt_template_stats():
+    return get_ppt_templates().stats()
+
 # PPT生成函数
 def generate_ppt_document(content, filename="lecture.pptx", template_path=None):
     """将Markdown内容转换为格式规范的PPT文档，使用指定模板，支持自动分页"""
     try:
-        from pptx import Presentation
-        from pptx.util import Inches, Pt
-        from pptx.enum.text import PP_ALIGN
-        from pptx.dml.color import RGBColor
-        import re
-        
-        # 创建演示文稿，使用模板如果提供
-        if template_path and os.path.exists(template_path):
-            prs = Presentation(template_path)
-            # 使用模板时，使用标题和内容布局
-            slide_layout = prs.slide_layouts[1]
-        else:
-            prs = Presentation()
-            # 设置默认幻灯片布局 - 标题和内容
-            slide_layout = prs.slide_layouts[1]
+        # 创建演示文稿：使用模板缓存的副本，未指定模板时使用默认模板
+        prs = get_ppt_templates().get(template_path)
+        # 使用标题和内容布局
+        slide_layout = prs.slide_layouts[1]
         
         # 检测内容语言
-        is_english = any(char in 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ' for char in content)
+        is_english = _contains_latin(content)
         
         # 设置字体
         if is_english:
@@ -979,69 +2590,72 @@ def generate_ppt_document(content, filename="lecture.pptx", template_path=None):
             title_font_name = '黑体'
             content_font_name = '微软雅黑'
         
-        # 分割内容为行
-        lines = content.split('\n')
+        blocks = parse_markdown(content)
         
         # 当前幻灯片和内容
         current_slide = None
         current_content = []
-        current_line_count = 0
-        MAX_LINES_PER_SLIDE = 12  # 每页最多12行内容
         
-        # 分页规则：遇到这些关键词时创建新幻灯片
-        page_break_keywords = [
-            r'^# ',  # 一级标题
-            r'^## ',  # 二级标题
-            r'^### ',  # 三级标题
-            r'^#### ',  # 四级标题
-        ]
+        # 按内容占位符（没有时为备用文本框）的尺寸和正文字号计算折行与分页
+        content_size = PptPt(PPT_CONTENT_FONT_SIZE)
+        body_placeholder = next((ph for ph in slide_layout.placeholders if ph.placeholder_format.idx == 1), None)
+        if body_placeholder is not None and body_placeholder.width and body_placeholder.height:
+            text_layout = get_text_layout(body_placeholder.width, body_placeholder.height, content_size)
+        else:
+            text_layout = get_text_layout(PptInches(9), PptInches(5.5), content_size, 0)
+        
+        # 分页规则：一到四级标题开始新的幻灯片
+        PAGE_BREAK_LEVEL = 4
+
+        def flush_content():
+            """把当前内容排入当前幻灯片，放不下的部分依次放到续页"""
+            nonlocal current_slide, current_content
+            lines = [line for line in current_content if line]
+            current_content = []
+            if not lines:
+                return
+            if current_slide is None:
+                # 讲义开头没有标题时，内容放到无标题的幻灯片上
+                current_slide = add_slide()
+            pages = text_layout.paginate(lines)
+            add_content_to_slide(current_slide, pages[0])
+            for page in pages[1:]:
+                add_content_to_slide(add_slide("Continued" if is_english else "（续）"), page)
 
         def create_new_slide(title_text=None):
+            """保存当前幻灯片的内容，然后创建新幻灯片并设置标题"""
+            nonlocal current_slide
+            flush_content()
+            current_slide = add_slide(title_text)
+            return current_slide
+
+        def add_slide(title_text=None):
             """创建新幻灯片并设置标题"""
-            nonlocal current_slide, current_content, current_line_count
-            
-            # 保存当前幻灯片内容（如果有的话）
-            if current_slide is not None and current_content:
-                add_content_to_slide(current_slide, current_content)
-            
-            # 创建新幻灯片
-            current_slide = prs.slides.add_slide(slide_layout)
+            slide = prs.slides.add_slide(slide_layout)
             
             # 设置标题
             if title_text:
-                title_box = current_slide.shapes.title
+                title_box = slide.shapes.title
                 if title_box is not None:
-                    title_box.text = clean_title_text(title_text)
+                    title_box.text = title_text
                     # 设置标题字体
                     for paragraph in title_box.text_frame.paragraphs:
                         paragraph.alignment = PP_ALIGN.CENTER
                         for run in paragraph.runs:
-                            run.font.size = Pt(28 if len(title_text) < 20 else 24)
+                            run.font.size = PptPt(28 if len(title_text) < 20 else 24)
                             run.font.bold = True
                             run.font.name = title_font_name
                             run.font.color.rgb = RGBColor(0, 0, 0)
             
-            # 重置内容
-            current_content = []
-            current_line_count = 0
-            
-            return current_slide
-
-        def clean_title_text(text):
-            """清理标题文本，移除Markdown标记"""
-            # 移除Markdown标题标记
-            cleaned = re.sub(r'^#+\s*', '', text)
-            # 移除粗体标记
-            cleaned = re.sub(r'\*\*(.*?)\*\*', r'\1', cleaned)
-            return cleaned.strip()
+            return slide
 
         def add_content_to_slide(slide, content_lines):
             """将内容添加到幻灯片"""
             if not content_lines:
                 return
             
-            # 过滤空行并清理内容
-            filtered_lines = [clean_content_text(line) for line in content_lines if line.strip()]
+            # 过滤空行（内容行已在解析时去掉Markdown标记）
+            filtered_lines = [line for line in content_lines if line]
             if not filtered_lines:
                 return
                 
@@ -1064,15 +2678,15 @@ def generate_ppt_document(content, filename="lecture.pptx", template_path=None):
                 for paragraph in tf.paragraphs:
                     paragraph.alignment = PP_ALIGN.LEFT
                     for run in paragraph.runs:
-                        run.font.size = Pt(18)
+                        run.font.size = content_size
                         run.font.name = content_font_name
                         run.font.color.rgb = RGBColor(0, 0, 0)
             else:
                 # 如果没有内容占位符，创建一个文本框
-                left = Inches(0.5)
-                top = Inches(1.5)
-                width = Inches(9)
-                height = Inches(5.5)
+                left = PptInches(0.5)
+                top = PptInches(1.5)
+                width = PptInches(9)
+                height = PptInches(5.5)
                 textbox = slide.shapes.add_textbox(left, top, width, height)
                 tf = textbox.text_frame
                 tf.text = content_text
@@ -1082,85 +2696,40 @@ def generate_ppt_document(content, filename="lecture.pptx", template_path=None):
                 for paragraph in tf.paragraphs:
                     paragraph.alignment = PP_ALIGN.LEFT
                     for run in paragraph.runs:
-                        run.font.size = Pt(18)
+                        run.font.size = content_size
                         run.font.name = content_font_name
                         run.font.color.rgb = RGBColor(0, 0, 0)
 
-        def clean_content_text(text):
-            """清理内容文本"""
-            # 移除Markdown标记但保留文本内容
-            cleaned = re.sub(r'^[*-]\s*', '', text)  # 移除列表标记
-            cleaned = re.sub(r'\*\*(.*?)\*\*', r'\1', cleaned)  # 移除粗体但保留文本
-            cleaned = re.sub(r'`(.*?)`', r'\1', cleaned)  # 移除代码标记但保留文本
-            return cleaned.strip()
-
-        def check_and_split_content(line):
-            """检查内容是否需要分页，如果需要则创建新幻灯片"""
-            nonlocal current_line_count, current_slide
-            
-            # 空行不计入行数限制
-            if not line.strip():
-                return False
-                
-            # 估算行长度（考虑换行）
-            line_length = len(line)
-            line_count_estimate = max(1, line_length // 50)  # 每行大约50字符
-            
-            current_line_count += line_count_estimate
-            
-            # 如果超过行数限制，创建新幻灯片
-            if current_line_count >= MAX_LINES_PER_SLIDE:
-                # 保存当前内容
-                if current_slide is not None and current_content:
-                    add_content_to_slide(current_slide, current_content)
-                
-                # 创建新幻灯片（续页）
-                create_new_slide("Continued" if is_english else "（续）")
-                
-                # 将当前行添加到新幻灯片
-                current_content.append(line)
-                current_line_count = line_count_estimate  # 重置计数
-                return True
-                
-            return False
+        def slide_lines(block):
+            """块在幻灯片中显示的文本行"""
+            kind = block.kind
+            if kind == "code":
+                return list(block.lines)
+            if kind == "table":
+                return [" | ".join(cells) for cells in block.rows]
+            if kind == "numbered":
+                return [f"{block.number}. {block.text}"]
+            return [block.text]
 
-        # 首先创建封面幻灯片
-        if lines and lines[0].strip():
-            first_line = lines[0].strip()
-            title_text = clean_title_text(first_line)
-            create_new_slide(title_text)
+        # 首先创建封面幻灯片：第一行非空时作为封面标题
+        if blocks and blocks[0].lineno == 0 and blocks[0].kind not in ("blank", "code", "table"):
+            create_new_slide(blocks[0].text)
+            blocks = blocks[1:]
         
-        # 处理每一行（跳过第一行，因为已经在封面使用了）
-        for i, line in enumerate(lines):
-            if i == 0:  # 跳过封面标题行
-                continue
-                
-            line = line.strip()
-            if not line:
-                # 空行也添加到内容中，但不触发分页检查
-                current_content.append("")
+        # 处理其余各块
+        for block in blocks:
+            if block.kind == "blank":
                 continue
-                
-            # 检查是否需要分页（基于标题）
-            need_break = any(re.search(pattern, line) for pattern in page_break_keywords)
             
-            # 如果需要分页或者当前没有幻灯片，创建新幻灯片
-            if need_break:
-                # 创建新幻灯片
-                slide_title = clean_title_text(line)
-                create_new_slide(slide_title)
-            else:
-                # 检查是否需要基于内容长度分页
-                if check_and_split_content(line):
-                    continue  # 已经在新幻灯片中处理了这一行
+            # 标题开始新的幻灯片
+            if block.kind == "heading" and block.level <= PAGE_BREAK_LEVEL:
+                create_new_slide(block.text)
+                continue
             
-            # 添加到当前内容（如果不是标题行）
-            if not need_break:
-                current_content.append(line)
+            current_content.extend(slide_lines(block))
         
         # 处理最后一页内容
-        if current_slide is not None and current_content:
-            add_content_to_slide(current_slide, current_content)
+        flush_content()
         
         # 如果没有创建任何幻灯片，创建一个默认幻灯片
         if len(prs.slides) == 0:
@@ -1175,9 +2744,7 @@ def generate_ppt_document(content, filename="lecture.pptx", template_path=None):
         return file_stream, filename
         
     except Exception as e:
-        print(f"生成PPT文档时出错: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception("生成PPT文档时出错: %s", e)
         return None, None
     
 # 添加保存PPT文档的函数